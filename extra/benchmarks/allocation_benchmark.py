@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# extra/benchmarks/allocation_benchmark.py
+#
+# Copyright (C) 2018 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Compares memory that is allocated while data is passed through the archive writer chain (counter, hash and
+optional encryption links) by the previous read()-based loop and by the current readinto()-based one.
+
+Allocated memory is measured with tracemalloc as a sum of peak allocations of every write call, so it is a lower
+bound of the really allocated memory.
+
+Usage: allocation_benchmark.py [total_size_in_mib] (wasp_backup package must be importable)
+"""
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+from wasp_general.io import WWriterChainLink, WAESWriter
+
+from wasp_backup.cipher import WBackupCipher
+from wasp_backup.file_archiver import WFileArchiveCreator
+from wasp_backup.io import WArchiverWriterChain, WArchiverDataCounter, WArchiverHashCalculationWriter
+from wasp_backup.io import WArchiverAESCipher
+
+
+class TracedWriter:
+
+	def __init__(self, chain):
+		self.__chain = chain
+		self.allocated = 0
+
+	def write(self, b):
+		current, peak = tracemalloc.get_traced_memory()
+		tracemalloc.reset_peak()
+		self.__chain.write(b)
+		self.allocated += tracemalloc.get_traced_memory()[1] - current
+		return len(b)
+
+
+class PreviousAESWriter(WAESWriter):
+
+	def __init__(self, raw, cipher):
+		WAESWriter.__init__(self, raw, cipher.aes_cipher())
+
+
+def previous_copy_data(source, target, buffer_size):
+	read_buffer = source.read(buffer_size)
+	while len(read_buffer) > 0:
+		target.write(read_buffer)
+		read_buffer = source.read(buffer_size)
+
+
+def run(copy_fn, buffer_size, aes_cls, source_data):
+	links = [WWriterChainLink(WArchiverDataCounter), WWriterChainLink(WArchiverHashCalculationWriter)]
+	if aes_cls is not None:
+		links.append(WWriterChainLink(aes_cls, WBackupCipher('AES-256-CBC', 'benchmark-password-benchmark')))
+	chain = WArchiverWriterChain(open(os.devnull, 'wb'), *links)
+
+	source = io.BytesIO(source_data)
+	target = TracedWriter(chain)
+	tracemalloc.start()
+	started_at = time.perf_counter()
+	copy_fn(source, target, buffer_size)
+	chain.flush()
+	duration = time.perf_counter() - started_at
+	tracemalloc.stop()
+	chain.close()
+	return target.allocated, duration
+
+
+if __name__ == '__main__':
+	if hasattr(tracemalloc, 'reset_peak') is False:
+		print('Python 3.9+ is required')
+		sys.exit(1)
+
+	total_size = (int(sys.argv[1]) if len(sys.argv) > 1 else 64) * 1024 * 1024
+	source_data = os.urandom(total_size)
+	gib_fraction = total_size / (1024 ** 3)
+
+	cases = [
+		('previous', previous_copy_data, io.DEFAULT_BUFFER_SIZE, None),
+		('current', WFileArchiveCreator.copy_data, WFileArchiveCreator.__default_buffer_size__, None),
+		('previous+aes', previous_copy_data, io.DEFAULT_BUFFER_SIZE, PreviousAESWriter),
+		('current+aes', WFileArchiveCreator.copy_data, WFileArchiveCreator.__default_buffer_size__, WArchiverAESCipher)
+	]
+
+	print('Archiving %i MiB (tracemalloc slows down both cases)' % (total_size // (1024 * 1024)))
+	for name, copy_fn, buffer_size, aes_cls in cases:
+		allocated, duration = run(copy_fn, buffer_size, aes_cls, source_data)
+		print('%-14s %12.1f MiB allocated per GiB %10.1f MiB/s' % (
+			name, allocated / gib_fraction / (1024 * 1024), total_size / duration / (1024 * 1024)
+		))
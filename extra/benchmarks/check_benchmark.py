@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# extra/benchmarks/check_benchmark.py
+#
+# Copyright (C) 2018 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Reports peak RSS and throughput of archive integrity checks. Archives of the specified size are created
+(data is generated by a program, so only the space for archives is required) and every archive is checked in its
+own process by the previous reader chain based loop (for archives without chunked hashing) and by the current
+readinto() based one. For the 50 GiB case run "check_benchmark.py 50" (the target directory must have enough free
+space for a single archive).
+
+Usage: check_benchmark.py [archive_size_in_gib [read_size_in_kib [directory]]] (wasp_backup package must be
+importable)
+"""
+
+import os
+import sys
+import time
+import logging
+import resource
+import tempfile
+import multiprocessing
+
+from wasp_general.io import WReaderChainLink, WDiscardReaderResult
+
+from wasp_backup.core import WBackupMeta
+from wasp_backup.popen_archiver import WPopenArchiveCreator
+from wasp_backup.archiver import WArchiveIntegrityChecker
+from wasp_backup.io import WExtractorReaderChain, WArchiverCompression, WArchiverHashCalculationReader
+from wasp_backup.io import WArchiverThrottlingReader
+
+
+__generator_program__ = \
+	'import os, sys; b = os.urandom(1024 * 1024); ' \
+	'[sys.stdout.buffer.write(b) for _ in range(%i)]'
+
+__hash_chunk_size__ = 64 * 1024 * 1024
+
+__cases__ = [  # name, compression mode, hash chunk size
+	('plain', None, None),
+	('gzip', WBackupMeta.Archive.CompressionMode.gzip, None),
+	('plain+chunks', None, __hash_chunk_size__),
+	('gzip+chunks', WBackupMeta.Archive.CompressionMode.gzip, __hash_chunk_size__)
+]
+
+
+def peak_rss():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss is in KiB on Linux
+
+
+def previous_check(archive_path, read_size):
+	checker = WArchiveIntegrityChecker(archive_path, logging.getLogger())
+	meta = checker.read_meta()
+	chain = [checker.open_inside_file(meta[WBackupMeta.Archive.MetaOptions.inside_filename.value])]
+	compression_mode = meta.get(WBackupMeta.Archive.MetaOptions.compression_mode.value)
+	if compression_mode is not None:
+		chain.append(WReaderChainLink(
+			WArchiverCompression.reader_cls(WBackupMeta.Archive.CompressionMode(compression_mode))
+		))
+	chain.extend([
+		WReaderChainLink(
+			WArchiverHashCalculationReader, meta[WBackupMeta.Archive.MetaOptions.hash_algorithm.value]
+		),
+		WReaderChainLink(WArchiverThrottlingReader),
+		WReaderChainLink(WDiscardReaderResult)
+	])
+	reader_chain = WExtractorReaderChain(*chain)
+	reader_chain.read()
+	calculated_hash = reader_chain.instance(WArchiverHashCalculationReader).hexdigest()
+	reader_chain.close()
+	return calculated_hash == meta[WBackupMeta.Archive.MetaOptions.hash_value.value].upper()
+
+
+def current_check(archive_path, read_size):
+	checker = WArchiveIntegrityChecker(archive_path, logging.getLogger(), read_size=read_size)
+	return checker.check_archive()[0]
+
+
+def check_in_process(check_fn, archive_path, read_size, result_queue):
+	baseline_rss = peak_rss()
+	started_at = time.perf_counter()
+	result = check_fn(archive_path, read_size)
+	duration = time.perf_counter() - started_at
+	result_queue.put((result, baseline_rss, peak_rss(), duration))
+
+
+def run(check_fn, archive_path, read_size):
+	# every check has its own process, so that peak RSS of a check does not depend on previous ones
+	context = multiprocessing.get_context('spawn')
+	result_queue = context.Queue()
+	process = context.Process(target=check_in_process, args=(check_fn, archive_path, read_size, result_queue))
+	process.start()
+	result = result_queue.get()
+	process.join()
+	return result
+
+
+def create_archive(archive_path, archive_size, compression_mode, hash_chunk_size):
+	program = '%s -c "%s"' % (sys.executable, __generator_program__ % (archive_size // (1024 * 1024)))
+	WPopenArchiveCreator(
+		program, archive_path, logging.getLogger(), compression_mode=compression_mode,
+		compression_level=(1 if compression_mode is not None else None),
+		archive_layout=WBackupMeta.Archive.Layout.encryption_compression, hash_chunk_size=hash_chunk_size
+	).archive()
+
+
+if __name__ == '__main__':
+	archive_size = (int(sys.argv[1]) if len(sys.argv) > 1 else 1) * 1024 * 1024 * 1024
+	read_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 1024) * 1024
+	directory = sys.argv[3] if len(sys.argv) > 3 else None
+	mib = 1024 * 1024
+
+	print('Checking %i MiB archives with %i KiB reads' % (archive_size // mib, read_size // 1024))
+	with tempfile.TemporaryDirectory(dir=directory) as temp_directory:
+		for name, compression_mode, hash_chunk_size in __cases__:
+			archive_path = os.path.join(temp_directory, 'archive.tar')
+			create_archive(archive_path, archive_size, compression_mode, hash_chunk_size)
+
+			checks = [('current', current_check)]
+			if hash_chunk_size is None:
+				checks.insert(0, ('previous', previous_check))
+			for check_name, check_fn in checks:
+				result, baseline_rss, rss, duration = run(check_fn, archive_path, read_size)
+				print('%-14s %-10s %-6s peak RSS %8.1f MiB (+%.1f MiB) %10.1f MiB/s' % (
+					name, check_name, 'OK' if result is True else 'FAILED', rss / mib, (rss - baseline_rss) / mib,
+					archive_size / duration / mib
+				))
+			os.unlink(archive_path)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# extra/benchmarks/hash_benchmark.py
+#
+# Copyright (C) 2018 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Reports throughput of every hash algorithm that may be used for archive integrity check on the current machine.
+
+Usage: hash_benchmark.py [total_size_in_mib [chunk_size_in_kib]] (wasp_backup package must be importable)
+"""
+
+import os
+import sys
+import time
+
+from wasp_backup.io import WArchiverHash
+
+
+def benchmark(hash_algorithm, chunk, chunks_count):
+	hash_obj = WArchiverHash.new(hash_algorithm)
+	chunk_view = memoryview(chunk)
+	started_at = time.perf_counter()
+	for i in range(chunks_count):
+		hash_obj.update(chunk_view)
+	hash_obj.hexdigest()
+	return time.perf_counter() - started_at
+
+
+if __name__ == '__main__':
+	total_size = (int(sys.argv[1]) if len(sys.argv) > 1 else 512) * 1024 * 1024
+	chunk_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 1024) * 1024
+	chunks_count = max(total_size // chunk_size, 1)
+	chunk = os.urandom(chunk_size)
+	processed_mib = (chunks_count * chunk_size) / (1024 * 1024)
+
+	print('Hashing %.0f MiB with %i KiB chunks' % (processed_mib, chunk_size // 1024))
+	for algorithm in WArchiverHash.algorithms():
+		duration = benchmark(algorithm, chunk, chunks_count)
+		print('%-10s %10.1f MiB/s' % (algorithm, processed_mib / duration))
+
+	unavailable = set(WArchiverHash.__generators__.keys()).difference(WArchiverHash.algorithms())
+	if len(unavailable) > 0:
+		print('Unavailable: %s' % ', '.join(sorted(unavailable)))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+pytest.importorskip('fastcdc')
+pytest.importorskip('Crypto')
+
+WBackupMeta = pytest.importorskip('wasp_backup.core').WBackupMeta
+WBackupCipher = pytest.importorskip('wasp_backup.cipher').WBackupCipher
+WArchiverRepository = pytest.importorskip('wasp_backup.repository').WArchiverRepository
+
+password = 'repository test password'
+
+
+def chunk_payload(repository, digest):
+	with open(repository.chunk_path(digest), 'rb') as f:
+		return f.read()
+
+
+@pytest.mark.parametrize('compression_mode', [None, WBackupMeta.Archive.CompressionMode.gzip])
+def test_store_load(tmpdir, compression_mode):
+	repository = WArchiverRepository.create(str(tmpdir), compression_mode=compression_mode)
+	data = os.urandom(10000) + bytes(10000)
+	digest, size, stored_size = repository.store_chunk(data)
+	assert(size == len(data))
+	assert(stored_size > 0)
+	assert(repository.store_chunk(data) == (digest, size, 0))
+
+	repository = WArchiverRepository.open(str(tmpdir))
+	assert(repository.load_chunk(digest, size) == data)
+	with pytest.raises(RuntimeError):
+		repository.load_chunk(digest, size + 1)
+
+
+@pytest.mark.parametrize('cipher_name', ['AES-256-CBC', 'AES-128-CTR'])
+def test_encrypted_store_load(tmpdir, cipher_name):
+	repository = WArchiverRepository.create(str(tmpdir), password=password, cipher_name=cipher_name)
+	data = os.urandom(3000)
+	digest, size, stored_size = repository.store_chunk(data)
+	assert(data not in chunk_payload(repository, digest))
+
+	repository = WArchiverRepository.open(str(tmpdir), password=password)
+	assert(repository.load_chunk(digest, size) == data)
+
+	with pytest.raises(ValueError):
+		WArchiverRepository.open(str(tmpdir), password=password[::-1])
+	with pytest.raises(ValueError):
+		WArchiverRepository.open(str(tmpdir))
+
+
+@pytest.mark.parametrize('cipher_name', ['AES-256-CBC', 'AES-128-CTR'])
+def test_chunk_nonce(tmpdir, cipher_name):
+	repository = WArchiverRepository.create(str(tmpdir), password=password, cipher_name=cipher_name)
+	block = b'\x00' * 32
+	first_digest = repository.store_chunk(block + b'\x01' * 32)[0]
+	second_digest = repository.store_chunk(block + b'\x02' * 32)[0]
+
+	# chunks that start with the same data must not share either encrypted prefix or key stream
+	first_chunk = chunk_payload(repository, first_digest)
+	second_chunk = chunk_payload(repository, second_digest)
+	assert(first_chunk[:8] == second_chunk[:8])  # payload sizes
+	assert(first_chunk[8:24] != second_chunk[8:24])  # nonces
+	assert(first_chunk[24:56] != second_chunk[24:56])
+
+	cipher = repository.cipher()
+	assert(first_chunk[24:56] != cipher.aes_cipher().encrypt(block))
+
+
+def test_chunk_key():
+	cipher = WBackupCipher('AES-256-CBC', password)
+	chunk_key = WArchiverRepository.chunk_key(cipher)
+	assert(len(chunk_key) == 32)
+	assert(chunk_key == WArchiverRepository.chunk_key(WBackupCipher('AES-256-CBC', password, salt=cipher.salt())))
+	assert(chunk_key != WArchiverRepository.chunk_key(WBackupCipher('AES-256-CBC', password)))
+
+	# the key must not be a cipher text of the data key
+	key_stream = cipher.aes_cipher().encrypt(b'wasp-backup-repository-chunk-key')
+	assert(chunk_key != key_stream)
+	assert(chunk_key not in cipher.aes_cipher().encrypt(bytes(64)))
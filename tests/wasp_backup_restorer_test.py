@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import stat
+import shutil
+import logging
+import tarfile
+
+import pytest
+
+pytest.importorskip('Crypto')
+
+WBackupMeta = pytest.importorskip('wasp_backup.core').WBackupMeta
+WBackupCipher = pytest.importorskip('wasp_backup.cipher').WBackupCipher
+WInsideTarArchiveCreator = pytest.importorskip('wasp_backup.inside_tar_archiver').WInsideTarArchiveCreator
+WArchiveRestorer = pytest.importorskip('wasp_backup.restorer').WArchiveRestorer
+
+logger = logging.getLogger('wasp_backup_restorer_test')
+
+
+class WSymlinkArchiveCreator(WInsideTarArchiveCreator):
+	# archives symbolic links that are replaced by other members with the same names
+
+	def __init__(self, archive_path, outside_path):
+		WInsideTarArchiveCreator.__init__(self, archive_path, logger)
+		self.__outside_path = outside_path
+
+	def _populate_archive(self, tar_archive):
+		def add_member(name, member_type, mode, linkname='', data=b''):
+			tar_info = tarfile.TarInfo(name)
+			tar_info.type = member_type
+			tar_info.mode = mode
+			tar_info.linkname = linkname
+			tar_info.size = len(data)
+			tar_archive.addfile(tar_info, io.BytesIO(data) if len(data) > 0 else None)
+
+		outside_file = os.path.join(self.__outside_path, 'file')
+		add_member('directory', tarfile.SYMTYPE, 0o777, linkname=self.__outside_path)
+		add_member('directory', tarfile.DIRTYPE, 0o700)
+		add_member('file', tarfile.REGTYPE, 0o600, data=b'data')
+		add_member('file', tarfile.SYMTYPE, 0o777, linkname=outside_file)
+
+
+def test_symlink_replacement(tmpdir):
+	outside_path = str(tmpdir.mkdir('outside'))
+	outside_file = os.path.join(outside_path, 'file')
+	with open(outside_file, 'w') as f:
+		f.write('outside')
+	os.chmod(outside_path, 0o755)
+	os.chmod(outside_file, 0o644)
+
+	archive_path = str(tmpdir.join('archive.tar'))
+	WSymlinkArchiveCreator(archive_path, outside_path).archive()
+
+	target_path = str(tmpdir.join('target'))
+	WArchiveRestorer(archive_path, logger, target_path, same_owner=False).restore()
+
+	restored_directory = os.path.join(target_path, 'directory')
+	assert(os.path.islink(restored_directory) is False)
+	assert(os.path.isdir(restored_directory) is True)
+	assert(stat.S_IMODE(os.stat(restored_directory).st_mode) == 0o700)
+	assert(os.path.islink(os.path.join(target_path, 'file')) is True)
+
+	assert(stat.S_IMODE(os.stat(outside_path).st_mode) == 0o755)
+	assert(stat.S_IMODE(os.stat(outside_file).st_mode) == 0o644)
+
+
+def test_directory_replacement(tmpdir):
+	source_path = str(tmpdir.mkdir('source'))
+	for name in ('link', 'file'):
+		os.makedirs(os.path.join(source_path, name, 'nested'))
+		with open(os.path.join(source_path, name, 'nested', 'data'), 'w') as f:
+			f.write('data')
+	first_archive = str(tmpdir.join('first.tar'))
+	WInsideTarArchiveCreator(first_archive, logger, source_path).archive()
+
+	for name in ('link', 'file'):
+		shutil.rmtree(os.path.join(source_path, name))
+	os.symlink('other', os.path.join(source_path, 'link'))
+	with open(os.path.join(source_path, 'file'), 'w') as f:
+		f.write('file')
+	second_archive = str(tmpdir.join('second.tar'))
+	WInsideTarArchiveCreator(second_archive, logger, source_path).archive()
+
+	target_path = str(tmpdir.join('target'))
+	for archive_path in (first_archive, second_archive):
+		WArchiveRestorer(archive_path, logger, target_path, same_owner=False).restore()
+
+	restored_source = os.path.join(target_path, source_path.lstrip('/'))
+	assert(os.readlink(os.path.join(restored_source, 'link')) == 'other')
+	with open(os.path.join(restored_source, 'file')) as f:
+		assert(f.read() == 'file')
+
+
+def test_wrong_password(tmpdir):
+	source_path = str(tmpdir.mkdir('source'))
+	with open(os.path.join(source_path, 'file'), 'w') as f:
+		f.write('data')
+	archive_path = str(tmpdir.join('archive.tar'))
+	cipher = WBackupCipher('AES-256-CBC', 'restorer test password')
+	WInsideTarArchiveCreator(
+		archive_path, logger, source_path, compression_mode=WBackupMeta.Archive.CompressionMode.gzip, cipher=cipher
+	).archive()
+
+	target_path = str(tmpdir.join('target'))
+	with pytest.raises(RuntimeError, match='password is wrong'):
+		WArchiveRestorer(archive_path, logger, target_path, password='wrong restorer test password').restore()
+	assert(os.path.exists(target_path) is False)
+
+	WArchiveRestorer(archive_path, logger, target_path, password='restorer test password').restore()
+	with open(os.path.join(target_path, source_path.lstrip('/'), 'file')) as f:
+		assert(f.read() == 'data')
@@ -32,16 +32,19 @@ from logging import getLogger
 from wasp_general.command.command import WCommandSet, WCommandProto, WCommandPrioritizedSelector, WCommand
 from wasp_general.command.result import WPlainCommandResult
 
+from wasp_backup.core import WBackupMeta
 from wasp_backup.file_backup import WFileBackupCommand
 from wasp_backup.check import WCheckBackupCommand
+from wasp_backup.listing import WListBackupCommand
+from wasp_backup.restore import WRestoreBackupCommand
 from wasp_backup.program_backup import WProgramBackupCommand
 from wasp_backup.retention import WRetentionBackupCommand
 
 
 class WCommandHelp(WCommand):
 
-	__help_info__ = '''This utility is able to create file or program backup, to check archive integrity and, \
-and is able to rotate archives that resides locally or on a remote location.
+	__help_info__ = '''This utility is able to create file or program backup, to check archive integrity, to list \
+archived files, to restore archives and is able to rotate archives that resides locally or on a remote location.
 Syntax: %s <main_command> [<command argument 1> <command argument 2> <command argument 3>...]
 
 ''' % sys.argv[0]
@@ -71,5 +74,10 @@ if __name__ == '__main__':
 	command_set.commands().add_prioritized(WFileBackupCommand(logger), 50)
 	command_set.commands().add_prioritized(WProgramBackupCommand(logger), 50)
 	command_set.commands().add_prioritized(WCheckBackupCommand(logger), 50)
+	command_set.commands().add_prioritized(WListBackupCommand(logger), 50)
+	command_set.commands().add_prioritized(WRestoreBackupCommand(logger), 50)
 	command_set.commands().add_prioritized(WRetentionBackupCommand(logger), 50)
-	print(command_set.exec(WCommandProto.join_tokens(*(sys.argv[1:]))))
+	command_result = command_set.exec(WCommandProto.join_tokens(*(sys.argv[1:])))
+	# archive may be written to stdout, so the result must not be mixed with it
+	result_output = sys.stderr if WBackupMeta.Archive.__stdout_path__ in sys.argv[1:] else sys.stdout
+	print(command_result, file=result_output)
@@ -37,6 +37,7 @@ from wasp_launcher.core_broker import WCommandKit, WBrokerCommand, WResponsiveBr
 from wasp_backup.core import WBackupMeta
 from wasp_backup.file_backup import WFileBackupCommand
 from wasp_backup.check import WCheckBackupCommand
+from wasp_backup.restore import WRestoreBackupCommand
 from wasp_backup.program_backup import WProgramBackupCommand
 from wasp_backup.retention import WRetentionBackupCommand
 
@@ -121,6 +122,45 @@ class WResponsiveCheckBackupCommand(WResponsiveBrokerCommand):
 		)
 
 
+class WResponsiveRestoreBackupCommand(WResponsiveBrokerCommand):
+
+	class RestoreBackupCommand(WRestoreBackupCommand, WBrokerCommand):
+
+		def __init__(self):
+			WRestoreBackupCommand.__init__(self, WAppsGlobals.log)
+			WBrokerCommand.__init__(
+				self, self.command_token(), *self.argument_descriptors(),
+				relationships=self.relationships()
+			)
+
+		def brief_description(self):
+			return self.__description__
+
+	class ScheduledTask(WResponsiveBrokerCommand.ScheduledTask):
+
+		def state_details(self):
+			restorer = self.basic_command().restorer()
+			if restorer is not None:
+				details = restorer.restore_details()
+				if details is not None:
+					return '\n' + details
+
+			return 'Restoring is not running. May be finalizing'
+
+		def thread_started(self):
+			self.basic_command().stop_event(self.stop_event())
+			WResponsiveBrokerCommand.ScheduledTask.thread_started(self)
+
+	__task_source_name__ = WBackupMeta.__task_source_name__
+	__scheduler_instance__ = WBackupMeta.__scheduler_instance_name__
+
+	def __init__(self):
+		WResponsiveBrokerCommand.__init__(
+			self, WResponsiveRestoreBackupCommand.RestoreBackupCommand(),
+			scheduled_task_cls=WResponsiveRestoreBackupCommand.ScheduledTask
+		)
+
+
 class WResponsiveProgramBackupCommand(WResponsiveBrokerCommand):
 
 	class ProgramBackupCommand(WProgramBackupCommand, WBrokerCommand):
@@ -210,6 +250,7 @@ class WBackupBrokerCommandKit(WCommandKit):
 		return (
 			WResponsiveCreateBackupCommand(),
 			WResponsiveCheckBackupCommand(),
+			WResponsiveRestoreBackupCommand(),
 			WResponsiveProgramBackupCommand(),
 			WResponsiveRetentionCommand()
 		)
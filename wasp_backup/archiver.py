@@ -28,23 +28,34 @@ from wasp_backup.version import __author__, __version__, __credits__, __license_
 from wasp_backup.version import __status__
 
 import os
+import io
+import sys
 import tarfile
 import json
 import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from time import mktime
 from datetime import datetime
 
 from wasp_general.verify import verify_type, verify_value
-from wasp_general.io import WWriterChainLink, WReaderChainLink, WThrottlingReader, WResponsiveWriter, WResponsiveIO
-from wasp_general.io import WResponsiveReader, WHashCalculationReader, WDiscardReaderResult, WReaderChain, WGzipReader
-from wasp_general.io import WBzip2Reader
+from wasp_general.io import WWriterChainLink, WReaderChainLink, WResponsiveWriter, WResponsiveIO
+from wasp_general.io import WResponsiveReader, WReaderChain
 
 from wasp_backup.cipher import WBackupCipher
 from wasp_backup.core import WBackupMeta
 from wasp_backup.io import WMetaTarPatcher, WArchiverThrottlingWriter, WArchiverHashCalculationWriter
-from wasp_backup.io import WArchiverAESCipher, WArchiverThrottlingReader
-from wasp_backup.io import WArchiverWriterChain, WExtractorReaderChain, WBackupMetaProvider, WBasicArchiverIO
-from wasp_backup.io import WArchiverDataCounter
+from wasp_backup.io import WArchiverAESCipher, WArchiverWriterChain, WBackupMetaProvider, WBasicArchiverIO
+from wasp_backup.io import WArchiverDataCounter, WArchiverCompression, WArchiverCompressionWriter
+from wasp_backup.io import WArchiverPipelineWriter, WArchiverHash
+from wasp_backup.io import WArchiverVolumes, WArchiverVolumeWriter, WBasicTarWriter, WStreamingTarWriter
+from wasp_backup.io import WArchiverSegmentsReader, WArchiverTeeWriter, WArchiverRepositoryWriter
+from wasp_backup.io import WArchiverFrameIndex, WArchiverFrameReader, WArchiverThrottlingSource
+from wasp_backup.io import WArchiverThrottlingReader, WArchiverSourceThrottlingWriter, WArchiverTokenBucket
+from wasp_backup.repository import WArchiverRepository
+from wasp_backup.io_priority import WArchiverIOPriority
+from wasp_backup.member_index import WArchiverMemberIndex, WArchiverIndexedTarFile
 
 
 """
@@ -76,16 +87,62 @@ class WBasicArchiveCreator(WBasicArchiverIO, WBackupMetaProvider):
 	@verify_type('paranoid', archive_path=str, io_write_rate=(float, int, None))
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_write_rate=lambda x: x is None or x > 0)
 	@verify_type(cipher=(WBackupCipher, None), compression_mode=(WBackupMeta.Archive.CompressionMode, None))
+	@verify_type(compression_workers=(int, None), compression_level=(int, None))
+	@verify_type(archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_type(hash_algorithm=(str, None), hash_chunk_size=(int, None), volume_size=(int, None))
+	@verify_value(compression_workers=lambda x: x is None or x > 0)
+	@verify_value(pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_value(hash_algorithm=lambda x: x is None or WArchiverHash.available(x))
+	@verify_value(hash_chunk_size=lambda x: x is None or x > 0, volume_size=lambda x: x is None or x > 0)
+	@verify_type(stream_part_size=(int, None), compression_frame_size=(int, None))
+	@verify_value(stream_part_size=lambda x: x is None or x > 0)
+	@verify_value(compression_frame_size=lambda x: x is None or x > 0)
 	def __init__(
 		self, archive_path, logger, stop_event=None, io_write_rate=None, compression_mode=None,
-		cipher=None
+		cipher=None, compression_workers=None, compression_level=None, archive_layout=None,
+		pipeline_queue_size=None, hash_algorithm=None, hash_chunk_size=None, volume_size=None,
+		stream_part_size=None, compression_frame_size=None
 	):
 		WBasicArchiverIO.__init__(self, archive_path, logger, stop_event=stop_event, io_rate=io_write_rate)
 		WBackupMetaProvider.__init__(self)
+
+		if compression_mode is not None:
+			WArchiverCompression.check_availability(compression_mode)
+			compression_level = WArchiverCompression.compression_level(compression_mode, compression_level)
+		elif compression_level is not None:
+			raise ValueError('Compression level can not be set for uncompressed archive')
+
 		self.__compression_mode = compression_mode
+		self.__compression_workers = compression_workers
+		self.__compression_level = compression_level
+		self.__archive_layout = \
+			archive_layout if archive_layout is not None else WBackupMeta.Archive.__default_layout__
+		self.__pipeline_queue_size = pipeline_queue_size
+		self.__hash_algorithm = hash_algorithm
+		self.__hash_chunk_size = hash_chunk_size
+		self.__volume_size = volume_size
+		self.__volume_callback = None
+		self.__stream_part_size = stream_part_size
+		self.__compression_frame_size = compression_frame_size if compression_mode is not None else None
+		self.__stream_consumer = None
+		self.__local_copy = True
+		self.__repository = None
 		self.__cipher = cipher
 		self.__writer_chain = None
 		self.__last_archive_creation_time = None
+		self.__source_read_rate = None
+		self.__io_priority = None
+
+		if self.streaming() is True:
+			if self.__archive_layout != WBackupMeta.Archive.Layout.compression_encryption:
+				raise ValueError('Streaming archives are supported for the "compression_encryption" layout only')
+			if archive_path == WBackupMeta.Archive.__stdout_path__ and volume_size is not None:
+				raise ValueError('Archive that is written to stdout can not be split into volumes')
+		if self.__compression_frame_size is not None and \
+			self.__archive_layout != WBackupMeta.Archive.Layout.compression_encryption:
+			raise ValueError(
+				'Seekable compression is supported for the "compression_encryption" layout only'
+			)
 
 	def io_write_rate(self):
 		return self.io_rate()
@@ -93,9 +150,121 @@ class WBasicArchiveCreator(WBasicArchiverIO, WBackupMetaProvider):
 	def compression_mode(self):
 		return self.__compression_mode
 
+	def compression_workers(self):
+		return self.__compression_workers
+
+	def compression_level(self):
+		return self.__compression_level
+
+	def archive_layout(self):
+		return self.__archive_layout
+
+	def pipeline_queue_size(self):
+		return self.__pipeline_queue_size
+
+	def hash_algorithm(self):
+		return self.__hash_algorithm
+
+	def hash_chunk_size(self):
+		return self.__hash_chunk_size
+
+	def volume_size(self):
+		return self.__volume_size
+
+	def volume_callback(self):
+		return self.__volume_callback
+
+	def set_volume_callback(self, value):
+		""" Set function that will be called with a path of every complete volume (for multi-volume archives)
+		"""
+		self.__volume_callback = value
+
+	def stream_part_size(self):
+		return self.__stream_part_size
+
+	def compression_frame_size(self):
+		""" Return size of independently compressed frames (seekable compression is used if it is set)
+		"""
+		return self.__compression_frame_size
+
+	def stream_consumer(self):
+		return self.__stream_consumer
+
+	def local_copy(self):
+		return self.__local_copy
+
+	def set_stream_consumer(self, consumer, local_copy=True):
+		""" Set function that will be called in a separate thread with a file object, that returns archive
+		data while archive is created (an uploading function, for example). Archive is written without seeking
+		in this case (see :meth:`.WBasicArchiveCreator.streaming`)
+
+		:param consumer: function that reads the given file object until the end
+		:param local_copy: whether archive must be written to the archive path also
+		"""
+		if self.__archive_layout != WBackupMeta.Archive.Layout.compression_encryption:
+			raise ValueError('Streaming archives are supported for the "compression_encryption" layout only')
+		if self.volume_size() is not None:
+			raise ValueError('Multi-volume archive can not be streamed')
+		if self.__repository is not None:
+			raise ValueError('Archive that is stored in a repository can not be streamed')
+		self.__stream_consumer = consumer
+		self.__local_copy = local_copy
+
+	def repository(self):
+		return self.__repository
+
+	def set_repository(self, repository):
+		""" Store archive in the deduplicating repository (:class:`wasp_backup.repository.WArchiverRepository`).
+		The archive path is a path of the manifest in this case. Archive is written without seeking and it is
+		not compressed or encrypted as a whole, chunks are compressed and encrypted by the repository instead
+
+		:param repository: repository to store archive in
+		"""
+		if self.__archive_layout != WBackupMeta.Archive.Layout.compression_encryption:
+			raise ValueError('Repository archives are supported for the "compression_encryption" layout only')
+		if self.volume_size() is not None or self.__stream_consumer is not None:
+			raise ValueError('Repository archive can not be split into volumes or streamed')
+		if self.archive_path() == WBackupMeta.Archive.__stdout_path__:
+			raise ValueError('Repository archive can not be written to stdout')
+		if self.compression_mode() is not None or self.cipher() is not None:
+			raise ValueError('Repository archive chunks are compressed and encrypted by the repository')
+		self.__repository = repository
+
+	def streaming(self):
+		""" Return True if archive is written without seeking (archive is written to stdout, archive is
+		streamed to a consumer or to a repository or the size of streaming parts is set)
+		"""
+		return self.__stream_part_size is not None or self.__stream_consumer is not None or \
+			self.__repository is not None or self.archive_path() == WBackupMeta.Archive.__stdout_path__
+
 	def cipher(self):
 		return self.__cipher
 
+	def source_read_rate(self):
+		return self.__source_read_rate
+
+	@verify_type(value=(int, float, None))
+	@verify_value(value=lambda x: x is None or x > 0)
+	def set_source_read_rate(self, value):
+		""" Limit the rate of archive data before it is compressed and encrypted, that is the rate of source
+		reading (the burst size of I/O throttling is used for this limit also)
+
+		:param value: rate limit (bytes per second)
+		"""
+		self.__source_read_rate = value
+
+	def io_priority(self):
+		return self.__io_priority
+
+	@verify_type(value=(WArchiverIOPriority, None))
+	def set_io_priority(self, value):
+		""" Set I/O priority of archiving. It is set for the thread that calls :meth:`.WBasicArchiveCreator.archive`
+		while archive is created (threads and processes that are started by archiving inherit it)
+
+		:param value: I/O priority
+		"""
+		self.__io_priority = value
+
 	def file_object(self):
 		return self.__writer_chain
 
@@ -113,49 +282,153 @@ class WBasicArchiveCreator(WBasicArchiverIO, WBackupMetaProvider):
 	def write_chain(self):
 		inside_archive_name = self.inside_filename()
 
-		chain = [
-			open(self.archive_path(), mode='wb'),
-			WWriterChainLink(WArchiverThrottlingWriter, write_limit=self.io_write_rate()),
-			WWriterChainLink(
-				WMetaTarPatcher, inside_archive_name, self, compression_mode=self.compression_mode()
-			),
-			WWriterChainLink(WArchiverDataCounter),
-			WWriterChainLink(WArchiverHashCalculationWriter)
-		]
+		volume_size = self.volume_size()
+		if self.repository() is not None:
+			target = WArchiverRepositoryWriter(
+				self.repository(), self.archive_path(), workers=self.compression_workers()
+			)
+		elif self.stream_consumer() is not None:
+			target = WArchiverTeeWriter(local_path=(self.archive_path() if self.local_copy() is True else None))
+		elif self.archive_path() == WBackupMeta.Archive.__stdout_path__:
+			target = open(sys.stdout.fileno(), mode='wb', closefd=False)
+		elif volume_size is None:
+			target = open(self.archive_path(), mode='wb')
+		else:
+			target = WArchiverVolumeWriter(self.archive_path(), volume_size, volume_callback=self.volume_callback())
+
+		chain = [target, WWriterChainLink(WArchiverThrottlingWriter, write_limit=self.io_throttling())]
 
 		cipher = self.cipher()
-		if cipher is not None:
-			chain.append(WWriterChainLink(WArchiverAESCipher, cipher))
+		compression_mode = self.compression_mode()
+		if self.archive_layout() == WBackupMeta.Archive.Layout.encryption_compression:
+			chain.extend([
+				WWriterChainLink(
+					WMetaTarPatcher, inside_archive_name, self, compression_mode=compression_mode,
+					compression_workers=self.compression_workers(),
+					compression_level=self.compression_level()
+				),
+				WWriterChainLink(WArchiverDataCounter),
+				WWriterChainLink(
+					WArchiverHashCalculationWriter, hash_algorithm=self.hash_algorithm(),
+					chunk_size=self.hash_chunk_size()
+				)
+			])
+			if cipher is not None:
+				chain.append(WWriterChainLink(WArchiverAESCipher, cipher))
+		else:
+			if self.streaming() is True:
+				tar_link = WWriterChainLink(
+					WStreamingTarWriter, inside_archive_name, self, part_size=self.stream_part_size()
+				)
+			else:
+				tar_link = WWriterChainLink(WMetaTarPatcher, inside_archive_name, self)
+			chain.extend([
+				tar_link,
+				WWriterChainLink(
+					WArchiverHashCalculationWriter, hash_algorithm=self.hash_algorithm(),
+					chunk_size=self.hash_chunk_size()
+				)
+			])
+			if cipher is not None:
+				chain.append(WWriterChainLink(WArchiverAESCipher, cipher))
+			if compression_mode is not None:
+				chain.append(WWriterChainLink(
+					WArchiverCompressionWriter, compression_mode,
+					compression_level=self.compression_level(),
+					compression_workers=self.compression_workers(),
+					frame_size=self.compression_frame_size()
+				))
+			chain.append(WWriterChainLink(WArchiverDataCounter))
+
+		source_read_rate = self.source_read_rate()
+		if source_read_rate is not None:
+			chain.append(WWriterChainLink(
+				WArchiverSourceThrottlingWriter,
+				read_limit=WArchiverTokenBucket(rate=source_read_rate, burst=self.io_burst())
+			))
 
 		stop_event = self.stop_event()
+
+		pipeline_queue_size = self.pipeline_queue_size()
+		if pipeline_queue_size is not None:
+			# every link (and the target file) is served by its own thread
+			pipelined_chain = chain[:1]
+			for link in chain[1:]:
+				pipelined_chain.append(
+					WWriterChainLink(WArchiverPipelineWriter, pipeline_queue_size, stop_event=stop_event)
+				)
+				pipelined_chain.append(link)
+			chain = pipelined_chain
+
 		if stop_event is not None:
 			chain.append(WWriterChainLink(WResponsiveWriter, stop_event))
 
 		return WArchiverWriterChain(*chain)
 
 	def archive(self):
+		io_priority = self.io_priority()
+		if io_priority is None:
+			return self.__archive()
+
+		# priority is set before threads of the writer chain are started, so they inherit it
+		previous_priority = io_priority.apply()
+		try:
+			return self.__archive()
+		finally:
+			WArchiverIOPriority.restore(previous_priority)
+
+	def __archive(self):
 		archive_path = self.archive_path()
 		self.__writer_chain = self.write_chain()
 		self.__last_archive_creation_time = self.__utc_unix_time()
-		archive_instance = self.__writer_chain.instance(WMetaTarPatcher)
+		archive_instance = self.__writer_chain.instance(WBasicTarWriter)
+
+		consumer_thread = None
+		tee_writer = self.__writer_chain.instance(WArchiverTeeWriter)
+		if tee_writer is not None:
+			consumer_thread = threading.Thread(target=self.__consume_stream, args=(tee_writer.reader(), ))
+			consumer_thread.start()
 
 		try:
 			self.write_archive(self.__writer_chain, archive_instance)
 			self.__writer_chain.flush()
 			archive_instance.patch()
 			self.__writer_chain.close()
+			self._archive_created()
 			self.logger().info('Archive "%s" was created and patched successfully' % archive_path)
 
 		except WResponsiveIO.IOTerminated:
-			os.unlink(archive_path)
+			self.__discard_archive()
 			self.logger().error(
 				'Unable to create archive "%s" - task terminated, changes discarded' % archive_path
 			)
 			return
 		except Exception:
-			os.unlink(archive_path)
+			self.__discard_archive()
 			self.logger().error('Unable to create archive "%s". Changes discarded' % archive_path)
 			raise
+		finally:
+			if consumer_thread is not None:
+				consumer_thread.join()
+
+	def __consume_stream(self, reader):
+		try:
+			self.__stream_consumer(reader)
+		except Exception as e:
+			self.logger().error('Archive stream consumer failed: %s' % str(e))
+		finally:
+			reader.close()
+
+	def __discard_archive(self):
+		self.__writer_chain.abort()
+		volume_writer = self.__writer_chain.instance(WArchiverVolumeWriter)
+		if volume_writer is not None:
+			volume_writer.discard()
+		elif self.repository() is not None:
+			pass  # the manifest is written on successful completion only
+		elif os.path.isfile(self.archive_path()) is True and self.local_copy() is True:
+			# stdout, pipes and sockets can not be discarded
+			os.unlink(self.archive_path())
 
 	@classmethod
 	def __utc_unix_time(cls):
@@ -166,6 +439,19 @@ class WBasicArchiveCreator(WBasicArchiverIO, WBackupMetaProvider):
 	def write_archive(self, fo, archive):
 		pass
 
+	def _archive_created(self):
+		""" This method is called after archive was successfully created
+		"""
+		pass
+
+	def extra_members(self):
+		compression_writer = None
+		if self.__writer_chain is not None:
+			compression_writer = self.__writer_chain.instance(WArchiverCompressionWriter)
+		if compression_writer is None or compression_writer.frame_index() is None:
+			return []
+		return [(WBackupMeta.Archive.__frame_index_filename__, compression_writer.frame_index().encode())]
+
 	def meta(self):
 		result = self.__writer_chain.meta() if self.__writer_chain is not None else {}
 
@@ -176,8 +462,12 @@ class WBasicArchiveCreator(WBasicArchiverIO, WBackupMetaProvider):
 		result.update({
 			WBackupMeta.Archive.MetaOptions.inside_filename: self.inside_filename(),
 			WBackupMeta.Archive.MetaOptions.compression_mode: compression_mode,
+			WBackupMeta.Archive.MetaOptions.compression_level: self.compression_level(),
+			WBackupMeta.Archive.MetaOptions.archive_layout: self.archive_layout().value,
 			WBackupMeta.Archive.MetaOptions.creation_time: self.__last_archive_creation_time
 		})
+		if self.volume_size() is not None:
+			result[WBackupMeta.Archive.MetaOptions.volume_size] = self.volume_size()
 		return result
 
 
@@ -186,53 +476,106 @@ class WBasicInsideTarArchiveCreator(WBasicArchiveCreator):
 	@verify_type('paranoid', archive_path=str, io_write_rate=(float, int, None))
 	@verify_type('paranoid', cipher=(WBackupCipher, None), compression_mode=(WBackupMeta.Archive.CompressionMode, None))
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_write_rate=lambda x: x is None or x > 0)
-	def __init__(self, archive_path, logger, compression_mode=None, cipher=None, stop_event=None, io_write_rate=None):
+	@verify_type('paranoid', compression_workers=(int, None), compression_level=(int, None))
+	@verify_type('paranoid', archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_type('paranoid', hash_algorithm=(str, None), hash_chunk_size=(int, None), volume_size=(int, None))
+	@verify_value('paranoid', compression_workers=lambda x: x is None or x > 0)
+	@verify_value('paranoid', pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', hash_algorithm=lambda x: x is None or WArchiverHash.available(x))
+	@verify_value('paranoid', hash_chunk_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', volume_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', stream_part_size=(int, None), compression_frame_size=(int, None))
+	@verify_value('paranoid', stream_part_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', compression_frame_size=lambda x: x is None or x > 0)
+	def __init__(
+		self, archive_path, logger, compression_mode=None, cipher=None, stop_event=None, io_write_rate=None,
+		compression_workers=None, compression_level=None, archive_layout=None, pipeline_queue_size=None,
+		hash_algorithm=None, hash_chunk_size=None, volume_size=None, stream_part_size=None,
+		compression_frame_size=None
+	):
 		WBasicArchiveCreator.__init__(
 			self, archive_path, logger, stop_event=stop_event, io_write_rate=io_write_rate,
-			compression_mode=compression_mode, cipher=cipher
+			compression_mode=compression_mode, cipher=cipher, compression_workers=compression_workers,
+			compression_level=compression_level, archive_layout=archive_layout,
+			pipeline_queue_size=pipeline_queue_size, hash_algorithm=hash_algorithm,
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size,
+			compression_frame_size=compression_frame_size
 		)
 
 		self.__compression_mode = compression_mode
 		self.__cipher = cipher
 		self.__writer_chain = None
+		self.__member_index = None
+
+	def member_index(self):
+		""" Return member index of the last created archive
+		"""
+		return self.__member_index
 
 	def write_archive(self, fo, archive):
-		tar = tarfile.open(fileobj=fo, mode='w:')
+		self.__member_index = None
+		tar = WArchiverIndexedTarFile.open(fileobj=fo, mode='w:')
+		tar_start = tar.offset
 		self._populate_archive(tar)
-		fo.flush()
+		self.__member_index = tar.member_index()
 
-		data_written = archive.data_written()
+		# tar offset is used instead of the archive size because the data may be compressed and/or encrypted
+		# already. The chain must not be flushed here since flushing completes compressed stream and pads
+		# the encrypted data
+		data_written = tar.offset - tar_start
 		padding_size = archive.record_size(data_written + (tarfile.BLOCKSIZE * 2)) - data_written
 		fo.write(archive.padding(padding_size))
 
 	def _populate_archive(self, tar_archive):
 		pass
 
+	def extra_members(self):
+		result = WBasicArchiveCreator.extra_members(self)
+		member_index = self.member_index()
+		if member_index is not None:
+			cipher = self.cipher()
+			index_data = member_index.encode(cipher=(cipher.auxiliary_cipher() if cipher is not None else None))
+			result.append((WBackupMeta.Archive.__member_index_filename__, index_data))
+		return result
+
 
 class WBasicArchiveExtractor(WBasicArchiverIO):
 
 	@verify_type('paranoid', archive_path=str, io_read_rate=(float, int, None))
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_read_rate=lambda x: x is None or x > 0)
-	def __init__(self, archive_path, logger, stop_event=None, io_read_rate=None):
+	@verify_type(password=(str, None))
+	def __init__(self, archive_path, logger, stop_event=None, io_read_rate=None, password=None):
 		WBasicArchiverIO.__init__(self, archive_path, logger, stop_event=stop_event, io_rate=io_read_rate)
+		self.__password = password
+		self.__ciphers = {}
 
 	def io_read_rate(self):
 		return self.io_rate()
 
-	@verify_type(file_name=str)
-	@verify_value(file_name=lambda x: len(x) > 0)
-	def open_file(self, file_name):
+	def open_archive(self):
+		""" Open archive for reading. Multi-volume archives and archives that are stored in a repository are
+		read as a single file (the password is used for encrypted repositories)
+		"""
+		if WArchiverRepository.is_manifest(self.archive_path()) is True:
+			return WArchiverRepository.open_archive(self.archive_path(), password=self.__password)
+		return WArchiverVolumes.open(self.archive_path())
+
+	def __reader_chain(self):
 		chain = [
-			open(self.archive_path(), 'rb'),
-			WReaderChainLink(WThrottlingReader, throttling_to=self.io_read_rate()),
+			self.open_archive(),
+			WReaderChainLink(WArchiverThrottlingReader, read_limit=self.io_throttling()),
 		]
 
 		stop_event = self.stop_event()
 		if stop_event is not None:
 			chain.append(WReaderChainLink(WResponsiveReader, stop_event))
 
-		reader_chain = WReaderChain(*chain)
+		return WReaderChain(*chain)
 
+	@verify_type(file_name=str)
+	@verify_value(file_name=lambda x: len(x) > 0)
+	def open_file(self, file_name):
+		reader_chain = self.__reader_chain()
 		tar = tarfile.open(fileobj=reader_chain, mode='r:')
 		extracted_file = tar.extractfile(file_name)
 		if extracted_file is None:
@@ -242,25 +585,247 @@ class WBasicArchiveExtractor(WBasicArchiverIO):
 		return extracted_file
 
 	def open_meta(self):
+		""" Open meta file. It is found with the meta locator at the end of the archive, archives without the
+		locator are scanned
+		"""
+		reader_chain = self.__reader_chain()
+		try:
+			meta_data = WBasicTarWriter.read_located_meta(reader_chain)
+		finally:
+			reader_chain.close()
+		if meta_data is not None:
+			return io.BytesIO(meta_data)
 		return self.open_file(WBackupMeta.Archive.__meta_filename__)
 
+	def read_meta(self):
+		""" Return archive meta data
+
+		:return: dict
+		"""
+		meta_file = self.open_meta()
+		try:
+			return json.loads(meta_file.read().decode())
+		finally:
+			meta_file.close()
+
+	@verify_type(member_name=str, meta=dict)
+	def read_extra_member(self, member_name, meta):
+		""" Read member that was written before the meta file. None is returned if archive does not have it
+
+		:param member_name: name of the member
+		:param meta: archive meta data
+		:return: bytes or None
+		"""
+		extra_members = meta.get(WBackupMeta.Archive.MetaOptions.extra_members.value, {})
+		if member_name not in extra_members:
+			return None
+		offset, size = extra_members[member_name]
+
+		reader_chain = self.__reader_chain()
+		try:
+			reader_chain.seek(offset)
+			result = reader_chain.read(size)[:size]
+		finally:
+			reader_chain.close()
+		if len(result) != size:
+			raise RuntimeError('Archive "%s" is truncated' % self.archive_path())
+		return result
+
+	@verify_type(meta=(dict, None))
+	def member_index(self, meta=None):
+		""" Return member index of an inside tar archive. None is returned if archive does not have the index
+		(this is not an inside tar archive or it was created by a previous version)
+
+		:param meta: archive meta data (it is read if it is not specified)
+		:return: WArchiverMemberIndex or None
+		"""
+		if meta is None:
+			meta = self.read_meta()
+		index_data = self.read_extra_member(WBackupMeta.Archive.__member_index_filename__, meta)
+		if index_data is None:
+			return None
+
+		cipher = self.archive_cipher(meta)
+		return WArchiverMemberIndex.decode(
+			index_data, cipher=(cipher.auxiliary_cipher() if cipher is not None else None)
+		)
+
+	@verify_type(meta=dict)
+	def archive_cipher(self, meta):
+		""" Return cipher of an encrypted archive (None is returned for unencrypted archives). Ciphers are cached,
+		since key derivation is slow
+
+		:param meta: archive meta data
+		:return: WBackupCipher or None
+		"""
+		cipher_name = meta.get(WBackupMeta.Archive.MetaOptions.cipher_algorithm.value)
+		if cipher_name is None:
+			return None
+		if self.__password is None:
+			raise RuntimeError('Archive "%s" is encrypted - password is required' % self.archive_path())
+		salt = meta[WBackupMeta.Archive.MetaOptions.pbkdf2_salt.value]
+		if (cipher_name, salt) not in self.__ciphers:
+			self.__ciphers[(cipher_name, salt)] = \
+				WBackupCipher(cipher_name, self.__password, salt=bytes.fromhex(salt))
+		return self.__ciphers[(cipher_name, salt)]
+
+	@verify_type(meta=(dict, None))
+	def open_inside_data(self, meta=None):
+		""" Open uncompressed and decrypted data of the inside file for random access. This is possible for
+		archives that are stored as is and for seekable compressed archives (archives with the frame index) of
+		the "compression_encryption" layout. None is returned for the other archives (they may be read sequentially
+		only)
+
+		:param meta: archive meta data (it is read if it is not specified)
+		:return: seekable file object or None
+		"""
+		if meta is None:
+			meta = self.read_meta()
+		inside_file_name = meta[WBackupMeta.Archive.MetaOptions.inside_filename.value]
+		parts_count = meta.get(WBackupMeta.Archive.MetaOptions.inside_file_parts.value)
+		compression_mode = meta.get(WBackupMeta.Archive.MetaOptions.compression_mode.value)
+		cipher = self.archive_cipher(meta)
+
+		if compression_mode is None:
+			if cipher is not None:
+				return None
+			return self.open_inside_file(inside_file_name, parts_count=parts_count)
+
+		archive_layout = meta.get(WBackupMeta.Archive.MetaOptions.archive_layout.value)
+		if archive_layout != WBackupMeta.Archive.Layout.compression_encryption.value:
+			return None
+		frame_index_data = self.read_extra_member(WBackupMeta.Archive.__frame_index_filename__, meta)
+		if frame_index_data is None:
+			return None
+
+		return io.BufferedReader(WArchiverFrameReader(
+			self.open_inside_file(inside_file_name, parts_count=parts_count),
+			WArchiverFrameIndex.decode(frame_index_data), WBackupMeta.Archive.CompressionMode(compression_mode),
+			cipher=(cipher.aes_cipher() if cipher is not None else None)
+		))
+
+	@verify_type(member_name=str, meta=(dict, None))
+	def open_member(self, member_name, meta=None):
+		""" Open member of the inside tar without reading of the previous members. The member index is used for
+		finding a member and the inside data must allow random access (see
+		:meth:`.WBasicArchiveExtractor.open_inside_data`). None is returned if this is impossible
+
+		:param member_name: name of a member
+		:param meta: archive meta data (it is read if it is not specified)
+		:return: None or tuple of a member header (tarfile.TarInfo) and a file object with member data (or None if
+		a member is not a regular file)
+		"""
+		if meta is None:
+			meta = self.read_meta()
+		member_index = self.member_index(meta)
+		if member_index is None:
+			return None
+		entry = member_index.find(member_name)
+		if entry is None:
+			raise RuntimeError('File "%s" was not found in archive "%s"' % (member_name, self.archive_path()))
+		inside_data = self.open_inside_data(meta)
+		if inside_data is None:
+			return None
+
+		inside_data.seek(entry.offset)
+		tar = tarfile.open(fileobj=inside_data, mode='r:')
+		tar_info = tar.next()
+		if tar_info is None or tar_info.name != entry.name:
+			raise RuntimeError('Archive "%s" is corrupted - member index mismatch' % self.archive_path())
+		return tar_info, tar.extractfile(tar_info)
+
+	@verify_type('paranoid', inside_file_name=str, parts_count=(int, None))
+	def open_inside_file(self, inside_file_name, parts_count=None):
+		""" Open inside file. Data of streaming archives (which meta has the "inside_file_parts" option) is
+		read from all the parts as a single file
+
+		:param inside_file_name: name of the inside file
+		:param parts_count: number of parts for streaming archives or None for the others
+		"""
+		if parts_count is None:
+			return self.open_file(inside_file_name)
+		reader_chain = self.__reader_chain()
+		segments = self.inside_file_segments(reader_chain, inside_file_name, parts_count=parts_count)
+		return io.BufferedReader(WArchiverSegmentsReader(reader_chain, segments))
+
+	@classmethod
+	@verify_type(inside_file_name=str, parts_count=(int, None))
+	def inside_file_segments(cls, archive_file, inside_file_name, parts_count=None):
+		""" Return list of pairs - offset and size of the inside file data (or of every part of it)
+		"""
+		if parts_count is None:
+			names = [inside_file_name]
+		else:
+			names = [WStreamingTarWriter.part_name(inside_file_name, x) for x in range(parts_count)]
+
+		members = {x.name: x for x in tarfile.open(fileobj=archive_file, mode='r:').getmembers()}
+		result = []
+		for name in names:
+			if name not in members:
+				raise RuntimeError('File "%s" was not found in archive' % name)
+			result.append((members[name].offset_data, members[name].size))
+		return result
+
 
 class WArchiveIntegrityChecker(WBasicArchiveExtractor):
+	""" Checks archive integrity. Archives with chunked hashing are checked with a pool of threads, segments are
+	read independently when hashed data is stored as is, otherwise data is read sequentially and only hash
+	calculation is done in parallel.
 
-	@verify_type('paranoid', archive_path=str, io_read_rate=(float, int, None))
+	Data is read with readinto into buffers that are allocated once, so memory usage does not depend on the
+	archive size. It is limited by "read_size" for archives without chunked hashing, by "workers * read_size" for
+	archives which hashed data is stored as is and by "(workers + 1) * chunk_size" for compressed archives with
+	chunked hashing
+	"""
+
+	__read_size__ = 1024 * 1024
+
+	@verify_type('paranoid', archive_path=str, io_read_rate=(float, int, None), workers=(int, None))
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_read_rate=lambda x: x is None or x > 0)
-	def __init__(self, archive_path, logger, stop_event=None, io_read_rate=None):
-		WBasicArchiveExtractor.__init__(self, archive_path, logger, stop_event=stop_event, io_read_rate=io_read_rate)
-		self.__reader_chain = None
+	@verify_value(workers=lambda x: x is None or x > 0)
+	@verify_type('paranoid', password=(str, None))
+	@verify_type(read_size=(int, None))
+	@verify_value(read_size=lambda x: x is None or x > 0)
+	def __init__(
+		self, archive_path, logger, stop_event=None, io_read_rate=None, workers=None, password=None, read_size=None
+	):
+		WBasicArchiveExtractor.__init__(
+			self, archive_path, logger, stop_event=stop_event, io_read_rate=io_read_rate, password=password
+		)
+		self.__workers = workers if workers is not None else (os.cpu_count() or 1)
+		self.__read_size = read_size if read_size is not None else self.__read_size__
+		self.__source = None
+		self.__chunks_checked = None
+		self.__chunks_count = None
+		self.__chunks_lock = threading.Lock()
+		self.__corrupted_ranges = []
+
+	def workers(self):
+		return self.__workers
+
+	def read_size(self):
+		return self.__read_size
+
+	def source(self):
+		return self.__source
+
+	def corrupted_ranges(self):
+		""" Return byte ranges (pairs of the first byte offset and the next after the last byte offset) of
+		corrupted segments that were found by the last check. Offsets are related to the hashed data
 
-	def reader_chain(self):
-		return self.__reader_chain
+		:return: list of tuples
+		"""
+		return self.__corrupted_ranges.copy()
 
 	def check_details(self):
-		if self.__reader_chain is not None:
-			return self.__reader_chain.status()
+		if self.__chunks_count is not None:
+			return 'Chunks checked: %i of %i' % (self.__chunks_checked, self.__chunks_count)
+		source = self.__source
+		if source is not None:
+			return source.status()
 
 	def check_archive(self):
+		self.__corrupted_ranges = []
 		try:
 			meta_file_data = self.open_meta()
 			json_raw_data = meta_file_data.read()
@@ -268,43 +833,198 @@ class WArchiveIntegrityChecker(WBasicArchiveExtractor):
 			json_data = json.loads(json_raw_data.decode())
 			inside_archive_name = json_data[WBackupMeta.Archive.MetaOptions.inside_filename.value]
 
-			chain = [self.open_file(inside_archive_name)]
+			archive_layout = WBackupMeta.Archive.Layout.encryption_compression
+			if WBackupMeta.Archive.MetaOptions.archive_layout.value in json_data:
+				try:
+					archive_layout = WBackupMeta.Archive.Layout(
+						json_data[WBackupMeta.Archive.MetaOptions.archive_layout.value]
+					)
+				except ValueError:
+					raise RuntimeError(
+						'Unsupported archive layout spotted: "%s"' %
+						json_data[WBackupMeta.Archive.MetaOptions.archive_layout.value]
+					)
 
-			if WBackupMeta.Archive.MetaOptions.compression_mode.value in json_data:
+			# for the "compression_encryption" layout hash is calculated for the stored data, so
+			# decompression is not required
+			compression_mode = None
+			if archive_layout == WBackupMeta.Archive.Layout.encryption_compression and \
+				WBackupMeta.Archive.MetaOptions.compression_mode.value in json_data:
 				compression_mode = json_data[WBackupMeta.Archive.MetaOptions.compression_mode.value]
 				if compression_mode is not None:
-					if compression_mode == WBackupMeta.Archive.CompressionMode.gzip.value:
-						chain.append(WReaderChainLink(WGzipReader))
-					elif compression_mode == WBackupMeta.Archive.CompressionMode.bzip2.value:
-						chain.append(WReaderChainLink(WBzip2Reader))
-					else:
+					try:
+						compression_mode = WBackupMeta.Archive.CompressionMode(compression_mode)
+					except ValueError:
 						raise RuntimeError(
 							'Unsupported compression mode spotted: "%s"' % compression_mode
 						)
+					WArchiverCompression.check_availability(compression_mode)
 
-			chain.extend([
-				WReaderChainLink(
-					WHashCalculationReader,
-					json_data[WBackupMeta.Archive.MetaOptions.hash_algorithm.value]
-				),
-				WReaderChainLink(WArchiverThrottlingReader),
-				WReaderChainLink(WDiscardReaderResult)
-			])
-			self.__reader_chain = WExtractorReaderChain(*chain)
-			self.__reader_chain.read()
-			calc_instance = self.__reader_chain.instance(WHashCalculationReader)
-			self.__reader_chain.close()
-
+			hash_algorithm = json_data[WBackupMeta.Archive.MetaOptions.hash_algorithm.value]
 			original_hash = json_data[WBackupMeta.Archive.MetaOptions.hash_value.value].upper()
-			calculated_hash = calc_instance.hexdigest().upper()
-			return original_hash == calculated_hash, original_hash, calculated_hash
+
+			parts_count = json_data.get(WBackupMeta.Archive.MetaOptions.inside_file_parts.value)
+			chunk_size = json_data.get(WBackupMeta.Archive.MetaOptions.hash_chunk_size.value)
+			if chunk_size is None:
+				calculated_hash = self.__calculate_hash(
+					inside_archive_name, parts_count, compression_mode, hash_algorithm
+				)
+				return original_hash == calculated_hash, original_hash, calculated_hash
+
+			original_chunks = [x.upper() for x in json_data[WBackupMeta.Archive.MetaOptions.hash_chunks.value]]
+			if compression_mode is None:
+				calculated_chunks = self.__calculate_chunks_parallel(
+					inside_archive_name, parts_count, hash_algorithm, chunk_size
+				)
+			else:
+				calculated_chunks = self.__calculate_chunks_sequential(
+					inside_archive_name, parts_count, compression_mode, hash_algorithm, chunk_size
+				)
+
+			chunk_offset = 0
+			for i in range(max(len(original_chunks), len(calculated_chunks))):
+				calculated_digest, chunk_length = (None, chunk_size)
+				if i < len(calculated_chunks):
+					calculated_digest, chunk_length = calculated_chunks[i]
+				if i >= len(original_chunks) or original_chunks[i] != calculated_digest:
+					self.__corrupted_ranges.append((chunk_offset, chunk_offset + chunk_length))
+				chunk_offset += chunk_length
+
+			calculated_hash = WArchiverHash.root_digest(hash_algorithm, [x[0] for x in calculated_chunks])
+			result = original_hash == calculated_hash and len(self.__corrupted_ranges) == 0
+			return result, original_hash, calculated_hash
 		except WResponsiveIO.IOTerminated:
 			self.logger().error(
 				'Unable to check archive "%s" - task terminated' % self.archive_path()
 			)
 			return
 		finally:
-			self.__reader_chain = None
+			self.__source = None
+			self.__chunks_count = None
+
+	def __open_data(self, inside_archive_name, parts_count, compression_mode):
+		""" Open hashed data. Return pair of the throttled source and an object to read hashed data from (the
+		source itself or a decompressing object)
+		"""
+		self.__source = WArchiverThrottlingSource(
+			self.open_inside_file(inside_archive_name, parts_count=parts_count), read_limit=self.io_throttling(),
+			stop_event=self.stop_event()
+		)
+		if compression_mode is None:
+			return self.__source, self.__source
+		source = io.BufferedReader(self.__source, buffer_size=self.read_size())
+		return source, WArchiverCompression.stream_reader(compression_mode, source)
+
+	def __read_into(self, data, buffer):
+		""" Read data into the buffer till it is full or data is exhausted. Data is read by "read_size" pieces
+
+		:return: number of bytes read
+		"""
+		view = memoryview(buffer)
+		read_size = self.read_size()
+		bytes_read = 0
+		while bytes_read < len(view):
+			piece_size = data.readinto(view[bytes_read:bytes_read + read_size])
+			if piece_size == 0:
+				break
+			bytes_read += piece_size
+		return bytes_read
+
+	def __calculate_hash(self, inside_archive_name, parts_count, compression_mode, hash_algorithm):
+		source, data = self.__open_data(inside_archive_name, parts_count, compression_mode)
+		try:
+			hash_obj = WArchiverHash.new(hash_algorithm)
+			read_buffer = bytearray(self.read_size())
+			read_view = memoryview(read_buffer)
+			bytes_read = data.readinto(read_buffer)
+			while bytes_read > 0:
+				hash_obj.update(read_view[:bytes_read])
+				bytes_read = data.readinto(read_buffer)
+			return hash_obj.hexdigest().upper()
+		finally:
+			if data is not source:
+				data.close()
+			source.close()
+
+	def __calculate_chunks_sequential(
+		self, inside_archive_name, parts_count, compression_mode, hash_algorithm, chunk_size
+	):
+		def chunk_digest(chunk):
+			hash_obj = WArchiverHash.new(hash_algorithm)
+			hash_obj.update(chunk)
+			return hash_obj.hexdigest().upper(), len(chunk)
+
+		source, data = self.__open_data(inside_archive_name, parts_count, compression_mode)
+		result = []
+		# every chunk is read into its own buffer which is reused when the chunk is hashed, so there are no
+		# more than "workers + 1" buffers
+		pending_chunks = deque()
+		free_buffers = []
+		try:
+			with ThreadPoolExecutor(max_workers=self.workers()) as executor:
+				chunk_length = chunk_size
+				while chunk_length == chunk_size:
+					if len(pending_chunks) >= self.workers():
+						chunk_future, chunk_buffer = pending_chunks.popleft()
+						result.append(chunk_future.result())
+						free_buffers.append(chunk_buffer)
+
+					chunk_buffer = free_buffers.pop() if len(free_buffers) > 0 else bytearray(chunk_size)
+					chunk_length = self.__read_into(data, chunk_buffer)
+					if chunk_length > 0:
+						chunk_future = executor.submit(chunk_digest, memoryview(chunk_buffer)[:chunk_length])
+						pending_chunks.append((chunk_future, chunk_buffer))
+
+				while len(pending_chunks) > 0:
+					result.append(pending_chunks.popleft()[0].result())
+		finally:
+			if data is not source:
+				data.close()
+			source.close()
+		return result
+
+	def __calculate_chunks_parallel(self, inside_archive_name, parts_count, hash_algorithm, chunk_size):
+		# hashed data is stored as is, so every segment is read from its own offset
+		with self.open_archive() as archive_file:
+			segments = self.inside_file_segments(archive_file, inside_archive_name, parts_count=parts_count)
+		inside_file_size = sum(x[1] for x in segments)
+
+		workers = self.workers()
+		stop_event = self.stop_event()
+		io_throttling = self.io_throttling()  # workers share a single limit
+
+		self.__chunks_checked = 0
+		self.__chunks_count = int(math.ceil(inside_file_size / chunk_size))
+
+		def worker_fn(worker_index):
+			worker_result = {}
+			read_buffer = bytearray(min(self.read_size(), chunk_size))
+			read_view = memoryview(read_buffer)
+			segments_reader = WArchiverSegmentsReader(self.open_archive(), segments)
+			with WArchiverThrottlingSource(segments_reader, read_limit=io_throttling, stop_event=stop_event) as reader:
+				for chunk_index in range(worker_index, self.__chunks_count, workers):
+					chunk_offset = chunk_index * chunk_size
+					chunk_length = min(chunk_size, inside_file_size - chunk_offset)
+					reader.seek(chunk_offset)
+					hash_obj = WArchiverHash.new(hash_algorithm)
+					bytes_read = 0
+					while bytes_read < chunk_length:
+						piece_size = reader.readinto(read_view[:min(len(read_view), chunk_length - bytes_read)])
+						if piece_size == 0:
+							break
+						hash_obj.update(read_view[:piece_size])
+						bytes_read += piece_size
+
+					worker_result[chunk_index] = (hash_obj.hexdigest().upper(), bytes_read)
+					with self.__chunks_lock:
+						self.__chunks_checked += 1
+			return worker_result
+
+		result = {}
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			for worker_result in executor.map(worker_fn, range(min(workers, self.__chunks_count))):
+				result.update(worker_result)
+		return [result[x] for x in range(self.__chunks_count)]
 
 
 """
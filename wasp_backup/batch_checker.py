@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/batch_checker.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import os
+import time
+import fnmatch
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from wasp_general.verify import verify_type, verify_value
+from wasp_general.uri import WURI
+
+from wasp_backup.core import WBackupMeta, WBackupMetaProvider
+from wasp_backup.io import WArchiverVolumes, WArchiverRateSchedule, WArchiverTokenBucket
+from wasp_backup.archiver import WArchiveIntegrityChecker
+
+
+class WArchiveBatchChecker:
+	""" Checks integrity of several archives. Archives are checked concurrently by a pool of processes (every
+	process checks one archive at a time with :class:`.WArchiveIntegrityChecker`). Processes take tokens from a single
+	shared token bucket, so the reading rate limit is a total limit however many archives are checked at the moment.
+	CPUs are shared between checker threads. A single archive is checked in the current
+	process.
+
+	A report (dict with :class:`.WBackupMeta.CheckReportOptions` keys) is created for every archive
+	"""
+
+	__poll_interval__ = 0.5
+	__report_suffix__ = '.check.json'
+
+	__process_stop_event = None  # stop event of a pool process
+	__process_io_state = None  # state of the token bucket that is shared by pool processes
+
+	@verify_type(archives=(list, tuple), io_read_rate=(float, int, None), processes=(int, None))
+	@verify_type(workers=(int, None), password=(str, None), read_size=(int, None))
+	@verify_value(archives=lambda x: len(x) > 0, io_read_rate=lambda x: x is None or x > 0)
+	@verify_value(processes=lambda x: x is None or x > 0, workers=lambda x: x is None or x > 0)
+	@verify_type(io_burst=(int, float, None), io_schedule=(WArchiverRateSchedule, None))
+	@verify_type(io_pressure_target=(int, float, None))
+	@verify_value(read_size=lambda x: x is None or x > 0, io_burst=lambda x: x is None or x > 0)
+	@verify_value(io_pressure_target=lambda x: x is None or 0 < x < 100)
+	def __init__(
+		self, archives, logger, stop_event=None, io_read_rate=None, processes=None, workers=None, password=None,
+		read_size=None, io_burst=None, io_schedule=None, io_pressure_target=None
+	):
+		""" Create new checker
+
+		:param archives: paths of archives to check
+		:param logger: logger to use
+		:param stop_event: event that terminates checking
+		:param io_read_rate: total reading rate limit (of all the processes)
+		:param processes: number of processes that check archives concurrently (it is the number of CPUs by
+		default)
+		:param workers: number of threads that check a single archive (by default, CPUs are divided between
+		processes)
+		:param password: password of encrypted repositories
+		:param read_size: size of a single read of every checker thread (see :class:`.WArchiveIntegrityChecker`)
+		:param io_burst: total burst size of the reading rate limit
+		:param io_schedule: total reading rate limits by time of day
+		:param io_pressure_target: stall percentage of I/O and CPU pressure that the adaptive limit of every
+		checker holds
+		"""
+		self.__archives = list(archives)
+		self.__logger = logger
+		self.__stop_event = stop_event
+		self.__io_read_rate = io_read_rate
+		cpu_count = os.cpu_count() or 1
+		self.__processes = min(processes if processes is not None else cpu_count, len(self.__archives))
+		self.__workers = workers if workers is not None else max(cpu_count // self.__processes, 1)
+		self.__password = password
+		self.__read_size = read_size
+		self.__io_burst = io_burst
+		self.__io_schedule = io_schedule
+		self.__io_pressure_target = io_pressure_target
+		self.__checker = None
+		self.__checked_count = None
+
+	def archives(self):
+		return self.__archives.copy()
+
+	def logger(self):
+		return self.__logger
+
+	def stop_event(self):
+		return self.__stop_event
+
+	def io_read_rate(self):
+		return self.__io_read_rate
+
+	def processes(self):
+		return self.__processes
+
+	def workers(self):
+		return self.__workers
+
+	def read_size(self):
+		return self.__read_size
+
+	def io_burst(self):
+		return self.__io_burst
+
+	def io_schedule(self):
+		return self.__io_schedule
+
+	def io_pressure_target(self):
+		return self.__io_pressure_target
+
+	def check_details(self):
+		checker = self.__checker
+		if checker is not None:
+			return checker.check_details()
+		if self.__checked_count is not None:
+			return 'Archives checked: %i of %i' % (self.__checked_count, len(self.__archives))
+
+	def check(self):
+		""" Check archives
+
+		:return: list of reports (in the same order as archives are)
+		"""
+		if self.__processes == 1:
+			return self.__check_sequential()
+		return self.__check_parallel()
+
+	def __check_sequential(self):
+		result = []
+		self.__checked_count = 0
+		try:
+			for archive_path in self.__archives:
+				result.append(self.check_archive(
+					archive_path, self.logger(), stop_event=self.stop_event(), io_read_rate=self.io_read_rate(),
+					workers=self.workers(), password=self.__password, read_size=self.read_size(),
+					io_burst=self.io_burst(), io_schedule=self.io_schedule(),
+					io_pressure_target=self.io_pressure_target(), checker_callback=self.__set_checker
+				))
+				self.__checker = None
+				self.__checked_count += 1
+		finally:
+			self.__checker = None
+			self.__checked_count = None
+		return result
+
+	def __set_checker(self, checker):
+		self.__checker = checker
+
+	def __check_parallel(self):
+		# the token bucket state and the stop event are passed to processes when they are started
+		io_state = WArchiverTokenBucket.shared_state()
+
+		# the stop event of the command can not be shared with other processes, so it is translated
+		process_stop_event = multiprocessing.Event()
+		stop_event = self.stop_event()
+
+		if stop_event is not None and stop_event.is_set():
+			process_stop_event.set()
+
+		self.__checked_count = 0
+		try:
+			with ProcessPoolExecutor(
+				max_workers=self.processes(), initializer=WArchiveBatchChecker._init_process,
+				initargs=(process_stop_event, io_state)
+			) as executor:
+				futures = [
+					executor.submit(
+						WArchiveBatchChecker._check_in_process, x, self.logger(), self.io_read_rate(),
+						self.workers(), self.__password, self.read_size(), self.io_burst(), self.io_schedule(),
+						self.io_pressure_target()
+					) for x in self.__archives
+				]
+				pending = set(futures)
+				while len(pending) > 0:
+					if stop_event is not None and stop_event.is_set():
+						process_stop_event.set()
+					done, pending = wait(pending, timeout=self.__poll_interval__)
+					self.__checked_count += len(done)
+				return [x.result() for x in futures]
+		finally:
+			self.__checked_count = None
+
+	@classmethod
+	def _init_process(cls, stop_event, io_state):
+		cls.__process_stop_event = stop_event
+		cls.__process_io_state = io_state
+
+	@classmethod
+	def _check_in_process(
+		cls, archive_path, logger, io_read_rate, workers, password, read_size, io_burst, io_schedule,
+		io_pressure_target
+	):
+		return cls.check_archive(
+			archive_path, logger, stop_event=cls.__process_stop_event, io_read_rate=io_read_rate, workers=workers,
+			password=password, read_size=read_size, io_burst=io_burst, io_schedule=io_schedule,
+			io_pressure_target=io_pressure_target, io_state=cls.__process_io_state
+		)
+
+	@classmethod
+	def check_archive(
+		cls, archive_path, logger, stop_event=None, io_read_rate=None, workers=None, password=None, read_size=None,
+		io_burst=None, io_schedule=None, io_pressure_target=None, io_state=None, checker_callback=None
+	):
+		""" Check a single archive and return its report
+
+		:param archive_path: archive to check
+		:param logger: logger to use
+		:param stop_event: event that terminates checking
+		:param io_read_rate: reading rate limit
+		:param workers: number of checker threads
+		:param password: password of an encrypted repository
+		:param read_size: size of a single read of every checker thread
+		:param io_burst: burst size of the reading rate limit
+		:param io_schedule: reading rate limits by time of day
+		:param io_pressure_target: stall percentage of I/O and CPU pressure that the adaptive limit holds
+		:param io_state: token bucket state that is shared with other checks (see
+		:meth:`.WArchiverTokenBucket.shared_state`)
+		:param checker_callback: function that is called with the created checker before the check starts
+		:return: dict
+		"""
+		started_at = time.time()
+		report = {
+			WBackupMeta.CheckReportOptions.archive: archive_path,
+			WBackupMeta.CheckReportOptions.check_started: int(started_at)
+		}
+		try:
+			if stop_event is not None and stop_event.is_set():
+				check_result = None
+			else:
+				checker = WArchiveIntegrityChecker(
+					archive_path, logger, stop_event=stop_event, io_read_rate=io_read_rate, workers=workers,
+					password=password, read_size=read_size
+				)
+				checker.set_io_throttling(
+					burst=io_burst, schedule=io_schedule, pressure_target=io_pressure_target, shared_state=io_state
+				)
+				if checker_callback is not None:
+					checker_callback(checker)
+				check_result = checker.check_archive()
+
+			if check_result is None:
+				report[WBackupMeta.CheckReportOptions.check_result] = WBackupMeta.CheckResult.terminated.value
+			else:
+				result, original_hash, calculated_hash = check_result
+				report.update({
+					WBackupMeta.CheckReportOptions.check_result:
+						(WBackupMeta.CheckResult.ok if result is True else WBackupMeta.CheckResult.corrupted).value,
+					WBackupMeta.CheckReportOptions.original_hash: original_hash,
+					WBackupMeta.CheckReportOptions.calculated_hash: calculated_hash,
+					WBackupMeta.CheckReportOptions.corrupted_ranges: [list(x) for x in checker.corrupted_ranges()]
+				})
+		except Exception as e:
+			logger.error('Unable to check archive "%s": %s' % (archive_path, str(e)))
+			report[WBackupMeta.CheckReportOptions.check_result] = WBackupMeta.CheckResult.failed.value
+			report[WBackupMeta.CheckReportOptions.error] = str(e)
+		report[WBackupMeta.CheckReportOptions.check_duration] = round(time.time() - started_at, 3)
+		return report
+
+	@classmethod
+	@verify_type(location=str, pattern=(str, None))
+	@verify_value(location=lambda x: len(x) > 0)
+	def find_archives(cls, location, pattern=None):
+		""" Return paths of archives to check. If location is a directory (or a "file://" URI of a directory), then
+		archives that match the shell pattern are selected from it (volumes of multi-volume archives are skipped).
+		Otherwise location is an archive path
+
+		:param location: archive or directory with archives
+		:param pattern: shell pattern to select archives in a directory with
+		:return: list of str
+		"""
+		if '://' in location:
+			uri = WURI.parse(location)
+			if uri.scheme() != 'file' or uri.path() is None:
+				raise RuntimeError(
+					'Unable to check archives at "%s" - only local archives may be checked' % location
+				)
+			location = uri.path()
+
+		if os.path.isdir(location) is False:
+			return [location]
+
+		result = []
+		for name in sorted(os.listdir(location)):
+			path = os.path.join(location, name)
+			if os.path.isfile(path) is False or name.endswith(cls.__report_suffix__) is True:
+				continue
+			if pattern is None or fnmatch.fnmatchcase(name, pattern) is True:
+				result.append(path)
+
+		volumes = set()
+		for path in result:
+			if WArchiverVolumes.is_manifest(path) is True:
+				volumes.update(WArchiverVolumes.volumes(path))
+		return [x for x in result if x not in volumes]
+
+	@classmethod
+	@verify_type(reports=(list, tuple), report_directory=str)
+	def write_reports(cls, reports, report_directory):
+		""" Write every report to its own JSON file (file is named after the archive)
+
+		:param reports: reports to write
+		:param report_directory: directory to write reports to
+		:return: list of paths of written reports
+		"""
+		os.makedirs(report_directory, exist_ok=True)
+		result = []
+		for report in reports:
+			archive_name = os.path.basename(report[WBackupMeta.CheckReportOptions.archive].rstrip(os.sep))
+			report_path = os.path.join(report_directory, archive_name + cls.__report_suffix__)
+			index = 1
+			while report_path in result:
+				report_path = os.path.join(report_directory, '%s.%i%s' % (archive_name, index, cls.__report_suffix__))
+				index += 1
+			with open(report_path, 'wb') as f:
+				f.write(WBackupMetaProvider.encode_meta(report, strict_cls=WBackupMeta.CheckReportOptions))
+			result.append(report_path)
+		return result
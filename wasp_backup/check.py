@@ -31,48 +31,153 @@ from wasp_general.command.enhanced import WCommandArgumentDescriptor
 from wasp_general.command.result import WPlainCommandResult
 
 
-from wasp_backup.command_common import WBackupCommand
-from wasp_backup.archiver import WArchiveIntegrityChecker
+from wasp_backup.core import WBackupMeta
+from wasp_backup.command_common import __common_args__, WBackupCommand
+from wasp_backup.batch_checker import WArchiveBatchChecker
 
 
 class WCheckBackupCommand(WBackupCommand):
 
 	__command__ = 'check'
-	__description__ = 'check backup archive for integrity'
+	__description__ = 'check backup archives for integrity'
 
 	__arguments__ = [
 		WCommandArgumentDescriptor(
-			'backup-archive', required=True, multiple_values=False, meta_var='archive_path',
-			help_info='backup file to check'
+			'backup-archive', required=True, multiple_values=True, meta_var='archive_path',
+			help_info='backup file to check. It may be a directory (or a "file://" URI) with backups, then every '
+			'backup that matches the "archive-pattern" option is checked. May be specified multiple times'
+		),
+		WCommandArgumentDescriptor(
+			'archive-pattern', meta_var='shell_pattern',
+			help_info='shell pattern that selects archives in a directory (like "*.tar.gz"). All the files are '
+			'selected by default'
+		),
+		WCommandArgumentDescriptor(
+			'processes', meta_var='processes_count',
+			help_info='number of processes that check archives concurrently (when several archives are checked). '
+			'It is the number of CPUs by default',
+			casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+				validate_fn=lambda x: x > 0
+			)
+		),
+		WCommandArgumentDescriptor(
+			'report-directory', meta_var='directory_path',
+			help_info='directory to write reports to. A JSON report is written for every checked archive'
 		),
 		WCommandArgumentDescriptor(
 			'io-read-rate', meta_var='maximum reading rate',
-			help_info='use this parameter to limit disk I/O load (bytes per second). You can use '
+			help_info='use this parameter to limit disk I/O load (bytes per second). The limit is shared by '
+			'all the archives that are checked concurrently. You can use '
 			'suffixes like "K" for kibibytes, "M" for mebibytes, "G" for gibibytes, "T" for tebibytes for '
 			'convenience ', casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+		),
+		__common_args__['io-burst'],
+		__common_args__['io-schedule'],
+		__common_args__['io-pressure-target'],
+		WCommandArgumentDescriptor(
+			'workers', meta_var='threads_count',
+			help_info='number of threads that check archive segments in parallel (for archives that were created '
+			'with the "hash-chunk-size" option). By default, CPUs are divided between processes',
+			casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+				validate_fn=lambda x: x > 0
+			)
+		),
+		WCommandArgumentDescriptor(
+			'read-size', meta_var='buffer_size',
+			help_info='size of a single read of every checker thread. Archives are read into buffers of this size '
+			'that are allocated once, so it limits memory usage (compressed archives with chunked hashing are read '
+			'by whole chunks). It is 1 mebibyte by default. You can use suffixes like "K" for kibibytes, "M" for '
+			'mebibytes, "G" for gibibytes, "T" for tebibytes for convenience',
+			casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+		),
+		WCommandArgumentDescriptor(
+			'password', meta_var='encryption_password',
+			help_info='password of an encrypted repository (for archives that are stored in a repository)'
 		)
 	]
 
+	def __init__(self, logger):
+		WBackupCommand.__init__(self, logger)
+		self.__checker = None
+
 	def checker(self):
 		return self.__checker
 
 	def _exec(self, command_arguments, **command_env):
-		archive = command_arguments['backup-archive']
+		pattern = None
+		if 'archive-pattern' in command_arguments.keys():
+			pattern = command_arguments['archive-pattern']
+
+		archives = []
+		for location in command_arguments['backup-archive']:
+			archives.extend(WArchiveBatchChecker.find_archives(location, pattern=pattern))
+		if len(archives) == 0:
+			return WPlainCommandResult.error('No archives were found')
+
 		io_read_rate = None
 		if 'io-read-rate' in command_arguments.keys():
 			io_read_rate = command_arguments['io-read-rate']
+		io_burst, io_schedule, io_pressure_target = self._io_throttling(command_arguments)
+
+		processes = None
+		if 'processes' in command_arguments.keys():
+			processes = command_arguments['processes']
+
+		workers = None
+		if 'workers' in command_arguments.keys():
+			workers = command_arguments['workers']
+
+		read_size = None
+		if 'read-size' in command_arguments.keys():
+			read_size = int(command_arguments['read-size'])
+
+		password = None
+		if 'password' in command_arguments.keys():
+			password = command_arguments['password']
 
 		try:
-			self.__checker = WArchiveIntegrityChecker(
-				archive, self.logger(), stop_event=self.stop_event(), io_read_rate=io_read_rate
+			self.__checker = WArchiveBatchChecker(
+				archives, self.logger(), stop_event=self.stop_event(), io_read_rate=io_read_rate,
+				processes=processes, workers=workers, password=password, read_size=read_size, io_burst=io_burst,
+				io_schedule=io_schedule, io_pressure_target=io_pressure_target
 			)
-			result, original_hash, calculated_hash = self.__checker.check_archive()
+			reports = self.__checker.check()
 		finally:
 			self.__checker = None
 
-		if result is True:
-			return WPlainCommandResult('Archive "%s" is OK' % archive)
-		return WPlainCommandResult.error(
-			'Archive "%s" is corrupted. Calculated hash - "%s". Original hash - "%s"' %
-			(archive, calculated_hash, original_hash)
+		if 'report-directory' in command_arguments.keys():
+			WArchiveBatchChecker.write_reports(reports, command_arguments['report-directory'])
+
+		messages = [self.report_message(x) for x in reports]
+		failed_reports = [
+			x for x in reports
+			if x[WBackupMeta.CheckReportOptions.check_result] != WBackupMeta.CheckResult.ok.value
+		]
+		if len(reports) > 1:
+			messages.append('Archives checked: %i, failed: %i' % (len(reports), len(failed_reports)))
+
+		if len(failed_reports) == 0:
+			return WPlainCommandResult('\n'.join(messages))
+		return WPlainCommandResult.error('\n'.join(messages))
+
+	@classmethod
+	def report_message(cls, report):
+		archive = report[WBackupMeta.CheckReportOptions.archive]
+		check_result = WBackupMeta.CheckResult(report[WBackupMeta.CheckReportOptions.check_result])
+
+		if check_result == WBackupMeta.CheckResult.ok:
+			return 'Archive "%s" is OK' % archive
+		elif check_result == WBackupMeta.CheckResult.terminated:
+			return 'Unable to check archive "%s" - task terminated' % archive
+		elif check_result == WBackupMeta.CheckResult.failed:
+			return 'Unable to check archive "%s": %s' % (archive, report[WBackupMeta.CheckReportOptions.error])
+
+		result = 'Archive "%s" is corrupted. Calculated hash - "%s". Original hash - "%s"' % (
+			archive, report[WBackupMeta.CheckReportOptions.calculated_hash],
+			report[WBackupMeta.CheckReportOptions.original_hash]
 		)
+		corrupted_ranges = report[WBackupMeta.CheckReportOptions.corrupted_ranges]
+		if len(corrupted_ranges) > 0:
+			result += '\nCorrupted byte ranges: %s' % \
+				', '.join(['%i-%i' % (start, end - 1) for start, end in corrupted_ranges])
+		return result
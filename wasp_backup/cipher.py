@@ -35,20 +35,31 @@ from wasp_backup.core import WBackupMeta
 
 
 class WBackupCipher:
+	""" Archive cipher. Derived key material is twice as long as the cipher requires - the first half is the
+	archive key (and the initialization sequence), the second half is used for additional archive data (like the
+	member index), so that the same key stream is never reused. The first half does not depend on the derived
+	length (PBKDF2 property), so archives of previous versions are decrypted the same way
+	"""
 
 	__pbkdf2_iterations_count__ = 10000
 	__hmac_hash_generator_name__ = 'SHA256'
 
-	def __init__(self, cipher_name, password):
+	def __init__(self, cipher_name, password, salt=None):
 		self.__cipher_name = cipher_name
 		aes_key_size, aes_mode = WAESMode.parse_cipher_name(cipher_name)
 		init_seq_length = WAESMode.init_sequence_length(aes_key_size, aes_mode)
 		kdf = WPBKDF2(
-			password, derived_key_length=init_seq_length,
+			password, salt=salt, derived_key_length=(init_seq_length * 2),
 			hmac=WHMAC(self.__hmac_hash_generator_name__), iterations_count=self.__pbkdf2_iterations_count__
 		)
 		self.__salt = kdf.salt()
-		self.__aes = WAES(WAESMode(aes_key_size, aes_mode, kdf.derived_key(), padding=WZeroPadding()))
+		derived_key = kdf.derived_key()
+		self.__aes = WAES(
+			WAESMode(aes_key_size, aes_mode, derived_key[:init_seq_length], padding=WZeroPadding())
+		)
+		self.__auxiliary_aes = WAES(
+			WAESMode(aes_key_size, aes_mode, derived_key[init_seq_length:], padding=WZeroPadding())
+		)
 
 	def cipher_name(self):
 		return self.__cipher_name
@@ -59,6 +70,9 @@ class WBackupCipher:
 	def aes_cipher(self):
 		return self.__aes
 
+	def auxiliary_cipher(self):
+		return self.__auxiliary_aes
+
 	def meta(self):
 		salt = ''
 		for salt_byte in self.salt():
@@ -32,6 +32,7 @@ import sys
 import shlex
 from datetime import datetime
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from wasp_general.verify import verify_type
 from wasp_general.uri import WURI
@@ -44,7 +45,11 @@ from wasp_general.command.result import WPlainCommandResult
 from wasp_general.command.enhanced import WEnhancedCommand
 
 from wasp_backup.core import WBackupMeta, WBackupMetaProvider
+from wasp_backup.io import WArchiverCompression, WArchiverHash, WArchiverVolumes, WArchiverRateSchedule
+from wasp_backup.io import WArchiverPressureController
+from wasp_backup.io_priority import WArchiverIOPriority
 from wasp_backup.notify import notify
+from wasp_backup.repository import WArchiverRepository
 
 
 class WCompressionArgumentHelper(WCommandArgumentDescriptor.ArgumentCastingHelper):
@@ -62,12 +67,42 @@ class WCompressionArgumentHelper(WCommandArgumentDescriptor.ArgumentCastingHelpe
 			return WBackupMeta.Archive.CompressionMode.gzip
 		elif value == 'bzip2':
 			return WBackupMeta.Archive.CompressionMode.bzip2
+		elif value in ('xz', 'zstd', 'lz4'):
+			compression_mode = WBackupMeta.Archive.CompressionMode[value]
+			WArchiverCompression.check_availability(compression_mode)
+			return compression_mode
 		elif value == 'disabled':
 			return
 		else:
 			raise ValueError('Invalid compression value')
 
 
+class WRateScheduleArgumentHelper(WCommandArgumentDescriptor.ArgumentCastingHelper):
+
+	def __init__(self):
+		WCommandArgumentDescriptor.ArgumentCastingHelper.__init__(
+			self, casting_fn=self.cast_string
+		)
+
+	@staticmethod
+	@verify_type(value=str)
+	def cast_string(value):
+		return WArchiverRateSchedule.parse(value, WCommandArgumentDescriptor.DataSizeArgumentHelper.cast_string)
+
+
+class WIOPriorityArgumentHelper(WCommandArgumentDescriptor.ArgumentCastingHelper):
+
+	def __init__(self):
+		WCommandArgumentDescriptor.ArgumentCastingHelper.__init__(
+			self, casting_fn=self.cast_string
+		)
+
+	@staticmethod
+	@verify_type(value=str)
+	def cast_string(value):
+		return WArchiverIOPriority.parse(value)
+
+
 def cipher_name_validation(cipher_name):
 	try:
 		if WAESMode.parse_cipher_name(cipher_name) is not None:
@@ -80,7 +115,7 @@ def cipher_name_validation(cipher_name):
 __common_args__ = {
 	'backup-archive': WCommandArgumentDescriptor(
 		'backup-archive', required=True, multiple_values=False, meta_var='archive_path',
-		help_info='backup file path'
+		help_info='backup file path. If it is "-", then archive is written to stdout as a stream'
 	),
 
 	'input-files': WCommandArgumentDescriptor(
@@ -95,10 +130,40 @@ __common_args__ = {
 
 	'compression': WCommandArgumentDescriptor(
 		'compression', meta_var='compression_type',
-		help_info='compression option. One of: "gzip", "bzip2" or "disabled". It is disabled by default',
+		help_info='compression option. One of: "gzip", "bzip2", "xz", "zstd", "lz4" or "disabled". It is '
+		'disabled by default. "zstd" and "lz4" are available if the "zstandard" and "lz4" python modules are '
+		'installed',
 		casting_helper=WCompressionArgumentHelper()
 	),
 
+	'compression-level': WCommandArgumentDescriptor(
+		'compression-level', meta_var='level',
+		help_info='compression level. Valid values depend on compression: 0-9 for "gzip" and "xz", 1-9 for '
+		'"bzip2", 1-22 for "zstd", 0-16 for "lz4". By default - 9 for "gzip" and "bzip2", 6 for "xz", 3 for '
+		'"zstd" and 0 for "lz4"',
+		casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper()
+	),
+
+	'compression-workers': WCommandArgumentDescriptor(
+		'compression-workers', meta_var='threads_count',
+		help_info='number of threads that compress data in parallel. With more than one thread data is split '
+		'into independently compressed blocks (the result is still a regular gzip/bzip2 file). Single-threaded '
+		'compression is used by default',
+		casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+			validate_fn=lambda x: x > 0
+		)
+	),
+
+	'pipeline-buffers': WCommandArgumentDescriptor(
+		'pipeline-buffers', meta_var='buffers_count',
+		help_info='if specified, every archiving stage (hashing, encryption, compression, writing) runs in a '
+		'separate thread. Stages exchange data with 1 MiB buffers, and this option limits the number of buffers '
+		'that may be queued between two stages. By default all the stages run sequentially in a single thread',
+		casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+			validate_fn=lambda x: x > 0
+		)
+	),
+
 	'password': WCommandArgumentDescriptor(
 		'password', meta_var='encryption_password',
 		help_info='password to encrypt backup. Backup is not encrypted by default'
@@ -114,6 +179,27 @@ __common_args__ = {
 		default_value='AES-256-CBC'
 	),
 
+	'hash-algorithm': WCommandArgumentDescriptor(
+		'hash-algorithm', meta_var='algorithm_name',
+		help_info='hash function that will be used for archive integrity check. Available algorithms are: '
+		'%s (XXH3 algorithms are available only if "xxhash" module is installed, they are not cryptographic '
+		'ones and may detect data corruption only). It is "MD5" by default' %
+		', '.join(['"%s"' % x for x in sorted(WArchiverHash.__generators__.keys())]),
+		casting_helper=WCommandArgumentDescriptor.StringArgumentCastingHelper(
+			validate_fn=WArchiverHash.available
+		),
+		default_value='MD5'
+	),
+
+	'hash-chunk-size': WCommandArgumentDescriptor(
+		'hash-chunk-size', meta_var='chunk_size',
+		help_info='if specified, archive data is hashed in segments of the given size, so the archive may be '
+		'checked by several threads at once and corrupted segments may be located. You can use suffixes like '
+		'"K" for kibibytes, "M" for mebibytes, "G" for gibibytes, "T" for tebibytes for convenience ("64M" is a '
+		'reasonable value). By default data is hashed as a whole',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
 	'io-write-rate': WCommandArgumentDescriptor(
 		'io-write-rate', meta_var='maximum writing rate',
 		help_info='use this parameter to limit disk I/O load (bytes per second). You can use '
@@ -121,10 +207,123 @@ __common_args__ = {
 		'convenience ', casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
 	),
 
+	'io-burst': WCommandArgumentDescriptor(
+		'io-burst', meta_var='burst_size',
+		help_info='number of bytes that may be processed at once when I/O rate is limited (by the "io-write-rate", '
+		'"io-read-rate" or "io-schedule" options). It is one second of the current rate by default. You can use '
+		'suffixes like "K" for kibibytes, "M" for mebibytes, "G" for gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
+	'io-schedule': WCommandArgumentDescriptor(
+		'io-schedule', meta_var='rate_schedule',
+		help_info='I/O rate limits by time of day (local time) like "08:00-20:00=50M,20:00-08:00=unlimited". '
+		'Every window has its own limit that takes effect as soon as the window starts (even in the middle of a '
+		'backup). The first matching window is used, outside of windows the limit of the "io-write-rate" (or '
+		'"io-read-rate") option is used. You can use suffixes like "K" for kibibytes, "M" for mebibytes, "G" for '
+		'gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WRateScheduleArgumentHelper()
+	),
+
+	'io-pressure-target': WCommandArgumentDescriptor(
+		'io-pressure-target', meta_var='stall_percentage',
+		help_info='if specified, then I/O rate is adjusted to hold the given stall percentage of I/O and CPU '
+		'pressure (Linux pressure stall information from "/proc/pressure" is used). The rate is decreased when '
+		'the host is under pressure and it is raised back up to the "io-write-rate" (or "io-read-rate" and '
+		'"io-schedule") limit otherwise',
+		casting_helper=WCommandArgumentDescriptor.FloatArgumentCastingHelper(
+			validate_fn=lambda x: 0 < x < 100
+		)
+	),
+
+	'source-read-rate': WCommandArgumentDescriptor(
+		'source-read-rate', meta_var='maximum reading rate',
+		help_info='use this parameter to limit the rate of source reading (bytes per second), so that backup '
+		'reads do not disturb other applications. Unlike the "io-write-rate" option, it limits data before '
+		'compression (files or output of a program as they are archived). You can use suffixes like "K" for '
+		'kibibytes, "M" for mebibytes, "G" for gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
+	'io-priority': WCommandArgumentDescriptor(
+		'io-priority', meta_var='priority',
+		help_info='Linux I/O priority of archiving (threads and programs that are started by archiving inherit '
+		'it): "idle" (disk is used only when nobody else needs it) or "best-effort" with an optional level from '
+		'0 (the highest) to 7 (the lowest) like "best-effort:7". The priority is respected by I/O schedulers that '
+		'support priorities (like BFQ) only',
+		casting_helper=WIOPriorityArgumentHelper()
+	),
+
+	'repository': WCommandArgumentDescriptor(
+		'repository', meta_var='repository_path',
+		help_info='if specified, archive is stored in the given deduplicating repository (a directory that is '
+		'created if it does not exist) and the archive file itself is a manifest with references to repository '
+		'chunks. Data is split into content-defined chunks, every chunk is stored once, so archives of slightly '
+		'changed data share most of the chunks. The "compression", "compression-level", "password" and '
+		'"cipher_algorithm" options are applied to chunks when repository is created, later they are taken from '
+		'the repository (the password is required for an encrypted repository anyway). "fastcdc" python module '
+		'is required'
+	),
+
+	'repository-chunk-size': WCommandArgumentDescriptor(
+		'repository-chunk-size', meta_var='chunk_size',
+		help_info='average chunk size of a new repository (chunks are from 1/4 to 4 times of this size). It is '
+		'1 mebibyte by default. You can use suffixes like "K" for kibibytes, "M" for mebibytes, "G" for '
+		'gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
 	'copy-to': WCommandArgumentDescriptor(
 		'copy-to', meta_var='URL', help_info='Location to copy backup archive to'
 	),
 
+	'volume-size': WCommandArgumentDescriptor(
+		'volume-size', meta_var='volume_size',
+		help_info='if specified, archive is split into volumes of the given size (files with ".000", ".001"... '
+		'suffixes) and the archive file itself is a manifest that describes volumes. You can use suffixes like '
+		'"K" for kibibytes, "M" for mebibytes, "G" for gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
+	'stream-part-size': WCommandArgumentDescriptor(
+		'stream-part-size', meta_var='part_size',
+		help_info='if specified, archive is written without seeking back (this mode is used always when archive '
+		'is written to stdout). Data is split into tar members of the given size at most, every member is kept in '
+		'memory before it is written. You can use suffixes like "K" for kibibytes, "M" for mebibytes, "G" for '
+		'gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
+	'compression-frame-size': WCommandArgumentDescriptor(
+		'compression-frame-size', meta_var='frame_size',
+		help_info='if specified, then data is compressed as independent frames of the given size and the frame '
+		'index is saved to the archive, so any part of the archive may be read without decompressing of the previous '
+		'data (this is supported for the default archive layout only). You can use suffixes like "K" for kibibytes, '
+		'"M" for mebibytes, "G" for gibibytes, "T" for tebibytes for convenience',
+		casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+	),
+
+	'copy-workers': WCommandArgumentDescriptor(
+		'copy-workers', meta_var='uploads_count',
+		help_info='number of volumes that are uploaded to the "copy-to" location at the same time. Volumes are '
+		'uploaded as soon as they are written. It is 2 by default',
+		casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+			validate_fn=lambda x: x > 0
+		),
+		default_value='2'
+	),
+
+	'copy-stream': WCommandArgumentDescriptor(
+		'copy-stream', flag_mode=True, help_info='if specified, then archive is uploaded to the "copy-to" '
+		'location while it is created (archive is not read back from a disk). Such archive is written without '
+		'seeking back (like with the "stream-part-size" option)'
+	),
+
+	'no-local-copy': WCommandArgumentDescriptor(
+		'no-local-copy', flag_mode=True, help_info='if specified with the "copy-stream" option, then archive is '
+		'uploaded only and the local archive is not created. The archive file name is used as a remote file name'
+	),
+
 	'copy-fail': WCommandArgumentDescriptor(
 		'copy-fail', flag_mode=True, help_info='If specified, then backup will fail if copy operation fails. '
 		'(But local archive would not be deleted any way)',
@@ -159,6 +358,28 @@ class WBackupCommand(WEnhancedCommand):
 			self.__stop_event = value
 		return self.__stop_event
 
+	def _io_throttling(self, command_arguments):
+		""" Return burst size, schedule and pressure target of I/O rate limit (the "io-burst", "io-schedule" and
+		"io-pressure-target" options)
+		"""
+		io_burst = None
+		if 'io-burst' in command_arguments.keys():
+			io_burst = int(command_arguments['io-burst'])
+
+		io_schedule = None
+		if 'io-schedule' in command_arguments.keys():
+			io_schedule = command_arguments['io-schedule']
+
+		io_pressure_target = None
+		if 'io-pressure-target' in command_arguments.keys():
+			io_pressure_target = command_arguments['io-pressure-target']
+			if WArchiverPressureController.available() is False:
+				self.logger().warning(
+					'Pressure stall information is unavailable, so I/O rate will not be adjusted to the pressure'
+				)
+
+		return io_burst, io_schedule, io_pressure_target
+
 
 # noinspection PyAbstractClass
 class WCreateBackupCommand(WBackupCommand):
@@ -166,6 +387,84 @@ class WCreateBackupCommand(WBackupCommand):
 	class UploadFailed(Exception):
 		pass
 
+	class VolumeUploader:
+		""" Uploads volumes of a multi-volume archive in parallel. Every volume is uploaded with its own network
+		client. The manifest is uploaded after all the volumes
+		"""
+
+		def __init__(self, archive_path, copy_to, workers):
+			self.__archive_path = archive_path
+			self.__copy_to = copy_to
+			self.__executor = ThreadPoolExecutor(max_workers=workers)
+			self.__uploads = []
+			self.__started_at = None
+
+		def upload(self, volume_path):
+			if self.__started_at is None:
+				self.__started_at = datetime.utcnow()
+			self.__uploads.append(self.__executor.submit(self.__upload, volume_path))
+
+		def complete(self):
+			try:
+				volumes_result = all([x.result() for x in self.__uploads])
+				copy_result = volumes_result is True and self.__upload(self.__archive_path) is True
+				started_at = self.__started_at if self.__started_at is not None else datetime.utcnow()
+				return copy_result, (datetime.utcnow() - started_at).total_seconds()
+			finally:
+				self.__executor.shutdown()
+
+		def cancel(self):
+			for upload in self.__uploads:
+				upload.cancel()
+			self.__executor.shutdown()
+
+		def __upload(self, file_path):
+			try:
+				uri = WURI.parse(self.__copy_to)
+				if uri.path() is None:
+					return False
+				dir_name, file_name = os.path.split(uri.path())
+				uri.component(WURI.Component.path, dir_name)
+				file_name += file_path[len(self.__archive_path):]  # volume suffix
+
+				network_client = __default_client_collection__.open(uri)
+				with open(file_path, 'rb') as f:
+					return network_client.request(WCommonNetworkClientCapability.upload_file, file_name, f)
+			except WNetworkClientProto.ConnectionError:
+				return False
+
+	class StreamUploader:
+		""" Uploads archive while it is created (is used as an archive stream consumer)
+		"""
+
+		def __init__(self, copy_to):
+			self.__copy_to = copy_to
+			self.__result = False
+			self.__started_at = None
+			self.__finished_at = None
+
+		def upload(self, archive_stream):
+			self.__started_at = datetime.utcnow()
+			try:
+				uri = WURI.parse(self.__copy_to)
+				if uri.path() is not None:
+					dir_name, file_name = os.path.split(uri.path())
+					uri.component(WURI.Component.path, dir_name)
+
+					network_client = __default_client_collection__.open(uri)
+					self.__result = network_client.request(
+						WCommonNetworkClientCapability.upload_file, file_name, archive_stream
+					)
+			except WNetworkClientProto.ConnectionError:
+				pass
+			finally:
+				self.__finished_at = datetime.utcnow()
+
+		def result(self):
+			if self.__started_at is None or self.__finished_at is None:
+				return False, -1
+			return self.__result is True, (self.__finished_at - self.__started_at).total_seconds()
+
 	def __init__(self, logger):
 		WBackupCommand.__init__(self, logger)
 		self.__archiver = None
@@ -176,19 +475,83 @@ class WCreateBackupCommand(WBackupCommand):
 	def set_archiver(self, value):
 		self.__archiver = value
 
+	def _open_repository(self, command_arguments, compression_mode=None, compression_level=None):
+		""" Open (or create) repository that is specified by the "repository" option. None is returned if
+		there is no such option
+		"""
+		if 'repository' not in command_arguments.keys():
+			return None
+		repository_path = command_arguments['repository']
+
+		password = None
+		if 'password' in command_arguments.keys():
+			password = command_arguments['password']
+
+		if WArchiverRepository.exists(repository_path) is True:
+			return WArchiverRepository.open(repository_path, password=password)
+
+		chunk_size = None
+		if 'repository-chunk-size' in command_arguments.keys():
+			chunk_size = int(command_arguments['repository-chunk-size'])
+
+		self.logger().info('Creating repository "%s"' % repository_path)
+		return WArchiverRepository.create(
+			repository_path, chunk_size=chunk_size, compression_mode=compression_mode,
+			compression_level=compression_level, password=password,
+			cipher_name=command_arguments['cipher_algorithm']
+		)
+
 	def _create_backup(self, command_arguments, *args, **kwargs):
 		archiver = self.archiver()
 		if archiver is None:
 			raise RuntimeError('Archiver must be set before call')
 
-		try:
-			backup_started_at = datetime.utcnow()
-			archiver.archive(*args, **kwargs)
-			backup_duration = (datetime.utcnow() - backup_started_at).seconds
+		io_burst, io_schedule, io_pressure_target = self._io_throttling(command_arguments)
+		archiver.set_io_throttling(burst=io_burst, schedule=io_schedule, pressure_target=io_pressure_target)
 
+		if 'source-read-rate' in command_arguments.keys():
+			archiver.set_source_read_rate(int(command_arguments['source-read-rate']))
+
+		if 'io-priority' in command_arguments.keys():
+			if WArchiverIOPriority.available() is True:
+				archiver.set_io_priority(command_arguments['io-priority'])
+			else:
+				self.logger().warning('I/O priorities are not supported, so the "io-priority" option is ignored')
+
+		try:
 			copy_to = None
 			if 'copy-to' in command_arguments.keys():
 				copy_to = command_arguments['copy-to']
+				if archiver.archive_path() == WBackupMeta.Archive.__stdout_path__:
+					raise ValueError('Archive that is written to stdout can not be copied')
+				if archiver.repository() is not None:
+					raise ValueError('Archive that is stored in a repository can not be copied')
+
+			volume_uploader = None
+			if copy_to is not None and archiver.volume_size() is not None:
+				# volumes are uploaded while the rest of archive is written
+				volume_uploader = WCreateBackupCommand.VolumeUploader(
+					archiver.archive_path(), copy_to, command_arguments['copy-workers']
+				)
+				archiver.set_volume_callback(volume_uploader.upload)
+
+			stream_uploader = None
+			if 'copy-stream' in command_arguments.keys() and command_arguments['copy-stream'] is True:
+				if copy_to is None:
+					raise ValueError('The "copy-stream" option requires the "copy-to" option')
+				local_copy = 'no-local-copy' not in command_arguments.keys() or \
+					command_arguments['no-local-copy'] is False
+				stream_uploader = WCreateBackupCommand.StreamUploader(copy_to)
+				archiver.set_stream_consumer(stream_uploader.upload, local_copy=local_copy)
+
+			backup_started_at = datetime.utcnow()
+			try:
+				archiver.archive(*args, **kwargs)
+			except Exception:
+				if volume_uploader is not None:
+					volume_uploader.cancel()
+				raise
+			backup_duration = (datetime.utcnow() - backup_started_at).seconds
 
 			notify_app = None
 			if 'notify-app' in command_arguments.keys():
@@ -205,7 +568,12 @@ class WCreateBackupCommand(WBackupCommand):
 					backup_duration=backup_duration
 				)
 
-			copy_result, copy_duration = self.__copy(archiver.archive_path(), copy_to)
+			if volume_uploader is not None:
+				copy_result, copy_duration = volume_uploader.complete()
+			elif stream_uploader is not None:
+				copy_result, copy_duration = stream_uploader.result()
+			else:
+				copy_result, copy_duration = self.__copy(archiver.archive_path(), copy_to)
 
 			if copy_result is True:
 				backup_result = \
@@ -262,7 +630,10 @@ class WCreateBackupCommand(WBackupCommand):
 		meta_data = archiver.meta()
 		meta_data[WBackupMeta.BackupNotificationOptions.created_archive] = archiver.archive_path()
 		meta_data[WBackupMeta.BackupNotificationOptions.backup_duration] = backup_duration
-		meta_data[WBackupMeta.BackupNotificationOptions.total_archive_size] = os.stat(archiver.archive_path()).st_size
+		total_archive_size = None
+		if os.path.isfile(archiver.archive_path()) is True:
+			total_archive_size = WArchiverVolumes.archive_size(archiver.archive_path())
+		meta_data[WBackupMeta.BackupNotificationOptions.total_archive_size] = total_archive_size
 		meta_data[WBackupMeta.BackupNotificationOptions.copy_to] = copy_to
 		meta_data[WBackupMeta.BackupNotificationOptions.copy_completion] = copy_complete
 		meta_data[WBackupMeta.BackupNotificationOptions.copy_duration] = copy_duration
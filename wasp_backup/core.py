@@ -38,32 +38,92 @@ class WBackupMeta:
 		class CompressionMode(Enum):
 			gzip = 'gz'
 			bzip2 = 'bz2'
+			xz = 'xz'
+			zstd = 'zst'
+			lz4 = 'lz4'
+
+		class Layout(Enum):
+			encryption_compression = 1  # data is encrypted and then compressed (archives without
+			# "archive_layout" meta option have this layout)
+			compression_encryption = 2  # data is compressed and then encrypted
+
+		class BackupMode(Enum):
+			full = 'full'  # all the files are archived
+			incremental = 'incremental'  # files that were changed since the last backup are archived
+			differential = 'differential'  # files that were changed since the last full backup are archived
+
+		class ProgramMemberOptions(Enum):
+			program = 'program'  # command of a program which output is stored in a member
+			compression_mode = 'compression_mode'  # one of WBackupMeta.Archive.CompressionMode values or None
+			compression_level = 'compression_level'
+			return_code = 'return_code'
+			size = 'size'  # size of the program output
+			stored_size = 'stored_size'  # size of the member (of the compressed output)
+			hash_value = 'hash_value'  # hash value of the program output (the "hash_algorithm" algorithm is used)
+
+		class IORateOptions(Enum):
+			rate = 'rate'  # average write rate
+			rate_limit = 'rate_limit'  # effective rate limit when archive was written (None means unlimited)
+			pressure_target = 'pressure_target'  # stall percentage that the adaptive limit holds
+			io_pressure = 'io_pressure'  # the last reading of I/O pressure (stall percentage)
+			cpu_pressure = 'cpu_pressure'  # the last reading of CPU pressure (stall percentage)
 
 		class MetaOptions(Enum):
 			creation_time = 'creation_time'  # unix time of archive creation (for UTC timezone)
 			inside_filename = 'inside_filename'
 			inside_tar = 'inside_tar'
 			archived_files = 'archived_files'
-			archived_program = 'archived_program'
+			archived_program = 'archived_program'  # command of a program (or list of commands if output of
+			# several programs is archived)
+			program_members = 'program_members'  # information about members of an archive with output of several
+			# programs, member names are keys and values are dicts with WBackupMeta.Archive.ProgramMemberOptions keys
 			uncompressed_archive_size = 'uncompressed_archive_size'  # size of uncompressed data
 			# (for inside_tar archive, this is a size of uncompressed inside tar, which is rounded to 10240)
 			compression_mode = 'compression_mode'
+			compression_level = 'compression_level'
+			compressed_archive_size = 'compressed_archive_size'  # size of compressed data before encryption
+			# (is saved for "compression_encryption" layout only)
+			compression_frame_size = 'compression_frame_size'  # size of independently compressed frames (is saved
+			# for seekable compressed archives only, they have the frame index)
+			archive_layout = 'archive_layout'  # one of WBackupMeta.Archive.Layout values
 			hash_algorithm = 'hash_algorithm'
-			hash_value = 'hash_value'  # hash value of uncompressed inside archive (for
-			# inside_tar archive, this is a hash of uncompressed inside tar)
+			hash_value = 'hash_value'  # for "encryption_compression" layout - hash value of uncompressed inside
+			# archive (for inside_tar archive, this is a hash of uncompressed inside tar). For
+			# "compression_encryption" layout - hash value of inside archive as it is stored. If chunked hashing is
+			# used, then this is a root digest - hash value of concatenated (binary) chunk digests
+			hash_chunk_size = 'hash_chunk_size'  # size of hashed segments (is saved for chunked hashing only)
+			hash_chunks = 'hash_chunks'  # list of segment digests (is saved for chunked hashing only)
+			volume_size = 'volume_size'  # size of archive volumes (is saved for multi-volume archives only)
+			inside_file_parts = 'inside_file_parts'  # number of members the inside file is split into (streaming)
+			backup_mode = 'backup_mode'  # one of WBackupMeta.Archive.BackupMode values (file index is used)
+			deleted_files = 'deleted_files'  # files that were deleted since the base backup (for incremental and
+			# differential backups)
+			extra_members = 'extra_members'  # data offsets and sizes of archive members that are written before
+			# the meta file (like the member index), member names are keys
 			snapshot_used = 'snapshot_used'
 			original_lv_uuid = 'original_lv_uuid'
-			io_write_rate = 'io_write_rate'
+			io_write_rate = 'io_write_rate'  # average write rate. If the adaptive rate limit is used, then this is a
+			# dict with WBackupMeta.Archive.IORateOptions keys
+			source_read_rate = 'source_read_rate'  # average rate of uncompressed archive data (is saved if the
+			# source reading rate is limited)
+			program_stall_time = 'program_stall_time'  # seconds the archived program was blocked by the full pipe
+			# (estimated, is saved for the high-throughput ingestion of a program output only)
+			archiver_stall_time = 'archiver_stall_time'  # seconds the archiver waited for the program output (is
+			# saved for the high-throughput ingestion of a program output only)
 			pbkdf2_salt = 'pbkdf2_salt'
 			pbkdf2_prf = 'pbkdf2_prf'
 			pbkdf2_iterations_count = 'pbkdf2_iterations_count'
 			cipher_algorithm = 'cipher_algorithm'
 
 		__meta_filename__ = 'meta.json'
+		__member_index_filename__ = 'index.bin'
+		__frame_index_filename__ = 'frames.bin'
+		__stdout_path__ = '-'  # archive path that means that archive is written to stdout
 		__maximum_meta_file_size__ = 50 * 1024 * 1024
 		__basic_inside_file_name__ = 'archive'
 		__file_mode__ = int('660', base=8)
 		__hash_generator_name__ = 'MD5'
+		__default_layout__ = Layout.compression_encryption
 
 	class BackupNotificationOptions(Enum):
 		created_archive = 'created_archive'
@@ -78,6 +138,23 @@ class WBackupMeta:
 		kept_archives = 'kept_archives'
 		removed_archives = 'removed_archives'
 
+	class CheckResult(Enum):
+		ok = 'ok'
+		corrupted = 'corrupted'
+		failed = 'failed'  # archive was not checked because of an error
+		terminated = 'terminated'
+
+	class CheckReportOptions(Enum):
+		archive = 'archive'
+		check_result = 'check_result'  # one of WBackupMeta.CheckResult values
+		original_hash = 'original_hash'
+		calculated_hash = 'calculated_hash'
+		corrupted_ranges = 'corrupted_ranges'  # pairs of the first byte offset and the next after the last
+		# byte offset of corrupted segments (offsets are related to the hashed data)
+		error = 'error'
+		check_started = 'check_started'  # unix time of the check start
+		check_duration = 'check_duration'
+
 	class LVMSnapshot:
 		__default_snapshot_size__ = 0.1
 		__mount_directory_prefix__ = 'wasp-backup-'
@@ -92,6 +169,13 @@ class WBackupMetaProvider:
 	def meta(self):
 		return {}
 
+	def extra_members(self):
+		""" Return archive members that are written before the meta file
+
+		:return: list of pairs - member name and member data (bytes)
+		"""
+		return []
+
 	@classmethod
 	def encode_meta(cls, meta, strict_cls=None):
 		result = {}
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/digest_cache.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import sqlite3
+import threading
+
+from wasp_general.verify import verify_type, verify_value
+
+
+class WArchiverDigestCache:
+	""" Persistent (SQLite) cache of file digests. A digest is valid while the file has the same device, inode,
+	size, modification and change times, so digests of untouched files are not calculated again. Every opening of
+	the cache is a new generation, entries that are used are marked with the current generation, and the least
+	recently used entries are removed on close when the cache has more than "maximum_entries" entries.
+	Methods may be called from several threads
+	"""
+
+	__default_maximum_entries__ = 1000000
+
+	__schema__ = (
+		'CREATE TABLE IF NOT EXISTS digests ('
+		'device INTEGER NOT NULL, inode INTEGER NOT NULL, hash_algorithm TEXT NOT NULL, '
+		'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, ctime_ns INTEGER NOT NULL, '
+		'digest TEXT NOT NULL, generation INTEGER NOT NULL, '
+		'PRIMARY KEY (device, inode, hash_algorithm))',
+		'CREATE INDEX IF NOT EXISTS digests_generation ON digests (generation)',
+		'CREATE TABLE IF NOT EXISTS generations (generation INTEGER NOT NULL)'
+	)
+
+	@verify_type(cache_path=str, maximum_entries=(int, None))
+	@verify_value(cache_path=lambda x: len(x) > 0, maximum_entries=lambda x: x is None or x > 0)
+	def __init__(self, cache_path, maximum_entries=None):
+		self.__cache_path = cache_path
+		self.__maximum_entries = \
+			maximum_entries if maximum_entries is not None else self.__default_maximum_entries__
+		self.__lock = threading.Lock()
+		self.__hits = 0
+		self.__misses = 0
+		self.__used = []
+		self.__updated = []
+
+		self.__connection = sqlite3.connect(cache_path, check_same_thread=False)
+		with self.__connection:
+			for statement in self.__schema__:
+				self.__connection.execute(statement)
+			generation = self.__connection.execute('SELECT MAX(generation) FROM generations').fetchone()[0]
+			self.__generation = (generation if generation is not None else 0) + 1
+			self.__connection.execute('DELETE FROM generations')
+			self.__connection.execute('INSERT INTO generations VALUES (?)', (self.__generation, ))
+
+	def cache_path(self):
+		return self.__cache_path
+
+	def maximum_entries(self):
+		return self.__maximum_entries
+
+	def hits(self):
+		return self.__hits
+
+	def misses(self):
+		return self.__misses
+
+	@verify_type(hash_algorithm=str)
+	def get(self, stat_result, hash_algorithm):
+		""" Return cached digest of a file or None if there is no valid digest
+
+		:param stat_result: the current stat result of a file
+		:param hash_algorithm: name of a hash algorithm
+		:return: str or None
+		"""
+		key = (stat_result.st_dev, stat_result.st_ino, hash_algorithm)
+		with self.__lock:
+			row = self.__connection.execute(
+				'SELECT size, mtime_ns, ctime_ns, digest FROM digests '
+				'WHERE device = ? AND inode = ? AND hash_algorithm = ?', key
+			).fetchone()
+			if row is None or tuple(row[:3]) != self.__file_state(stat_result):
+				self.__misses += 1
+				return None
+			self.__hits += 1
+			self.__used.append(key)
+			return row[3]
+
+	@verify_type(hash_algorithm=str, digest=str)
+	def set(self, stat_result, hash_algorithm, digest):
+		""" Save digest of a file. The stat result must be taken before the file was read
+		"""
+		with self.__lock:
+			self.__updated.append(
+				(stat_result.st_dev, stat_result.st_ino, hash_algorithm) + self.__file_state(stat_result)
+				+ (digest, self.__generation)
+			)
+
+	def close(self):
+		""" Save digests and remove the least recently used entries
+		"""
+		with self.__lock:
+			with self.__connection:
+				self.__connection.executemany(
+					'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.__updated
+				)
+				self.__connection.executemany(
+					'UPDATE digests SET generation = ? WHERE device = ? AND inode = ? AND hash_algorithm = ?',
+					((self.__generation, ) + x for x in self.__used)
+				)
+				self.__evict()
+			self.__connection.close()
+			self.__used = []
+			self.__updated = []
+
+	def __evict(self):
+		entries = self.__connection.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+		if entries > self.__maximum_entries:
+			self.__connection.execute(
+				'DELETE FROM digests WHERE rowid IN '
+				'(SELECT rowid FROM digests ORDER BY generation LIMIT ?)',
+				(entries - self.__maximum_entries, )
+			)
+
+	@classmethod
+	def __file_state(cls, stat_result):
+		return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ctime_ns
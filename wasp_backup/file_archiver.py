@@ -27,8 +27,6 @@ from wasp_backup.version import __author__, __version__, __credits__, __license_
 # noinspection PyUnresolvedReferences
 from wasp_backup.version import __status__
 
-import io
-
 from wasp_general.verify import verify_type, verify_value
 
 from wasp_backup.cipher import WBackupCipher
@@ -38,19 +36,38 @@ from wasp_backup.archiver import WBasicArchiveCreator
 
 class WFileArchiveCreator(WBasicArchiveCreator):
 
+	__default_buffer_size__ = 1024 * 1024  # writes of this size pass through buffers of chain links without copying
+
 	@verify_type('paranoid', archive_path=str, io_write_rate=(float, int, None))
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_write_rate=lambda x: x is None or x > 0)
 	@verify_type(cipher=(WBackupCipher, None), compression_mode=(WBackupMeta.Archive.CompressionMode, None))
+	@verify_type('paranoid', compression_workers=(int, None), compression_level=(int, None))
+	@verify_type('paranoid', archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_value('paranoid', compression_workers=lambda x: x is None or x > 0)
+	@verify_value('paranoid', pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', hash_algorithm=(str, None), hash_chunk_size=(int, None))
+	@verify_value('paranoid', hash_chunk_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', volume_size=(int, None))
+	@verify_value('paranoid', volume_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', stream_part_size=(int, None), compression_frame_size=(int, None))
+	@verify_value('paranoid', stream_part_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', compression_frame_size=lambda x: x is None or x > 0)
 	def __init__(
 		self, backup_source, archive_path, logger, stop_event=None, io_write_rate=None, compression_mode=None,
-		cipher=None, buffer_size=io.DEFAULT_BUFFER_SIZE
+		cipher=None, buffer_size=None, compression_workers=None, compression_level=None,
+		archive_layout=None, pipeline_queue_size=None, hash_algorithm=None,
+		hash_chunk_size=None, volume_size=None, stream_part_size=None, compression_frame_size=None
 	):
 		WBasicArchiveCreator.__init__(
 			self, archive_path, logger, stop_event=stop_event, io_write_rate=io_write_rate,
-			compression_mode=compression_mode, cipher=cipher
+			compression_mode=compression_mode, cipher=cipher, compression_workers=compression_workers,
+			compression_level=compression_level, archive_layout=archive_layout,
+			pipeline_queue_size=pipeline_queue_size, hash_algorithm=hash_algorithm,
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size,
+			compression_frame_size=compression_frame_size
 		)
 		self.__backup_source = backup_source
-		self.__buffer_size = buffer_size
+		self.__buffer_size = buffer_size if buffer_size is not None else self.__default_buffer_size__
 
 	def backup_source(self):
 		return self.__backup_source
@@ -59,13 +76,22 @@ class WFileArchiveCreator(WBasicArchiveCreator):
 		return self.__buffer_size
 
 	def write_archive(self, fo, archive):
-		backup_source = self.backup_source()
-		buffer_size = self.buffer_size()
+		self.copy_data(self.backup_source(), fo, self.buffer_size())
+
+	@classmethod
+	@verify_type(buffer_size=int)
+	@verify_value(buffer_size=lambda x: x > 0)
+	def copy_data(cls, source, target, buffer_size):
+		""" Copy data from the source file object to the target one. A single buffer is used for the whole
+		copying and the target receives memoryviews of it, so a target must not keep references to the written data
+		"""
+		read_buffer = bytearray(buffer_size)
+		read_view = memoryview(read_buffer)
 
-		read_buffer = backup_source.read(buffer_size)
-		while len(read_buffer) > 0:
-			fo.write(read_buffer)
-			read_buffer = backup_source.read(buffer_size)
+		bytes_read = source.readinto(read_buffer)
+		while bytes_read:
+			target.write(read_view[:bytes_read])
+			bytes_read = source.readinto(read_buffer)
 
 	def meta(self):
 		result = WBasicArchiveCreator.meta(self)
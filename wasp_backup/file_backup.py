@@ -32,6 +32,7 @@ from enum import Enum
 from wasp_general.command.enhanced import WCommandArgumentDescriptor
 
 from wasp_backup.cipher import WBackupCipher
+from wasp_backup.core import WBackupMeta
 from wasp_backup.inside_tar_archiver import WLVMArchiveCreator
 from wasp_backup.command_common import __common_args__, WCreateBackupCommand
 
@@ -73,11 +74,67 @@ class WFileBackupCommand(WCreateBackupCommand):
 			'snapshot-mount-dir', meta_var='mount_path',
 			help_info='path where snapshot volume should be mount. It is random directory by default'
 		),
+		WCommandArgumentDescriptor(
+			'read-ahead-workers', meta_var='threads_count',
+			help_info='if specified, then directories are listed, files are stat\'ed and small files are read '
+			'by the given number of threads ahead of archiving. It is useful for trees with a lot of small files. '
+			'By default files are read sequentially',
+			casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+				validate_fn=lambda x: x > 0
+			)
+		),
+		WCommandArgumentDescriptor(
+			'backup-mode', help_info='one of: "full" (all the files are archived), "incremental" (files that '
+			'were changed since the last backup are archived) or "differential" (files that were changed since '
+			'the last full backup are archived). Incremental and differential backups require the "file-index" '
+			'option. It is "full" by default',
+			casting_helper=WCommandArgumentDescriptor.EnumArgumentHelper(WBackupMeta.Archive.BackupMode),
+			default_value=WBackupMeta.Archive.BackupMode.full.value
+		),
+		WCommandArgumentDescriptor(
+			'file-index', meta_var='index_path',
+			help_info='path to the file index - the state of files that is saved after every backup (the index '
+			'of the last full backup is saved with the ".full" suffix). If there is no suitable index, then '
+			'incremental and differential backups are made as full ones'
+		),
+		WCommandArgumentDescriptor(
+			'digest-cache', meta_var='cache_path',
+			help_info='if specified, digests of archived files are saved to the archive member index (files are '
+			'hashed with the "hash-algorithm" algorithm). Digests are cached in the given SQLite database, so files '
+			'that were not changed (they have the same inode, size, modification and change times) are not hashed '
+			'again by the following backups'
+		),
+		WCommandArgumentDescriptor(
+			'digest-cache-size', meta_var='entries_count',
+			help_info='maximum number of entries in the digest cache. The least recently used entries are removed '
+			'when it is exceeded. It is 1000000 by default',
+			casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+				validate_fn=lambda x: x > 0
+			)
+		),
 		__common_args__['compression'],
+		__common_args__['compression-level'],
+		__common_args__['compression-workers'],
+		__common_args__['pipeline-buffers'],
 		__common_args__['password'],
 		__common_args__['cipher_algorithm'],
+		__common_args__['hash-algorithm'],
+		__common_args__['hash-chunk-size'],
 		__common_args__['io-write-rate'],
+		__common_args__['io-burst'],
+		__common_args__['io-schedule'],
+		__common_args__['io-pressure-target'],
+		__common_args__['source-read-rate'],
+		__common_args__['io-priority'],
+		__common_args__['volume-size'],
+		__common_args__['stream-part-size'],
+		__common_args__['compression-frame-size'],
+		__common_args__['repository'],
+		__common_args__['repository-chunk-size'],
 		__common_args__['copy-to'],
+		__common_args__['copy-workers'],
+		__common_args__['copy-stream'],
+		__common_args__['no-local-copy'],
 		__common_args__['copy-fail'],
 		__common_args__['notify-app']
 	)
@@ -87,8 +144,44 @@ class WFileBackupCommand(WCreateBackupCommand):
 		if 'compression' in command_arguments.keys():
 			compression_mode = command_arguments['compression']
 
+		compression_level = None
+		if 'compression-level' in command_arguments.keys():
+			compression_level = command_arguments['compression-level']
+
+		compression_workers = None
+		if 'compression-workers' in command_arguments.keys():
+			compression_workers = command_arguments['compression-workers']
+
+		pipeline_queue_size = None
+		if 'pipeline-buffers' in command_arguments.keys():
+			pipeline_queue_size = command_arguments['pipeline-buffers']
+
+		read_ahead_workers = None
+		if 'read-ahead-workers' in command_arguments.keys():
+			read_ahead_workers = command_arguments['read-ahead-workers']
+
+		file_index_path = None
+		if 'file-index' in command_arguments.keys():
+			file_index_path = command_arguments['file-index']
+
+		digest_cache_path = None
+		if 'digest-cache' in command_arguments.keys():
+			digest_cache_path = command_arguments['digest-cache']
+
+		digest_cache_size = None
+		if 'digest-cache-size' in command_arguments.keys():
+			digest_cache_size = command_arguments['digest-cache-size']
+
+		repository = self._open_repository(
+			command_arguments, compression_mode=compression_mode, compression_level=compression_level
+		)
+		if repository is not None:
+			# chunks are compressed and encrypted by the repository
+			compression_mode = None
+			compression_level = None
+
 		cipher = None
-		if 'password' in command_arguments:
+		if 'password' in command_arguments and repository is None:
 			cipher = WBackupCipher(
 				command_arguments['cipher_algorithm'], command_arguments['password']
 			)
@@ -101,6 +194,22 @@ class WFileBackupCommand(WCreateBackupCommand):
 		if 'snapshot-mount-dir' in command_arguments.keys():
 			snapshot_mount_dir = command_arguments['snapshot-mount-dir']
 
+		hash_chunk_size = None
+		if 'hash-chunk-size' in command_arguments.keys():
+			hash_chunk_size = int(command_arguments['hash-chunk-size'])
+
+		volume_size = None
+		if 'volume-size' in command_arguments.keys():
+			volume_size = int(command_arguments['volume-size'])
+
+		stream_part_size = None
+		if 'stream-part-size' in command_arguments.keys():
+			stream_part_size = int(command_arguments['stream-part-size'])
+
+		compression_frame_size = None
+		if 'compression-frame-size' in command_arguments.keys():
+			compression_frame_size = int(command_arguments['compression-frame-size'])
+
 		io_write_rate = None
 		if 'io-write-rate' in command_arguments.keys():
 			io_write_rate = command_arguments['io-write-rate']
@@ -110,8 +219,16 @@ class WFileBackupCommand(WCreateBackupCommand):
 		archiver = WLVMArchiveCreator(
 			backup_archive, self.logger(), *command_arguments['input-files'],
 			compression_mode=compression_mode, sudo=command_arguments['sudo'], cipher=cipher,
-			io_write_rate=io_write_rate, stop_event=self.stop_event()
+			io_write_rate=io_write_rate, stop_event=self.stop_event(), compression_workers=compression_workers,
+			compression_level=compression_level, pipeline_queue_size=pipeline_queue_size,
+			hash_algorithm=command_arguments['hash-algorithm'], hash_chunk_size=hash_chunk_size,
+			volume_size=volume_size, stream_part_size=stream_part_size, read_ahead_workers=read_ahead_workers,
+			backup_mode=command_arguments['backup-mode'], file_index_path=file_index_path,
+			digest_cache_path=digest_cache_path, digest_cache_size=digest_cache_size,
+			compression_frame_size=compression_frame_size
 		)
+		if repository is not None:
+			archiver.set_repository(repository)
 
 		snapshot_disabled = (command_arguments['snapshot'] == WFileBackupCommand.SnapshotUsage.disabled)
 		snapshot_force = (command_arguments['snapshot'] == WFileBackupCommand.SnapshotUsage.forced)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/file_index.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import os
+import json
+
+from wasp_general.verify import verify_type, verify_value
+
+
+class WArchiverFileIndex:
+	""" State of archived files (size, modification time, change time and inode of every file) that is saved
+	after a backup and is used for finding changed files by the following incremental and differential backups.
+	The index of the last full backup is saved near the index file (with the ".full" suffix), so that differential
+	backups are made against the last full backup and incremental ones against the last backup of any kind
+	"""
+
+	__index_format__ = 'wasp-backup-file-index'
+	__index_version__ = 1
+	__full_index_suffix__ = '.full'
+
+	def __init__(self, files=None):
+		self.__files = files if files is not None else {}
+
+	@classmethod
+	def file_state(cls, stat_result):
+		return [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ctime_ns, stat_result.st_ino]
+
+	@verify_type(path=str)
+	def add(self, path, stat_result):
+		self.__files[path] = self.file_state(stat_result)
+
+	@verify_type(path=str)
+	def changed(self, path, stat_result):
+		""" Check whether file is new or was changed since this index was saved
+		"""
+		return self.__files.get(path) != self.file_state(stat_result)
+
+	def paths(self):
+		return self.__files.keys()
+
+	def __len__(self):
+		return len(self.__files)
+
+	@verify_type(sources=list)
+	def deleted(self, current_index, sources):
+		""" Return sorted paths that are in this index but are absent in the current one. Only paths that are
+		inside the given backup sources are checked
+
+		:param current_index: index of the current backup
+		:param sources: list of backed up paths
+		:return: list of str
+		"""
+		sources = [x.rstrip(os.sep) for x in sources]
+
+		def inside_sources(path):
+			for source in sources:
+				if path == source or path.startswith(source + os.sep) is True:
+					return True
+			return False
+
+		current_paths = current_index.paths()
+		return sorted(x for x in self.paths() if x not in current_paths and inside_sources(x) is True)
+
+	@classmethod
+	@verify_type(index_path=str)
+	@verify_value(index_path=lambda x: len(x) > 0)
+	def full_index_path(cls, index_path):
+		return index_path + cls.__full_index_suffix__
+
+	@classmethod
+	@verify_type('paranoid', index_path=str)
+	@verify_value('paranoid', index_path=lambda x: len(x) > 0)
+	def load(cls, index_path):
+		""" Load index. If there is no such file, then None is returned
+		"""
+		if os.path.exists(index_path) is False:
+			return None
+		with open(index_path, 'r') as f:
+			index_data = json.load(f)
+		if isinstance(index_data, dict) is False or index_data.get('format') != cls.__index_format__:
+			raise RuntimeError('File "%s" is not a file index' % index_path)
+		if index_data.get('version') != cls.__index_version__:
+			raise RuntimeError('Unsupported file index version: "%s"' % str(index_data.get('version')))
+		return WArchiverFileIndex(index_data['files'])
+
+	@verify_type('paranoid', index_path=str)
+	@verify_value('paranoid', index_path=lambda x: len(x) > 0)
+	def save(self, index_path):
+		index_data = {
+			'format': self.__index_format__,
+			'version': self.__index_version__,
+			'files': self.__files
+		}
+		temp_path = index_path + '.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(index_data, f)
+		os.replace(temp_path, index_path)
@@ -38,6 +38,9 @@ from wasp_general.os.linux.mounts import WMountPoint
 from wasp_backup.cipher import WBackupCipher
 from wasp_backup.core import WBackupMeta
 from wasp_backup.archiver import WBasicInsideTarArchiveCreator
+from wasp_backup.tree_walker import WArchiverTreeWalker
+from wasp_backup.file_index import WArchiverFileIndex
+from wasp_backup.digest_cache import WArchiverDigestCache
 
 
 class WInsideTarArchiveCreator(WBasicInsideTarArchiveCreator):
@@ -48,28 +51,97 @@ class WInsideTarArchiveCreator(WBasicInsideTarArchiveCreator):
 	@verify_type(backup_sources=str, abs_path=bool)
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_write_rate=lambda x: x is None or x > 0)
 	@verify_value(backup_sources=lambda x: len(x) > 0)
+	@verify_type('paranoid', compression_workers=(int, None), compression_level=(int, None))
+	@verify_type('paranoid', archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_value('paranoid', compression_workers=lambda x: x is None or x > 0)
+	@verify_value('paranoid', pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', hash_algorithm=(str, None), hash_chunk_size=(int, None))
+	@verify_value('paranoid', hash_chunk_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', volume_size=(int, None))
+	@verify_value('paranoid', volume_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', stream_part_size=(int, None), compression_frame_size=(int, None))
+	@verify_value('paranoid', stream_part_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', compression_frame_size=lambda x: x is None or x > 0)
+	@verify_type(read_ahead_workers=(int, None), backup_mode=(WBackupMeta.Archive.BackupMode, None))
+	@verify_type(file_index_path=(str, None))
+	@verify_value(read_ahead_workers=lambda x: x is None or x > 0, file_index_path=lambda x: x is None or len(x) > 0)
+	@verify_type(digest_cache_path=(str, None), digest_cache_size=(int, None))
+	@verify_value(digest_cache_path=lambda x: x is None or len(x) > 0)
+	@verify_value(digest_cache_size=lambda x: x is None or x > 0)
 	def __init__(
 		self, archive_path, logger, *backup_sources, compression_mode=None, cipher=None, stop_event=None,
-		io_write_rate=None, abs_path=False
+		io_write_rate=None, abs_path=False, compression_workers=None, compression_level=None,
+		archive_layout=None, pipeline_queue_size=None, hash_algorithm=None,
+		hash_chunk_size=None, volume_size=None, stream_part_size=None, read_ahead_workers=None,
+		backup_mode=None, file_index_path=None, digest_cache_path=None, digest_cache_size=None,
+		compression_frame_size=None
 	):
 		WBasicInsideTarArchiveCreator.__init__(
 			self, archive_path, logger, compression_mode=compression_mode, cipher=cipher, stop_event=stop_event,
-			io_write_rate=io_write_rate
+			io_write_rate=io_write_rate, compression_workers=compression_workers,
+			compression_level=compression_level, archive_layout=archive_layout,
+			pipeline_queue_size=pipeline_queue_size, hash_algorithm=hash_algorithm,
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size,
+			compression_frame_size=compression_frame_size
 		)
 
 		self.__backup_sources = list(backup_sources)
 		self.__abs_path = abs_path
+		self.__read_ahead_workers = read_ahead_workers
 		self.__last_file = None
 
+		if backup_mode is None:
+			backup_mode = WBackupMeta.Archive.BackupMode.full
+		if backup_mode != WBackupMeta.Archive.BackupMode.full and file_index_path is None:
+			raise ValueError('File index is required for "%s" backups' % backup_mode.value)
+		self.__backup_mode = backup_mode
+		self.__file_index_path = file_index_path
+		self.__file_index = None
+		self.__last_backup_mode = None
+		self.__deleted_files = None
+		self.__digest_cache_path = digest_cache_path
+		self.__digest_cache_size = digest_cache_size
+		self.__file_digests = None
+
 	def backup_sources(self):
 		return self.__backup_sources.copy()
 
 	def abs_path(self):
 		return self.__abs_path
 
+	def read_ahead_workers(self):
+		return self.__read_ahead_workers
+
 	def last_file(self):
 		return self.__last_file
 
+	def backup_mode(self):
+		return self.__backup_mode
+
+	def file_index_path(self):
+		return self.__file_index_path
+
+	def last_backup_mode(self):
+		""" Return mode of the last backup. It may differ from the requested mode, since a full backup is made
+		if there is no suitable file index
+		"""
+		return self.__last_backup_mode
+
+	def deleted_files(self):
+		return self.__deleted_files
+
+	def digest_cache_path(self):
+		return self.__digest_cache_path
+
+	def digest_cache_size(self):
+		return self.__digest_cache_size
+
+	def file_digests(self):
+		""" Return digests of archived regular files (they are calculated when the digest cache is used). Digests
+		are saved in the member index
+		"""
+		return self.__file_digests
+
 	def inside_filename(self):
 		result = WBackupMeta.Archive.__basic_inside_file_name__ + '.tar'
 		compression_mode = self.compression_mode()
@@ -86,10 +158,98 @@ class WInsideTarArchiveCreator(WBasicInsideTarArchiveCreator):
 			self.__last_file = tarinfo.name
 			return tarinfo
 
-		for entry in self.backup_sources():
-			if self.abs_path() is True:
-				entry = os.path.abspath(entry)
-			tar_archive.add(entry, recursive=True, filter=last_file_tracking)
+		self.__file_index = None
+		self.__last_backup_mode = None
+		self.__deleted_files = None
+		self.__file_digests = None
+
+		entry_filter = None
+		base_index = None
+		file_index_path = self.file_index_path()
+		if file_index_path is not None:
+			base_index = self.__base_file_index()
+			self.__file_index = WArchiverFileIndex()
+
+			def index_filter(walker_entry):
+				self.__file_index.add(walker_entry.path, walker_entry.stat)
+				return base_index is None or base_index.changed(walker_entry.path, walker_entry.stat)
+			entry_filter = index_filter
+
+		digest_cache = None
+		digest_cache_path = self.digest_cache_path()
+		if digest_cache_path is not None:
+			digest_cache = WArchiverDigestCache(digest_cache_path, maximum_entries=self.digest_cache_size())
+
+		read_ahead_workers = self.read_ahead_workers()
+		tree_walker = None
+		if read_ahead_workers is not None or entry_filter is not None or digest_cache is not None:
+			# files that are compared with the index or are hashed are walked with the tree walker, so they
+			# are stat'ed once
+			hash_algorithm = None
+			if digest_cache is not None:
+				hash_algorithm = self.hash_algorithm()
+				if hash_algorithm is None:
+					hash_algorithm = WBackupMeta.Archive.__hash_generator_name__
+			tree_walker = WArchiverTreeWalker(
+				tar_archive, read_ahead_workers if read_ahead_workers else 1, hash_algorithm=hash_algorithm,
+				digest_cache=digest_cache
+			)
+
+		backup_sources = []
+		try:
+			for entry in self.backup_sources():
+				if self.abs_path() is True:
+					entry = os.path.abspath(entry)
+				backup_sources.append(entry)
+				if tree_walker is not None:
+					tree_walker.add(entry, filter=last_file_tracking, entry_filter=entry_filter)
+				else:
+					tar_archive.add(entry, recursive=True, filter=last_file_tracking)
+		finally:
+			if digest_cache is not None:
+				digest_cache.close()
+
+		if digest_cache is not None:
+			self.__file_digests = tree_walker.digests()
+			self.logger().info(
+				'File digests: %i were taken from the cache, %i were calculated' %
+				(digest_cache.hits(), digest_cache.misses())
+			)
+
+		if base_index is not None:
+			self.__deleted_files = base_index.deleted(self.__file_index, backup_sources)
+
+	def __base_file_index(self):
+		backup_mode = self.backup_mode()
+		file_index_path = self.file_index_path()
+		base_index = None
+		if backup_mode == WBackupMeta.Archive.BackupMode.incremental:
+			base_index = WArchiverFileIndex.load(file_index_path)
+		elif backup_mode == WBackupMeta.Archive.BackupMode.differential:
+			base_index = WArchiverFileIndex.load(WArchiverFileIndex.full_index_path(file_index_path))
+
+		if base_index is None:
+			if backup_mode != WBackupMeta.Archive.BackupMode.full:
+				self.logger().warning(
+					'There is no file index for the "%s" backup. Full backup will be made' % backup_mode.value
+				)
+			self.__last_backup_mode = WBackupMeta.Archive.BackupMode.full
+		else:
+			self.__last_backup_mode = backup_mode
+		return base_index
+
+	def write_archive(self, fo, archive):
+		WBasicInsideTarArchiveCreator.write_archive(self, fo, archive)
+		member_index = self.member_index()
+		if member_index is not None and self.__file_digests is not None:
+			member_index.set_digests(self.__file_digests)
+
+	def _archive_created(self):
+		if self.__file_index is not None:
+			file_index_path = self.file_index_path()
+			self.__file_index.save(file_index_path)
+			if self.__last_backup_mode == WBackupMeta.Archive.BackupMode.full:
+				self.__file_index.save(WArchiverFileIndex.full_index_path(file_index_path))
 
 	def meta(self):
 		result = WBasicInsideTarArchiveCreator.meta(self)
@@ -97,6 +257,10 @@ class WInsideTarArchiveCreator(WBasicInsideTarArchiveCreator):
 			WBackupMeta.Archive.MetaOptions.inside_tar: True,
 			WBackupMeta.Archive.MetaOptions.archived_files: self.backup_sources(),
 		})
+		if self.__last_backup_mode is not None:
+			result[WBackupMeta.Archive.MetaOptions.backup_mode] = self.__last_backup_mode.value
+		if self.__deleted_files is not None:
+			result[WBackupMeta.Archive.MetaOptions.deleted_files] = self.__deleted_files
 		return result
 
 
@@ -107,14 +271,42 @@ class WLVMArchiveCreator(WInsideTarArchiveCreator):
 	@verify_type('paranoid', cipher=(WBackupCipher, None), io_write_rate=(float, int, None))
 	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, backup_sources=lambda x: len(x) > 0)
 	@verify_value('paranoid', io_write_rate=lambda x: x is None or x > 0)
+	@verify_type('paranoid', compression_workers=(int, None), compression_level=(int, None))
+	@verify_type('paranoid', archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_value('paranoid', compression_workers=lambda x: x is None or x > 0)
+	@verify_value('paranoid', pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', hash_algorithm=(str, None), hash_chunk_size=(int, None))
+	@verify_value('paranoid', hash_chunk_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', volume_size=(int, None))
+	@verify_value('paranoid', volume_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', stream_part_size=(int, None), compression_frame_size=(int, None))
+	@verify_value('paranoid', stream_part_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', compression_frame_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', read_ahead_workers=(int, None), backup_mode=(WBackupMeta.Archive.BackupMode, None))
+	@verify_type('paranoid', file_index_path=(str, None))
+	@verify_value('paranoid', read_ahead_workers=lambda x: x is None or x > 0)
+	@verify_value('paranoid', file_index_path=lambda x: x is None or len(x) > 0)
+	@verify_type('paranoid', digest_cache_path=(str, None), digest_cache_size=(int, None))
+	@verify_value('paranoid', digest_cache_path=lambda x: x is None or len(x) > 0)
+	@verify_value('paranoid', digest_cache_size=lambda x: x is None or x > 0)
 	@verify_type(sudo=bool)
 	def __init__(
 		self, archive_path, logger, *backup_sources, compression_mode=None, sudo=False, cipher=None, stop_event=None,
-		io_write_rate=None
+		io_write_rate=None, compression_workers=None, compression_level=None,
+		archive_layout=None, pipeline_queue_size=None, hash_algorithm=None,
+		hash_chunk_size=None, volume_size=None, stream_part_size=None, read_ahead_workers=None,
+		backup_mode=None, file_index_path=None, digest_cache_path=None, digest_cache_size=None,
+		compression_frame_size=None
 	):
 		WInsideTarArchiveCreator.__init__(
 			self, archive_path, logger, *backup_sources, compression_mode=compression_mode, cipher=cipher,
-			stop_event=stop_event, io_write_rate=io_write_rate, abs_path=True
+			stop_event=stop_event, io_write_rate=io_write_rate, abs_path=True,
+			compression_workers=compression_workers, compression_level=compression_level, archive_layout=archive_layout,
+			pipeline_queue_size=pipeline_queue_size, hash_algorithm=hash_algorithm,
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size,
+			read_ahead_workers=read_ahead_workers, backup_mode=backup_mode, file_index_path=file_index_path,
+			digest_cache_path=digest_cache_path, digest_cache_size=digest_cache_size,
+			compression_frame_size=compression_frame_size
 		)
 		self.__sudo = sudo
 		self.__logical_volume_uuid = None
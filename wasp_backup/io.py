@@ -33,27 +33,652 @@ import io
 import os
 import gzip
 import bz2
+import lzma
 import time
 import pwd
 import grp
+import queue
+import threading
+import multiprocessing
+import hashlib
+import json
+import bisect
+import re
+import struct
+import zlib
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from abc import ABCMeta, abstractmethod
 
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+try:
+	import lz4.frame
+except ImportError:
+	lz4 = None
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
 from wasp_general.verify import verify_type, verify_value
-from wasp_general.io import WAESWriter, WHashCalculationWriter, WWriterChain, WThrottlingWriter, WWriterChainLink
+from wasp_general.io import WAESWriter, WWriterChain, WThrottlingWriter, WWriterChainLink, WThrottlingIO
 from wasp_general.io import WReaderChain, WThrottlingReader, WReaderChainLink, WDiscardWriterResult
+from wasp_general.io import WBufferedIOReader, WGzipReader, WBzip2Reader, WResponsiveIO
 from wasp_general.cli.formatter import data_size_formatter
+from wasp_general.crypto.aes import WAES, WAESMode
 
 from wasp_backup.core import WBackupMeta, WBackupMetaProvider, WArchiverIOStatusProvider
 
 
-class WTarPatcher(io.BufferedWriter):
+class WStreamCompressorWriter:
+	""" File-like adapter for compressor objects with "compress"/"flush" methods (like zstd or lz4 ones)
+	"""
+
+	def __init__(self, raw, compressor, stream_header=None):
+		self.__raw = raw
+		self.__compressor = compressor
+		self.__closed = False
+		if stream_header is not None:
+			self.__raw.write(stream_header)
+
+	def write(self, b):
+		data = self.__compressor.compress(b)
+		if len(data) > 0:
+			self.__raw.write(data)
+		return len(b)
+
+	def flush(self):
+		self.__raw.flush()
+
+	def close(self):
+		if self.__closed is False:
+			self.__raw.write(self.__compressor.flush())
+			self.__closed = True
+
+
+class WXzReader(WBufferedIOReader):
+
+	def __init__(self, raw):
+		WBufferedIOReader.__init__(self, raw)
+		self.__xz = lzma.LZMAFile(raw)
+
+	def read_chunk(self, size):
+		return self.__xz.read(size)
+
+	def close(self, *args, **kwargs):
+		self.__xz.close()
+		WBufferedIOReader.close(self)
+
+
+class WZstdReader(WBufferedIOReader):
+
+	def __init__(self, raw):
+		WBufferedIOReader.__init__(self, raw)
+		WArchiverCompression.check_availability(WBackupMeta.Archive.CompressionMode.zstd)
+		self.__zstd = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+
+	def read_chunk(self, size):
+		return self.__zstd.read(size)
+
+	def close(self, *args, **kwargs):
+		self.__zstd.close()
+		WBufferedIOReader.close(self)
+
+
+class WLz4Reader(WBufferedIOReader):
+
+	def __init__(self, raw):
+		WBufferedIOReader.__init__(self, raw)
+		WArchiverCompression.check_availability(WBackupMeta.Archive.CompressionMode.lz4)
+		self.__lz4 = lz4.frame.LZ4FrameFile(raw, mode='rb')
+
+	def read_chunk(self, size):
+		return self.__lz4.read(size)
+
+	def close(self, *args, **kwargs):
+		self.__lz4.close()
+		WBufferedIOReader.close(self)
+
+
+class WArchiverCompression:
+	""" Collection of compression-specific routines. zstd and lz4 compression require third-party modules, so they
+	are available only when "zstandard" and "lz4" modules are installed
+	"""
+
+	__levels__ = {  # compression mode: (minimum level, maximum level, default level)
+		WBackupMeta.Archive.CompressionMode.gzip: (0, 9, 9),
+		WBackupMeta.Archive.CompressionMode.bzip2: (1, 9, 9),
+		WBackupMeta.Archive.CompressionMode.xz: (0, 9, 6),
+		WBackupMeta.Archive.CompressionMode.zstd: (1, 22, 3),
+		WBackupMeta.Archive.CompressionMode.lz4: (0, 16, 0)
+	}
+
+	__required_modules__ = {
+		WBackupMeta.Archive.CompressionMode.zstd: ('zstandard', lambda: zstandard),
+		WBackupMeta.Archive.CompressionMode.lz4: ('lz4', lambda: lz4)
+	}
+
+	__readers__ = {
+		WBackupMeta.Archive.CompressionMode.gzip: WGzipReader,
+		WBackupMeta.Archive.CompressionMode.bzip2: WBzip2Reader,
+		WBackupMeta.Archive.CompressionMode.xz: WXzReader,
+		WBackupMeta.Archive.CompressionMode.zstd: WZstdReader,
+		WBackupMeta.Archive.CompressionMode.lz4: WLz4Reader
+	}
+
+	@classmethod
+	@verify_type(compression_mode=WBackupMeta.Archive.CompressionMode)
+	def available(cls, compression_mode):
+		if compression_mode in cls.__required_modules__:
+			module_name, module_fn = cls.__required_modules__[compression_mode]
+			return module_fn() is not None
+		return True
+
+	@classmethod
+	@verify_type('paranoid', compression_mode=WBackupMeta.Archive.CompressionMode)
+	def check_availability(cls, compression_mode):
+		if cls.available(compression_mode) is False:
+			module_name, module_fn = cls.__required_modules__[compression_mode]
+			raise RuntimeError(
+				'Compression mode "%s" is unavailable. Python module "%s" is required' %
+				(compression_mode.name, module_name)
+			)
+
+	@classmethod
+	@verify_type(compression_mode=WBackupMeta.Archive.CompressionMode, compression_level=(int, None))
+	def compression_level(cls, compression_mode, compression_level=None):
+		minimum_level, maximum_level, default_level = cls.__levels__[compression_mode]
+		if compression_level is None:
+			return default_level
+		if compression_level < minimum_level or compression_level > maximum_level:
+			raise ValueError(
+				'Invalid compression level for "%s" compression. It must be between %i and %i' %
+				(compression_mode.name, minimum_level, maximum_level)
+			)
+		return compression_level
+
+	@classmethod
+	@verify_type('paranoid', compression_mode=WBackupMeta.Archive.CompressionMode, compression_level=(int, None))
+	def stream_writer(cls, compression_mode, raw, compression_level=None):
+		cls.check_availability(compression_mode)
+		level = cls.compression_level(compression_mode, compression_level)
+
+		if compression_mode == WBackupMeta.Archive.CompressionMode.gzip:
+			return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.bzip2:
+			return bz2.BZ2File(raw, mode='wb', compresslevel=level)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.xz:
+			return lzma.LZMAFile(raw, mode='wb', preset=level)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.zstd:
+			return WStreamCompressorWriter(raw, zstandard.ZstdCompressor(level=level).compressobj())
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.lz4:
+			compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+			return WStreamCompressorWriter(raw, compressor, stream_header=compressor.begin())
+		raise RuntimeError('Invalid compression mode spotted')
+
+	@classmethod
+	@verify_type('paranoid', compression_mode=WBackupMeta.Archive.CompressionMode, compression_level=(int, None))
+	def block_compress_function(cls, compression_mode, compression_level=None):
+		cls.check_availability(compression_mode)
+		level = cls.compression_level(compression_mode, compression_level)
+
+		if compression_mode == WBackupMeta.Archive.CompressionMode.gzip:
+			return lambda x: gzip.compress(x, compresslevel=level)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.bzip2:
+			return lambda x: bz2.compress(x, compresslevel=level)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.xz:
+			return lambda x: lzma.compress(x, preset=level)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.zstd:
+			# compressor objects are not thread-safe, so every block has its own one
+			return lambda x: zstandard.ZstdCompressor(level=level).compress(x)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.lz4:
+			return lambda x: lz4.frame.compress(x, compression_level=level)
+		raise RuntimeError('Invalid compression mode spotted')
+
+	@classmethod
+	@verify_type('paranoid', compression_mode=WBackupMeta.Archive.CompressionMode)
+	def block_decompress_function(cls, compression_mode):
+		cls.check_availability(compression_mode)
+
+		if compression_mode == WBackupMeta.Archive.CompressionMode.gzip:
+			return gzip.decompress
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.bzip2:
+			return bz2.decompress
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.xz:
+			return lzma.decompress
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.zstd:
+			return lambda x: zstandard.ZstdDecompressor().decompress(x)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.lz4:
+			return lz4.frame.decompress
+		raise RuntimeError('Invalid compression mode spotted')
+
+	@classmethod
+	@verify_type('paranoid', compression_mode=WBackupMeta.Archive.CompressionMode)
+	def stream_reader(cls, compression_mode, raw):
+		""" Return file object that decompresses data of the raw file object. Returned object supports readinto,
+		so decompressed data may be read into a reused buffer. The raw object must be closed separately
+		"""
+		cls.check_availability(compression_mode)
+
+		if compression_mode == WBackupMeta.Archive.CompressionMode.gzip:
+			return gzip.GzipFile(fileobj=raw, mode='rb')
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.bzip2:
+			return bz2.BZ2File(raw, mode='rb')
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.xz:
+			return lzma.LZMAFile(raw, mode='rb')
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.zstd:
+			return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+		elif compression_mode == WBackupMeta.Archive.CompressionMode.lz4:
+			return lz4.frame.LZ4FrameFile(raw, mode='rb')
+		raise RuntimeError('Invalid compression mode spotted')
+
+	@classmethod
+	@verify_type(compression_mode=WBackupMeta.Archive.CompressionMode)
+	def reader_cls(cls, compression_mode):
+		return cls.__readers__[compression_mode]
+
+
+class WArchiverFrameIndex:
+	""" Index of independently compressed frames of a seekable compressed archive. For every frame it keeps sizes
+	of uncompressed and compressed data, so a frame that contains any uncompressed position may be found and
+	decompressed without decompressing of the previous frames
+	"""
+
+	__index_magic__ = b'WBKPFRM'
+	__index_version__ = 1
+	__header__ = struct.Struct('>7sBQ')  # magic, version and frames count
+	__frame__ = struct.Struct('>QQ')  # uncompressed and compressed sizes of a frame
+
+	def __init__(self):
+		self.__frames = []
+		self.__uncompressed_offsets = []
+		self.__compressed_offsets = []
+		self.__uncompressed_size = 0
+		self.__compressed_size = 0
+
+	def frames(self):
+		return self.__frames
+
+	def uncompressed_size(self):
+		return self.__uncompressed_size
+
+	def compressed_size(self):
+		return self.__compressed_size
+
+	@verify_type(uncompressed_size=int, compressed_size=int)
+	def add(self, uncompressed_size, compressed_size):
+		self.__frames.append((uncompressed_size, compressed_size))
+		self.__uncompressed_offsets.append(self.__uncompressed_size)
+		self.__compressed_offsets.append(self.__compressed_size)
+		self.__uncompressed_size += uncompressed_size
+		self.__compressed_size += compressed_size
+
+	@verify_type(position=int)
+	def frame(self, position):
+		""" Return frame that contains the given uncompressed position
+
+		:param position: position in uncompressed data
+		:return: tuple of frame number, offset of the frame in uncompressed data, offset of the frame in compressed
+		data and size of the compressed frame
+		"""
+		if position < 0 or position >= self.__uncompressed_size:
+			raise ValueError('Position %i is out of the data' % position)
+		frame_number = bisect.bisect_right(self.__uncompressed_offsets, position) - 1
+		# frames may be empty, so the last frame with the given offset is found
+		return (
+			frame_number, self.__uncompressed_offsets[frame_number], self.__compressed_offsets[frame_number],
+			self.__frames[frame_number][1]
+		)
+
+	def encode(self):
+		result = [self.__header__.pack(self.__index_magic__, self.__index_version__, len(self.__frames))]
+		result.extend(self.__frame__.pack(*x) for x in self.__frames)
+		return zlib.compress(b''.join(result))
+
+	@classmethod
+	@verify_type(data=bytes)
+	def decode(cls, data):
+		try:
+			data = zlib.decompress(data)
+			magic, version, frames_count = cls.__header__.unpack_from(data)
+			if magic != cls.__index_magic__:
+				raise RuntimeError('Frame index is corrupted')
+			if version != cls.__index_version__:
+				raise RuntimeError('Unsupported frame index version: "%i"' % version)
+			result = WArchiverFrameIndex()
+			for uncompressed_size, compressed_size in cls.__frame__.iter_unpack(data[cls.__header__.size:]):
+				result.add(uncompressed_size, compressed_size)
+		except (zlib.error, struct.error):
+			raise RuntimeError('Frame index is corrupted')
+		if len(result.frames()) != frames_count:
+			raise RuntimeError('Frame index is corrupted')
+		return result
+
+
+class WBlockCompressor:
+	""" pigz-alike compressor. Data is split into blocks that are compressed independently by a thread pool. Blocks
+	are written in the original order, so the result is a sequence of concatenated compressed streams (which is a
+	valid gzip/bzip2 file). Sizes of blocks are saved to the frame index if it is set
+	"""
+
+	__default_block_size__ = 1024 * 1024
+
+	@verify_type(workers=int, block_size=(int, None), frame_index=(WArchiverFrameIndex, None))
+	@verify_value(compress_fn=lambda x: callable(x), workers=lambda x: x > 0)
+	@verify_value(block_size=lambda x: x is None or x > 0)
+	def __init__(self, raw, compress_fn, workers, block_size=None, frame_index=None):
+		self.__raw = raw
+		self.__frame_index = frame_index
+		self.__compress_fn = compress_fn
+		self.__workers = workers
+		self.__block_size = block_size if block_size is not None else self.__default_block_size__
+		self.__buffer = bytearray()
+		self.__executor = ThreadPoolExecutor(max_workers=workers)
+		self.__pending = deque()
+		self.__blocks_written = 0
+
+	def raw(self):
+		return self.__raw
+
+	def workers(self):
+		return self.__workers
+
+	def block_size(self):
+		return self.__block_size
+
+	def write(self, b):
+		self.__buffer += b
+		block_size = self.block_size()
+		while len(self.__buffer) >= block_size:
+			self.__submit(self.__buffer[:block_size])
+			del self.__buffer[:block_size]
+		return len(b)
+
+	def flush(self):
+		if len(self.__buffer) > 0:
+			self.__submit(self.__buffer)
+			self.__buffer = bytearray()
+		while len(self.__pending) > 0:
+			self.__write_block(*self.__pending.popleft())
+		self.__raw.flush()
+
+	def close(self):
+		if self.__executor is None:
+			return
+		try:
+			if self.__blocks_written == 0 and len(self.__buffer) == 0 and len(self.__pending) == 0:
+				self.__submit(b'')  # an empty stream must be a valid compressed file also
+			self.flush()
+		finally:
+			self.__executor.shutdown()
+			self.__executor = None
+
+	def __submit(self, block):
+		if len(self.__pending) >= (self.__workers * 2):
+			self.__write_block(*self.__pending.popleft())
+		self.__pending.append((len(block), self.__executor.submit(self.__compress_fn, block)))
+
+	def __write_block(self, block_size, compressed_block):
+		compressed_block = compressed_block.result()
+		self.__raw.write(compressed_block)
+		self.__blocks_written += 1
+		if self.__frame_index is not None:
+			self.__frame_index.add(block_size, len(compressed_block))
+
+
+class WArchiverCompressionWriter(io.BufferedWriter, WBackupMetaProvider):
+	""" Writer chain link that compresses data. Flushing of this writer completes the current compressed stream
+	(following data will be written as a new concatenated stream), so the compressed data may be passed to the next
+	links (like a cipher one) before they are flushed.
+
+	If the frame size is set, then data is compressed as independent frames of this size and the frame index is
+	built (see :class:`.WArchiverFrameReader`)
+	"""
+
+	class CompressedOutput:
+
+		def __init__(self, raw):
+			self.__raw = raw
+			self.__bytes_written = 0
+
+		def bytes_written(self):
+			return self.__bytes_written
+
+		def write(self, b):
+			self.__raw.write(b)
+			self.__bytes_written += len(b)
+			return len(b)
+
+		def flush(self):
+			self.__raw.flush()
+
+	@verify_type(compression_mode=WBackupMeta.Archive.CompressionMode, compression_level=(int, None))
+	@verify_type(compression_workers=(int, None), frame_size=(int, None))
+	@verify_value(compression_workers=lambda x: x is None or x > 0, frame_size=lambda x: x is None or x > 0)
+	def __init__(self, raw, compression_mode, compression_level=None, compression_workers=None, frame_size=None):
+		io.BufferedWriter.__init__(self, raw)
+		WBackupMetaProvider.__init__(self)
+		self.__output = WArchiverCompressionWriter.CompressedOutput(raw)
+		self.__compression_mode = compression_mode
+		self.__compression_level = compression_level
+		self.__compression_workers = compression_workers
+		self.__frame_size = frame_size
+		self.__frame_index = WArchiverFrameIndex() if frame_size is not None else None
+		self.__compressor = None
+		self.__streams = 0
+
+	def compression_mode(self):
+		return self.__compression_mode
+
+	def frame_size(self):
+		return self.__frame_size
+
+	def frame_index(self):
+		return self.__frame_index
+
+	def compressed_size(self):
+		return self.__output.bytes_written()
+
+	def write(self, b):
+		if self.__compressor is None:
+			self.__open_compressor()
+		return self.__compressor.write(b)
+
+	def flush(self):
+		if self.__compressor is None and self.__streams == 0:
+			self.__open_compressor()  # empty data must be a valid compressed stream also
+		if self.__compressor is not None:
+			self.__compressor.close()
+			self.__compressor = None
+		io.BufferedWriter.flush(self)
+
+	def __open_compressor(self):
+		if self.__frame_size is not None:
+			self.__compressor = WBlockCompressor(
+				self.__output,
+				WArchiverCompression.block_compress_function(self.__compression_mode, self.__compression_level),
+				self.__compression_workers if self.__compression_workers is not None else 1,
+				block_size=self.__frame_size, frame_index=self.__frame_index
+			)
+		elif self.__compression_workers is not None and self.__compression_workers > 1:
+			self.__compressor = WBlockCompressor(
+				self.__output,
+				WArchiverCompression.block_compress_function(self.__compression_mode, self.__compression_level),
+				self.__compression_workers
+			)
+		else:
+			self.__compressor = WArchiverCompression.stream_writer(
+				self.__compression_mode, self.__output, self.__compression_level
+			)
+		self.__streams += 1
+
+	def close(self):
+		if self.closed is False:
+			self.flush()
+		io.BufferedWriter.close(self)
+
+	def meta(self):
+		result = {
+			WBackupMeta.Archive.MetaOptions.compressed_archive_size: self.compressed_size()
+		}
+		if self.__frame_size is not None:
+			result[WBackupMeta.Archive.MetaOptions.compression_frame_size] = self.__frame_size
+		return result
+
+
+class WBasicTarWriter(io.BufferedWriter, metaclass=ABCMeta):
+	""" Basic class for writer chain links that write data as a tar archive member.
+
+	Archives end with a meta locator - the last block of the archive, that describes where meta file data is, so
+	meta may be read without scanning the whole archive. The locator is placed after the two zero blocks that
+	mark the end of a tar archive (tar readers ignore the rest of the last record), so archive is a valid tar
+	"""
 
 	__default_tar_mode__ = int('440', base=8)
+	__zero_padding__ = bytes(tarfile.RECORDSIZE + (tarfile.BLOCKSIZE * 3))  # enough for any record alignment
+
+	__locator__ = struct.Struct('>8sHQQI')  # magic, version, meta data offset, meta data size and its CRC32
+	__locator_crc__ = struct.Struct('>I')  # CRC32 of the locator fields
+	__locator_magic__ = b'WBKPMETA'
+	__locator_version__ = 1
+
+	def __new__(cls, *args, **kwargs):
+		# io.BufferedWriter does not check abstract methods, so a writer that does not implement them would fail
+		# only after the whole archive was written
+		if len(cls.__abstractmethods__) > 0:
+			raise TypeError(
+				'Can\'t instantiate abstract class %s with abstract methods %s' %
+				(cls.__name__, ', '.join(sorted(cls.__abstractmethods__)))
+			)
+		return io.BufferedWriter.__new__(cls, *args, **kwargs)
+
+	@abstractmethod
+	def patch(self):
+		""" Complete the archive (this method is called after all the data was written and flushed)
+		"""
+		raise NotImplementedError('This method is abstract')
+
+	@classmethod
+	def tar_info(cls, name, size=None):
+		tar_info = tarfile.TarInfo(name=name)
+		if size is not None:
+			tar_info.size = size
+		tar_info.mtime = time.mktime(datetime.now().timetuple())
+		tar_info.mode = cls.__default_tar_mode__
+		tar_info.type = tarfile.REGTYPE
+		tar_info.uid = os.getuid()
+		tar_info.gid = os.getgid()
+		tar_info.uname = pwd.getpwuid(tar_info.uid).pw_name
+		tar_info.gname = grp.getgrgid(tar_info.gid).gr_name
+		return tar_info
+
+	@classmethod
+	def tar_header(cls, name, size=None):
+		# header must fit a single block, so pax extended headers (default since python 3.8) are not allowed
+		return cls.tar_info(name, size=size).tobuf(format=tarfile.GNU_FORMAT)
+
+	@classmethod
+	def align_size(cls, size, chunk_size):
+		result = divmod(size, chunk_size)
+		return (result[0] if result[1] == 0 else (result[0] + 1)) * chunk_size
+
+	@classmethod
+	def record_size(cls, size):
+		return cls.align_size(size, tarfile.RECORDSIZE)
+
+	@classmethod
+	def block_size(cls, size):
+		return cls.align_size(size, tarfile.BLOCKSIZE)
+
+	@classmethod
+	def padding(cls, padding_size):
+		if padding_size <= 0:
+			return b''
+		if padding_size <= len(cls.__zero_padding__):
+			return memoryview(cls.__zero_padding__)[:padding_size]
+		return tarfile.NUL * padding_size
+
+	@classmethod
+	@verify_type(archive_size=int, meta_offset=int, meta_data=bytes)
+	def archive_end(cls, archive_size, meta_offset, meta_data):
+		""" Return the end of archive - zero blocks and the meta locator
+
+		:param archive_size: size of archive data (it must be aligned to the tar block size)
+		:param meta_offset: offset of meta file data from the archive beginning
+		:param meta_data: meta file data
+		:return: bytes
+		"""
+		end_size = cls.record_size(archive_size + (tarfile.BLOCKSIZE * 3)) - archive_size
+		locator = cls.__locator__.pack(
+			cls.__locator_magic__, cls.__locator_version__, meta_offset, len(meta_data), zlib.crc32(meta_data)
+		)
+		locator += cls.__locator_crc__.pack(zlib.crc32(locator))
+		return bytes(end_size - len(locator)) + locator
+
+	@classmethod
+	def read_located_meta(cls, archive_file):
+		""" Read meta file data with the meta locator. None is returned if archive does not have a valid locator
+		(it was created by a previous version)
+
+		:param archive_file: seekable archive file object
+		:return: bytes or None
+		"""
+		archive_size = archive_file.seek(0, os.SEEK_END)
+		if archive_size < tarfile.RECORDSIZE or (archive_size % tarfile.BLOCKSIZE) != 0:
+			return None
+
+		locator_size = cls.__locator__.size + cls.__locator_crc__.size
+		archive_file.seek(archive_size - locator_size)
+		locator = archive_file.read(locator_size)[:locator_size]
+		if len(locator) != locator_size:
+			return None
+		locator_fields = locator[:cls.__locator__.size]
+		if cls.__locator_crc__.unpack(locator[cls.__locator__.size:])[0] != zlib.crc32(locator_fields):
+			return None
+		magic, version, meta_offset, meta_size, meta_crc = cls.__locator__.unpack(locator_fields)
+		if magic != cls.__locator_magic__ or version != cls.__locator_version__:
+			return None
+		if meta_size > WBackupMeta.Archive.__maximum_meta_file_size__ or (meta_offset + meta_size) > archive_size:
+			return None
+
+		archive_file.seek(meta_offset)
+		meta_data = archive_file.read(meta_size)[:meta_size]
+		if len(meta_data) != meta_size or zlib.crc32(meta_data) != meta_crc:
+			return None
+		return meta_data
 
+	@classmethod
+	@verify_type(extra_members=(dict, None))
+	def encoded_meta(cls, meta_provider, extra_members=None):
+		""" Return encoded meta data
+
+		:param meta_provider: meta data source
+		:param extra_members: data offsets and sizes of members that were written before the meta file
+		:return: bytes
+		"""
+		meta = meta_provider.meta()
+		if extra_members is not None and len(extra_members) > 0:
+			meta[WBackupMeta.Archive.MetaOptions.extra_members] = extra_members
+		meta_data = meta_provider.encode_meta(meta, strict_cls=WBackupMeta.Archive.MetaOptions)
+		if len(meta_data) > WBackupMeta.Archive.__maximum_meta_file_size__:
+			raise RuntimeError('Meta data corrupted - too big')
+		return meta_data
+
+
+class WTarPatcher(WBasicTarWriter):
+
+	@verify_type(compression_workers=(int, None), compression_level=(int, None))
+	@verify_value(compression_workers=lambda x: x is None or x > 0)
 	def __init__(
-		self, archive, inside_file_name, patch_header=True, patch_tail=False, compression_mode=None
+		self, archive, inside_file_name, patch_header=True, patch_tail=False, compression_mode=None,
+		compression_workers=None, compression_level=None
 	):
 		self.__original_archive = \
 			open(archive, mode='wb', buffering=0) if isinstance(archive, str) is True else archive
@@ -68,16 +693,18 @@ class WTarPatcher(io.BufferedWriter):
 			self.__original_archive.write(self.tar_header(inside_file_name))
 
 		self.__compression_mode = compression_mode
-		if self.__compression_mode is not None:
-			if self.__compression_mode == WBackupMeta.Archive.CompressionMode.gzip:
-				archive = gzip.GzipFile(fileobj=self.__original_archive)
-				self.__compression_writer = archive
-
-			elif self.__compression_mode == WBackupMeta.Archive.CompressionMode.bzip2:
-				archive = bz2.BZ2File(self.__original_archive, mode='wb')
-				self.__compression_writer = archive
-			else:
-				raise RuntimeError('Invalid compression mode spotted')
+		self.__compression_workers = compression_workers
+		self.__compression_level = compression_level
+		if self.__compression_mode is not None and compression_workers is not None and compression_workers > 1:
+			self.__compression_writer = WBlockCompressor(
+				self.__original_archive,
+				WArchiverCompression.block_compress_function(self.__compression_mode, compression_level),
+				compression_workers
+			)
+		elif self.__compression_mode is not None:
+			self.__compression_writer = WArchiverCompression.stream_writer(
+				self.__compression_mode, self.__original_archive, compression_level
+			)
 
 		self.__inside_file_name = inside_file_name
 		self.__patch_header = patch_header
@@ -97,6 +724,12 @@ class WTarPatcher(io.BufferedWriter):
 	def compression_mode(self):
 		return self.__compression_mode
 
+	def compression_workers(self):
+		return self.__compression_workers
+
+	def compression_level(self):
+		return self.__compression_level
+
 	def inside_file_size(self):
 		final_position = self.final_position()
 		if final_position is None:
@@ -168,47 +801,18 @@ class WTarPatcher(io.BufferedWriter):
 		self.__original_archive.seek(self.start_position(), os.SEEK_SET)
 		self.__original_archive.write(tar_header)
 
-	@classmethod
-	def tar_info(cls, name, size=None):
-		tar_info = tarfile.TarInfo(name=name)
-		if size is not None:
-			tar_info.size = size
-		tar_info.mtime = time.mktime(datetime.now().timetuple())
-		tar_info.mode = cls.__default_tar_mode__
-		tar_info.type = tarfile.REGTYPE
-		tar_info.uid = os.getuid()
-		tar_info.gid = os.getgid()
-		tar_info.uname = pwd.getpwuid(tar_info.uid).pw_name
-		tar_info.gname = grp.getgrgid(tar_info.gid).gr_name
-		return tar_info
-
-	@classmethod
-	def tar_header(cls, name, size=None):
-		return cls.tar_info(name, size=size).tobuf()
-
-	@classmethod
-	def align_size(cls, size, chunk_size):
-		result = divmod(size, chunk_size)
-		return (result[0] if result[1] == 0 else (result[0] + 1)) * chunk_size
-
-	@classmethod
-	def record_size(cls, size):
-		return cls.align_size(size, tarfile.RECORDSIZE)
-
-	@classmethod
-	def block_size(cls, size):
-		return cls.align_size(size, tarfile.BLOCKSIZE)
-
-	@classmethod
-	def padding(cls, padding_size):
-		return tarfile.NUL * padding_size if padding_size > 0 else b''
-
 
 class WMetaTarPatcher(WTarPatcher):
 
-	def __init__(self, archive_path, inside_archive_name, meta_provider, compression_mode=None):
+	@verify_type('paranoid', compression_workers=(int, None), compression_level=(int, None))
+	@verify_value('paranoid', compression_workers=lambda x: x is None or x > 0)
+	def __init__(
+		self, archive_path, inside_archive_name, meta_provider, compression_mode=None, compression_workers=None,
+		compression_level=None
+	):
 		WTarPatcher.__init__(
-			self, archive_path, inside_archive_name, patch_tail=True, compression_mode=compression_mode
+			self, archive_path, inside_archive_name, patch_tail=True, compression_mode=compression_mode,
+			compression_workers=compression_workers, compression_level=compression_level
 		)
 		self.__meta_provider = meta_provider
 
@@ -220,27 +824,25 @@ class WMetaTarPatcher(WTarPatcher):
 		inside_file_size = original_archive.tell() - self.start_position()
 		inside_data_block_delta = self.block_size(inside_file_size) - inside_file_size
 		original_archive.write(self.padding(inside_data_block_delta))
-		inside_file_size += inside_data_block_delta
 
-		meta_provider = self.meta_provider()
-		meta_data = meta_provider.encode_meta(meta_provider.meta(), strict_cls=WBackupMeta.Archive.MetaOptions)
+		extra_members = {}
+		for member_name, member_data in self.meta_provider().extra_members():
+			extra_members[member_name] = [self.__write_member(member_name, member_data), len(member_data)]
 
-		if len(meta_data) > WBackupMeta.Archive.__maximum_meta_file_size__:
-			raise RuntimeError('Meta data corrupted - too big')
-
-		meta_header = self.tar_header(WBackupMeta.Archive.__meta_filename__, size=len(meta_data))
-		original_archive.write(meta_header)
-		inside_file_size += len(meta_header)
+		meta_data = self.encoded_meta(self.meta_provider(), extra_members=extra_members)
+		meta_offset = self.__write_member(WBackupMeta.Archive.__meta_filename__, meta_data)
 
-		original_archive.write(meta_data)
-		inside_file_size += len(meta_data)
-
-		meta_padding = self.block_size(len(meta_data)) - len(meta_data)
-		inside_file_size += meta_padding
-		original_archive.write(self.padding(meta_padding))
+		inside_file_size = original_archive.tell() - self.start_position()
+		original_archive.write(self.archive_end(inside_file_size, meta_offset, meta_data))
 
-		delta = self.record_size(inside_file_size + (tarfile.BLOCKSIZE * 2)) - inside_file_size
-		original_archive.write(self.padding(delta))
+	def __write_member(self, name, data):
+		# returns offset of the member data
+		original_archive = self.original_archive()
+		original_archive.write(self.tar_header(name, size=len(data)))
+		data_offset = original_archive.tell()
+		original_archive.write(data)
+		original_archive.write(self.padding(self.block_size(len(data)) - len(data)))
+		return data_offset
 
 	@classmethod
 	def process_meta(cls, meta):
@@ -252,48 +854,720 @@ class WMetaTarPatcher(WTarPatcher):
 		return result
 
 
-class WArchiverHashCalculationWriter(WHashCalculationWriter, WBackupMetaProvider):
+class WStreamingTarWriter(WBasicTarWriter, WBackupMetaProvider):
+	""" Writes archive without seeking back, so that archive may be written to a pipe or to a socket. Data is
+	buffered and is written as a sequence of tar members ("<inside file name>.000000", "<inside file name>.000001"
+	and so on) of the "part_size" size at most, so the size of every member is known before its header is written.
+	Meta file and the end of the archive are written by the :meth:`.WStreamingTarWriter.patch` call
+	"""
 
-	def __init__(self, raw):
-		WHashCalculationWriter.__init__(self, raw, WBackupMeta.Archive.__hash_generator_name__)
+	__default_part_size__ = 16 * 1024 * 1024
+
+	@verify_type(inside_file_name=str, part_size=(int, None))
+	@verify_value(part_size=lambda x: x is None or x > 0)
+	def __init__(self, archive, inside_file_name, meta_provider, part_size=None):
+		self.__archive = archive
+		io.BufferedWriter.__init__(self, WDiscardWriterResult(self.__archive))
 		WBackupMetaProvider.__init__(self)
 
+		self.__inside_file_name = inside_file_name
+		self.__meta_provider = meta_provider
+		self.__part_size = part_size if part_size is not None else self.__default_part_size__
+		self.__buffer = bytearray()
+		self.__parts_count = 0
+		self.__bytes_written = 0
+
+	def inside_file_name(self):
+		return self.__inside_file_name
+
+	def meta_provider(self):
+		return self.__meta_provider
+
+	def part_size(self):
+		return self.__part_size
+
+	def parts_count(self):
+		return self.__parts_count
+
+	@classmethod
+	@verify_type(inside_file_name=str, part_index=int)
+	def part_name(cls, inside_file_name, part_index):
+		return '%s.%06i' % (inside_file_name, part_index)
+
+	def write(self, b):
+		data = memoryview(b).cast('B')
+		part_size = self.part_size()
+		while len(data) > 0:
+			if len(self.__buffer) == 0 and len(data) >= part_size:
+				# a complete part is written without copying
+				self.__write_part(data[:part_size])
+				data = data[part_size:]
+				continue
+
+			piece_size = min(part_size - len(self.__buffer), len(data))
+			self.__buffer.extend(data[:piece_size])
+			data = data[piece_size:]
+			if len(self.__buffer) == part_size:
+				self.__write_part(self.__buffer)
+				self.__buffer = bytearray()
+		return len(b)
+
+	def tell(self):
+		# the target may be unseekable, so the position inside the inside file is returned
+		return (self.__parts_count * self.part_size()) + len(self.__buffer)
+
+	def __write_member(self, name, data):
+		# returns offset of the member data
+		self.__archive.write(self.tar_header(name, size=len(data)))
+		self.__archive.write(memoryview(data))
+		padding_size = self.block_size(len(data)) - len(data)
+		self.__archive.write(self.padding(padding_size))
+		data_offset = self.__bytes_written + tarfile.BLOCKSIZE
+		self.__bytes_written += tarfile.BLOCKSIZE + len(data) + padding_size
+		return data_offset
+
+	def __write_part(self, data):
+		self.__write_member(self.part_name(self.inside_file_name(), self.__parts_count), data)
+		self.__parts_count += 1
+
+	def flush(self):
+		# incomplete part is kept until the next write or the patch call
+		self.__archive.flush()
+
+	def close(self):
+		self.__archive.close()
+		io.BufferedWriter.close(self)
+
+	def patch(self):
+		if len(self.__buffer) > 0 or self.__parts_count == 0:
+			self.__write_part(self.__buffer)
+			self.__buffer = bytearray()
+
+		extra_members = {}
+		for member_name, member_data in self.meta_provider().extra_members():
+			extra_members[member_name] = [self.__write_member(member_name, member_data), len(member_data)]
+
+		meta_data = self.encoded_meta(self.meta_provider(), extra_members=extra_members)
+		meta_offset = self.__write_member(WBackupMeta.Archive.__meta_filename__, meta_data)
+
+		self.__archive.write(self.archive_end(self.__bytes_written, meta_offset, meta_data))
+		self.__archive.flush()
+
 	def meta(self):
 		return {
-			WBackupMeta.Archive.MetaOptions.hash_algorithm:
-				WBackupMeta.Archive.__hash_generator_name__,
-			WBackupMeta.Archive.MetaOptions.hash_value:
-				self.hexdigest()
+			WBackupMeta.Archive.MetaOptions.inside_file_parts: self.__parts_count
+		}
+
+
+class WArchiverHash:
+	""" Hash algorithms that may be used for archive integrity checks. BLAKE2 algorithms require python 3.6+ and
+	XXH3 ones require "xxhash" module. XXH3 algorithms are not cryptographic ones, so they are suitable for
+	corruption detection only
+	"""
+
+	__generators__ = {
+		'MD5': lambda: hashlib.md5,
+		'SHA1': lambda: hashlib.sha1,
+		'SHA256': lambda: hashlib.sha256,
+		'SHA512': lambda: hashlib.sha512,
+		'BLAKE2B': lambda: getattr(hashlib, 'blake2b', None),
+		'BLAKE2S': lambda: getattr(hashlib, 'blake2s', None),
+		'XXH3_64': lambda: getattr(xxhash, 'xxh3_64', None),
+		'XXH3_128': lambda: getattr(xxhash, 'xxh3_128', None)
+	}
+
+	@classmethod
+	def algorithms(cls):
+		return tuple(x for x in sorted(cls.__generators__.keys()) if cls.available(x) is True)
+
+	@classmethod
+	@verify_type(hash_algorithm=str)
+	def available(cls, hash_algorithm):
+		generator_fn = cls.__generators__.get(hash_algorithm.upper())
+		return generator_fn is not None and generator_fn() is not None
+
+	@classmethod
+	@verify_type('paranoid', hash_algorithm=str)
+	def new(cls, hash_algorithm):
+		if cls.available(hash_algorithm) is False:
+			raise RuntimeError('Hash algorithm "%s" is unavailable' % hash_algorithm)
+		return cls.__generators__[hash_algorithm.upper()]()()
+
+	@classmethod
+	@verify_type('paranoid', hash_algorithm=str, chunk_digests=list)
+	def root_digest(cls, hash_algorithm, chunk_digests):
+		hash_obj = cls.new(hash_algorithm)
+		for digest in chunk_digests:
+			hash_obj.update(bytes.fromhex(digest))
+		return hash_obj.hexdigest().upper()
+
+
+class WArchiverHashCalculationWriter(io.BufferedWriter, WBackupMetaProvider):
+	""" Calculates hash of the written data. If "chunk_size" is specified, then data is hashed in fixed-size
+	segments that may be checked independently of each other, and the resulting hash is a root digest of segment
+	digests (see :meth:`.WArchiverHash.root_digest`)
+	"""
+
+	@verify_type(hash_algorithm=(str, None), chunk_size=(int, None))
+	@verify_value(chunk_size=lambda x: x is None or x > 0)
+	def __init__(self, raw, hash_algorithm=None, chunk_size=None):
+		io.BufferedWriter.__init__(self, raw)
+		WBackupMetaProvider.__init__(self)
+		self.__hash_algorithm = \
+			hash_algorithm.upper() if hash_algorithm is not None else WBackupMeta.Archive.__hash_generator_name__
+		self.__hash = WArchiverHash.new(self.__hash_algorithm)
+		self.__chunk_size = chunk_size
+		self.__chunk_bytes = 0
+		self.__chunks = []
+
+	def hash_algorithm(self):
+		return self.__hash_algorithm
+
+	def chunk_size(self):
+		return self.__chunk_size
+
+	def chunk_digests(self):
+		result = self.__chunks.copy()
+		if self.__chunk_bytes > 0:
+			result.append(self.__hash.hexdigest().upper())
+		return result
+
+	def hexdigest(self):
+		if self.__chunk_size is None:
+			return self.__hash.hexdigest().upper()
+		return WArchiverHash.root_digest(self.__hash_algorithm, self.chunk_digests())
+
+	@verify_type('paranoid', b=(bytes, memoryview))
+	def write(self, b):
+		if self.__chunk_size is None:
+			self.__hash.update(b)
+		else:
+			self.__update_chunks(b)
+		io.BufferedWriter.write(self, b)
+		return len(b)
+
+	def __update_chunks(self, b):
+		data = memoryview(b)
+		while len(data) > 0:
+			piece_size = min(self.__chunk_size - self.__chunk_bytes, len(data))
+			self.__hash.update(data[:piece_size])
+			self.__chunk_bytes += piece_size
+			data = data[piece_size:]
+
+			if self.__chunk_bytes == self.__chunk_size:
+				self.__chunks.append(self.__hash.hexdigest().upper())
+				self.__hash = WArchiverHash.new(self.__hash_algorithm)
+				self.__chunk_bytes = 0
+
+	def meta(self):
+		result = {
+			WBackupMeta.Archive.MetaOptions.hash_algorithm: self.hash_algorithm(),
+			WBackupMeta.Archive.MetaOptions.hash_value: self.hexdigest()
 		}
+		if self.__chunk_size is not None:
+			result[WBackupMeta.Archive.MetaOptions.hash_chunk_size] = self.__chunk_size
+			result[WBackupMeta.Archive.MetaOptions.hash_chunks] = self.chunk_digests()
+		return result
+
+
+class WArchiverHashCalculationReader(WBufferedIOReader):
+
+	@verify_type(hash_algorithm=str)
+	def __init__(self, raw, hash_algorithm):
+		WBufferedIOReader.__init__(self, raw)
+		self.__hash_algorithm = hash_algorithm.upper()
+		self.__hash = WArchiverHash.new(self.__hash_algorithm)
+
+	def hash_algorithm(self):
+		return self.__hash_algorithm
+
+	def hexdigest(self):
+		return self.__hash.hexdigest().upper()
+
+	def read_chunk(self, size):
+		result = WBufferedIOReader.read_chunk(self, size)
+		self.__hash.update(result)
+		return result
 
 
 class WArchiverAESCipher(WAESWriter, WBackupMetaProvider):
+	""" :class:`.WAESWriter` that encrypts every written chunk with a single cipher call. Only the unaligned tail
+	(that is shorter than a cipher block) is kept between writes, so the written data is not copied. If a cipher
+	supports output buffers (like PyCryptodome ciphers do), then data is encrypted into a reused buffer
+	"""
 
 	def __init__(self, raw, cipher):
 		WAESWriter.__init__(self, raw, cipher.aes_cipher())
 		WBackupMetaProvider.__init__(self)
+		aes_cipher = cipher.aes_cipher()
+		self.__cipher = aes_cipher.cipher()
+		self.__cipher_padding = aes_cipher.mode().padding()
+		self.__cipher_block_size = aes_cipher.mode().key_size()
+		self.__buffer = bytearray()
+		self.__output_buffer = bytearray()
 		self.__meta = cipher.meta()
 
+	@verify_type('paranoid', b=(bytes, memoryview))
+	def write(self, b):
+		data = memoryview(b)
+		block_size = self.__cipher_block_size
+
+		if len(self.__buffer) > 0:
+			fill_size = min(block_size - len(self.__buffer), len(data))
+			self.__buffer += data[:fill_size]
+			data = data[fill_size:]
+			if len(self.__buffer) < block_size:
+				return len(b)
+			io.BufferedWriter.write(self, self.__encrypt(bytes(self.__buffer)))
+			self.__buffer.clear()
+
+		aligned_size = len(data) - (len(data) % block_size)
+		if aligned_size > 0:
+			io.BufferedWriter.write(self, self.__encrypt(data[:aligned_size]))
+		if aligned_size < len(data):
+			self.__buffer += data[aligned_size:]
+		return len(b)
+
+	def flush(self):
+		if len(self.__buffer) > 0:
+			data = self.__cipher_padding.pad(bytes(self.__buffer), self.__cipher_block_size)
+			io.BufferedWriter.write(self, self.__encrypt(data))
+			self.__buffer.clear()
+		io.BufferedWriter.flush(self)
+
+	def __encrypt(self, data):
+		if self.__output_buffer is not None:
+			if len(self.__output_buffer) < len(data):
+				self.__output_buffer = bytearray(len(data))
+			output = memoryview(self.__output_buffer)[:len(data)]
+			try:
+				self.__cipher.encrypt(data, output=output)
+				return output
+			except TypeError:
+				self.__output_buffer = None  # output buffers are not supported (PyCrypto cipher)
+		return self.__cipher.encrypt(data)
+
 	def meta(self):
 		return self.__meta
 
 
-class WArchiverThrottlingWriter(WThrottlingWriter, WBackupMetaProvider, WArchiverIOStatusProvider):
+class WArchiverRateSchedule:
+	""" Rate limits by time of day. Every window is a range of local time (from the start minute inclusive to the
+	end minute exclusive, a window may cross midnight) with its own rate limit (None means unlimited). The first
+	window that matches wins, the default rate is used outside of windows
+	"""
+
+	__window_re__ = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(.+)$')
+	__minutes_per_day__ = 24 * 60
+
+	@verify_type(windows=(list, tuple))
+	def __init__(self, windows):
+		""" Create new schedule
+
+		:param windows: list of (start minute, end minute, rate) where minutes are counted from midnight
+		"""
+		for start, end, rate in windows:
+			if start < 0 or start >= self.__minutes_per_day__ or end < 0 or end >= self.__minutes_per_day__:
+				raise ValueError('Invalid window time')
+			if start == end:
+				raise ValueError('Window can not be empty')
+			if rate is not None and rate <= 0:
+				raise ValueError('Rate limit must be positive')
+		self.__windows = tuple((int(x[0]), int(x[1]), x[2]) for x in windows)
+
+	def windows(self):
+		return self.__windows
+
+	@verify_type(default_rate=(int, float, None), now=(float, None))
+	def rate(self, default_rate=None, now=None):
+		""" Return rate limit for the given time
+
+		:param default_rate: rate that is used outside of windows
+		:param now: unix time (the current time by default)
+		:return: int, float or None
+		"""
+		local_time = time.localtime(now)
+		minute = local_time.tm_hour * 60 + local_time.tm_min
+		for start, end, rate in self.__windows:
+			if start < end:
+				if start <= minute < end:
+					return rate
+			elif minute >= start or minute < end:
+				return rate
+		return default_rate
+
+	@classmethod
+	@verify_type(value=str)
+	def parse(cls, value, size_fn):
+		""" Parse a schedule like "08:00-20:00=50M,20:00-08:00=unlimited"
+
+		:param value: comma-separated windows
+		:param size_fn: function that converts rate strings (like "50M") to numbers
+		:return: WArchiverRateSchedule
+		"""
+		windows = []
+		for window in value.split(','):
+			re_window = cls.__window_re__.search(window.strip())
+			if re_window is None:
+				raise ValueError('Invalid schedule window: "%s"' % window)
+			start_hour, start_minute, end_hour, end_minute, rate = re_window.groups()
+			if int(start_hour) > 23 or int(end_hour) > 23 or int(start_minute) > 59 or int(end_minute) > 59:
+				raise ValueError('Invalid schedule window: "%s"' % window)
+			windows.append((
+				int(start_hour) * 60 + int(start_minute),
+				int(end_hour) * 60 + int(end_minute),
+				None if rate.lower() == 'unlimited' else size_fn(rate)
+			))
+		return WArchiverRateSchedule(windows)
+
+
+class WArchiverPressureController:
+	""" Adaptive rate limit that holds the target stall percentage of the Linux pressure stall information (PSI).
+	The "some" share of I/O and CPU pressure (system-wide) is sampled periodically. If the highest one is above the
+	target, then the limit is decreased multiplicatively (it starts from the measured throughput), otherwise the
+	limit is raised till it is not a limit any more. Methods must be called by a single thread at a time
+	"""
+
+	__pressure_files__ = (('io', '/proc/pressure/io'), ('cpu', '/proc/pressure/cpu'))
+	__sample_interval__ = 1
+	__decrease_factor__ = 0.7
+	__increase_factor__ = 1.2
+	__minimum_rate__ = 64 * 1024
+
+	@verify_type(target=(int, float))
+	@verify_value(target=lambda x: 0 < x < 100)
+	def __init__(self, target):
+		""" Create new controller
+
+		:param target: stall percentage to hold
+		"""
+		self.__target = target
+		self.__rate = None
+		self.__pressure = {}
+		self.__totals = None
+		self.__sampled_at = None
+		self.__bytes_processed = 0
+
+	def target(self):
+		return self.__target
+
+	def rate(self):
+		""" Return the adaptive limit (None if I/O is not limited by pressure)
+		"""
+		return self.__rate
+
+	def pressure(self):
+		""" Return the last readings - dict where resource names ("io" and "cpu") are keys and stall percentages
+		are values (the dict is empty if PSI is unavailable or it was not sampled yet)
+		"""
+		return self.__pressure.copy()
+
+	def limit(self, rate):
+		""" Return the effective limit for the given limit (the limit that is set for this moment)
+		"""
+		if self.__rate is None:
+			return rate
+		if rate is None:
+			return self.__rate
+		return min(rate, self.__rate)
+
+	def adjust(self, rate, bytes_processed):
+		""" Sample pressure and adjust the adaptive limit if the sample interval has passed
+
+		:param rate: the limit that is set for this moment (the adaptive limit is never greater)
+		:param bytes_processed: total number of bytes that were processed by a limited I/O
+		:return: None
+		"""
+		now = time.monotonic()
+		if self.__sampled_at is not None and (now - self.__sampled_at) < self.__sample_interval__:
+			return
+
+		totals = self.stall_totals()
+		if totals is not None and self.__totals is not None:
+			duration = now - self.__sampled_at
+			# totals are in microseconds
+			self.__pressure = {
+				x: min((totals[x] - self.__totals[x]) / (duration * 10000), 100) for x in totals.keys()
+			}
+			throughput = (bytes_processed - self.__bytes_processed) / duration
+
+			if max(self.__pressure.values()) > self.__target:
+				current_rate = self.limit(rate)
+				if current_rate is None or current_rate > throughput:
+					current_rate = throughput
+				self.__rate = max(current_rate * self.__decrease_factor__, self.__minimum_rate__)
+			elif self.__rate is not None:
+				self.__rate *= self.__increase_factor__
+				if (rate is not None and self.__rate >= rate) or self.__rate > (throughput * 2):
+					self.__rate = None
+
+		self.__totals = totals
+		self.__sampled_at = now
+		self.__bytes_processed = bytes_processed
+
+	@classmethod
+	def stall_totals(cls):
+		""" Return total stall time (in microseconds) of every resource or None if PSI is unavailable
+		"""
+		result = {}
+		try:
+			for name, path in cls.__pressure_files__:
+				with open(path) as f:
+					for line in f:
+						if line.startswith('some ') is True:
+							result[name] = int(line.rsplit('total=', 1)[1])
+		except (OSError, ValueError, IndexError):
+			return None
+		if len(result) != len(cls.__pressure_files__):
+			return None
+		return result
+
+	@classmethod
+	def available(cls):
+		return cls.stall_totals() is not None
+
+
+class WArchiverTokenBucket:
+	""" Thread-safe token bucket that limits I/O rate. Tokens are added with the current rate up to the burst size,
+	every I/O operation takes tokens and the operation that takes more tokens than there are waits for the debt
+	to be paid off. Unlike the average rate limit, the rate is re-evaluated all the time, so a change of a
+	schedule window takes effect in the middle of a run (and a slowdown does not let a burst of the saved rate later).
+	A single bucket may be shared by several readers or writers, so they have a single limit. Buckets of different
+	processes have a single limit if they are created with the same shared state (see
+	:meth:`.WArchiverTokenBucket.shared_state`)
+	"""
+
+	__default_burst_time__ = 1  # burst size in seconds of the current rate (if it is not set explicitly)
+	__maximum_sleep__ = 1  # debt is waited in short sleeps, so the rate change is noticed
+
+	@verify_type(rate=(int, float, None), burst=(int, float, None), schedule=(WArchiverRateSchedule, None))
+	@verify_type(pressure_target=(int, float, None))
+	@verify_value(rate=lambda x: x is None or x > 0, burst=lambda x: x is None or x > 0)
+	def __init__(
+		self, rate=None, burst=None, schedule=None, pressure_target=None, shared_state=None, stop_event=None
+	):
+		""" Create new bucket
+
+		:param rate: rate limit (bytes per second). It is the limit outside of schedule windows, None means
+		unlimited
+		:param burst: bucket size - number of bytes that may be processed at once without waiting (one second of
+		the current rate by default)
+		:param schedule: rate limits by time of day
+		:param pressure_target: if specified, then the limit is adjusted to hold this stall percentage of I/O and
+		CPU pressure (see :class:`.WArchiverPressureController`). The adaptive limit is adjusted by every
+		process that shares the state
+		:param shared_state: state that is returned by :meth:`.WArchiverTokenBucket.shared_state` (tokens are
+		kept in this process if it is not set)
+		:param stop_event: event that terminates waiting (WResponsiveIO.IOTerminated is raised)
+		"""
+		self.__rate = rate
+		self.__burst = burst
+		self.__schedule = schedule
+		self.__pressure_controller = None
+		if pressure_target is not None:
+			self.__pressure_controller = WArchiverPressureController(pressure_target)
+		self.__shared_state = shared_state
+		self.__stop_event = stop_event
+		self.__tokens = None  # None means that the bucket is full
+		self.__updated_at = None
+		self.__bytes_processed = 0
+		self.__lock = shared_state.get_lock() if shared_state is not None else threading.Lock()
+
+	def burst(self):
+		return self.__burst
+
+	def schedule(self):
+		return self.__schedule
+
+	def pressure_controller(self):
+		return self.__pressure_controller
+
+	def current_rate(self):
+		""" Return the current rate limit (None if I/O is not limited now)
+		"""
+		rate = self.__scheduled_rate()
+		if self.__pressure_controller is not None:
+			return self.__pressure_controller.limit(rate)
+		return rate
+
+	def __scheduled_rate(self):
+		if self.__schedule is not None:
+			return self.__schedule.rate(self.__rate)
+		return self.__rate
+
+	def consume(self, size):
+		""" Take tokens for processed data and wait if there are not enough of them
+
+		:param size: size of data
+		:return: None
+		"""
+		with self.__lock:
+			self.__bytes_processed += size
+			if self.__pressure_controller is not None:
+				self.__pressure_controller.adjust(self.__scheduled_rate(), self.__bytes_processed)
+			rate = self.__refill()
+			if rate is None:
+				return
+			self.__tokens -= size
+			debt = -self.__tokens
+			if self.__shared_state is not None:
+				self.__shared_state[0] = self.__tokens
+
+		while debt > 0:
+			rate = self.current_rate()
+			if rate is None:
+				return
+			sleep_time = debt / rate
+			if sleep_time <= self.__maximum_sleep__:
+				self.__sleep(sleep_time)
+				return
+			self.__sleep(self.__maximum_sleep__)
+			debt -= self.__maximum_sleep__ * rate
+
+	def __sleep(self, timeout):
+		if self.__stop_event is None:
+			time.sleep(timeout)
+		elif self.__stop_event.wait(timeout) is True:
+			raise WResponsiveIO.IOTerminated('Stop event was set')
+
+	def __refill(self):
+		if self.__shared_state is not None:  # monotonic clock is the same for all the processes
+			tokens, updated_at = self.__shared_state[:]
+			self.__tokens = tokens if math.isnan(tokens) is False else None
+			self.__updated_at = updated_at
+
+		rate = self.current_rate()
+		now = time.monotonic()
+		if rate is None:
+			self.__tokens = None
+		else:
+			burst = self.__burst if self.__burst is not None else rate * self.__default_burst_time__
+			if self.__tokens is None:
+				self.__tokens = burst
+			else:
+				self.__tokens = min(self.__tokens + (now - self.__updated_at) * rate, burst)
+		self.__updated_at = now
+
+		if self.__shared_state is not None:
+			self.__shared_state[:] = [self.__tokens if self.__tokens is not None else math.nan, now]
+		return rate
+
+	@classmethod
+	def shared_state(cls):
+		""" Return new state of a bucket that is shared between processes. It must be passed to processes when
+		they are started (like any other synchronized object of the "multiprocessing" module)
+
+		:return: multiprocessing.Array
+		"""
+		return multiprocessing.Array('d', [math.nan, math.nan])
+
+	@classmethod
+	def bucket(cls, limit):
+		""" Return a bucket for the given limit (the limit itself if it is a bucket already)
+
+		:param limit: rate limit or a bucket
+		:return: WArchiverTokenBucket or None (if limit is None)
+		"""
+		if limit is None or isinstance(limit, WArchiverTokenBucket) is True:
+			return limit
+		return WArchiverTokenBucket(rate=limit)
+
+
+class WArchiverThrottlingIO(WArchiverIOStatusProvider):
+	""" Base class of throttling links that are limited by a token bucket. Processed bytes are counted by
+	:class:`WThrottlingIO` with no limit of its own
+	"""
+
+	def __init__(self, limit):
+		WArchiverIOStatusProvider.__init__(self)
+		self.__bucket = WArchiverTokenBucket.bucket(limit)
+
+	def token_bucket(self):
+		return self.__bucket
+
+	def consume_tokens(self, size):
+		if self.__bucket is not None and size > 0:
+			self.__bucket.consume(size)
+
+	def limit_status(self):
+		if self.__bucket is None:
+			return ''
+		rate = self.__bucket.current_rate()
+		result = '\nRate limit: %s' % ('%s/sec' % data_size_formatter(math.ceil(rate)) if rate is not None else 'none')
+
+		pressure_controller = self.__bucket.pressure_controller()
+		if pressure_controller is not None:
+			pressure = pressure_controller.pressure()
+			readings = ', '.join(['%s %.2f%%' % (x, pressure[x]) for x in sorted(pressure.keys())])
+			result += '\nPressure: %s (target %s%%)' % (
+				readings if len(readings) > 0 else 'unknown', str(pressure_controller.target())
+			)
+		return result
+
+
+class WArchiverThrottlingWriter(WThrottlingWriter, WBackupMetaProvider, WArchiverThrottlingIO):
 
 	def __init__(self, raw, write_limit=None):
-		WThrottlingWriter.__init__(self, raw, throttling_to=write_limit)
+		WThrottlingWriter.__init__(self, raw)
 		WBackupMetaProvider.__init__(self)
-		WArchiverIOStatusProvider.__init__(self)
+		WArchiverThrottlingIO.__init__(self, write_limit)
+
+	def write(self, b):
+		self.consume_tokens(len(b))
+		return WThrottlingWriter.write(self, b)
 
 	def meta(self):
+		rate = math.ceil(self.rate())
+		bucket = self.token_bucket()
+		if bucket is None or bucket.pressure_controller() is None:
+			return {WBackupMeta.Archive.MetaOptions.io_write_rate: rate}
+
+		pressure_controller = bucket.pressure_controller()
+		pressure = pressure_controller.pressure()
+		rate_limit = bucket.current_rate()
 		return {
-			WBackupMeta.Archive.MetaOptions.io_write_rate: math.ceil(self.rate())
+			WBackupMeta.Archive.MetaOptions.io_write_rate: {
+				WBackupMeta.Archive.IORateOptions.rate.value: rate,
+				WBackupMeta.Archive.IORateOptions.rate_limit.value:
+					math.ceil(rate_limit) if rate_limit is not None else None,
+				WBackupMeta.Archive.IORateOptions.pressure_target.value: pressure_controller.target(),
+				WBackupMeta.Archive.IORateOptions.io_pressure.value:
+					round(pressure['io'], 2) if 'io' in pressure else None,
+				WBackupMeta.Archive.IORateOptions.cpu_pressure.value:
+					round(pressure['cpu'], 2) if 'cpu' in pressure else None
+			}
 		}
 
 	def status(self):
 		result = 'Write rate: %s/sec\n' % data_size_formatter(math.ceil(self.rate()))
 		result += 'Bytes processed: %i' % self.bytes_processed()
-		return result
+		return result + self.limit_status()
+
+
+class WArchiverSourceThrottlingWriter(WThrottlingWriter, WBackupMetaProvider, WArchiverThrottlingIO):
+	""" Throttling link of uncompressed archive data. It is placed above the compression stage, so it limits the
+	rate that sources (files or output of programs) are read with, since they are not read ahead more than it is
+	bounded by an archiver
+	"""
+
+	def __init__(self, raw, read_limit=None):
+		WThrottlingWriter.__init__(self, raw)
+		WBackupMetaProvider.__init__(self)
+		WArchiverThrottlingIO.__init__(self, read_limit)
+
+	def write(self, b):
+		self.consume_tokens(len(b))
+		return WThrottlingWriter.write(self, b)
+
+	def meta(self):
+		return {
+			WBackupMeta.Archive.MetaOptions.source_read_rate: math.ceil(self.rate())
+		}
+
+	def status(self):
+		result = 'Source read rate: %s/sec\n' % data_size_formatter(math.ceil(self.rate()))
+		result += 'Source bytes processed: %i' % self.bytes_processed()
+		return result + self.limit_status()
 
 
 class WArchiverDataCounter(WThrottlingWriter, WBackupMetaProvider):
@@ -308,17 +1582,349 @@ class WArchiverDataCounter(WThrottlingWriter, WBackupMetaProvider):
 		}
 
 
-class WArchiverThrottlingReader(WThrottlingReader, WArchiverIOStatusProvider):
+class WArchiverThrottlingReader(WThrottlingReader, WArchiverThrottlingIO):
 
 	def __init__(self, raw, read_limit=None):
-		WThrottlingReader.__init__(self, raw, throttling_to=read_limit)
-		WArchiverIOStatusProvider.__init__(self)
+		WThrottlingReader.__init__(self, raw)
+		WArchiverThrottlingIO.__init__(self, read_limit)
+
+	def read_chunk(self, size):
+		result = WThrottlingReader.read_chunk(self, size)
+		self.consume_tokens(len(result))
+		return result
 
 	def status(self):
 		result = 'Read rate: %s/sec\n' % data_size_formatter(math.ceil(self.rate()))
 		result += 'Bytes processed: %i' % self.bytes_processed()
+		return result + self.limit_status()
+
+
+class WArchiverThrottlingSource(io.RawIOBase, WThrottlingIO, WArchiverThrottlingIO):
+	""" Seekable file object (like the inside file) which reading is throttled and may be terminated with the stop
+	event. Unlike reader chain links, exactly the requested data is returned, so it may be read with random access
+	"""
+
+	def __init__(self, source, read_limit=None, stop_event=None):
+		io.RawIOBase.__init__(self)
+		WThrottlingIO.__init__(self)
+		WArchiverThrottlingIO.__init__(self, read_limit)
+		self.__source = source
+		self.__stop_event = stop_event
+		self.start_counter()
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return self.__source.seekable()
+
+	def tell(self):
+		return self.__source.tell()
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		return self.__source.seek(offset, whence)
+
+	def readinto(self, b):
+		if self.__stop_event is not None and self.__stop_event.is_set():
+			raise WResponsiveIO.IOTerminated('Stop event was set')
+		result = self.__source.readinto(b)
+		if result is not None:
+			self.increase_counter(result)
+			self.consume_tokens(result)
 		return result
 
+	def status(self):
+		result = 'Read rate: %s/sec\n' % data_size_formatter(math.ceil(self.rate()))
+		result += 'Bytes processed: %i' % self.bytes_processed()
+		return result + self.limit_status()
+
+	def close(self):
+		self.stop_counter()
+		self.__source.close()
+		io.RawIOBase.close(self)
+
+
+class WArchiverAESReader(WBufferedIOReader):
+	""" Reader chain link that decrypts data. Data is decrypted in pieces that are aligned to the cipher block,
+	the unaligned rest is kept till the next read. If the original data size is known, then the zero padding that
+	was added by encryption is dropped. Unlike the other links, no more data than it was requested is returned,
+	since decompressors (that may read this link) rely on it
+	"""
+
+	@verify_type(cipher=WAES, data_size=(int, None))
+	@verify_value(data_size=lambda x: x is None or x >= 0)
+	def __init__(self, raw, cipher, data_size=None):
+		WBufferedIOReader.__init__(self, raw)
+		self.__cipher = cipher.cipher()
+		self.__data_size = data_size
+		self.__bytes_decrypted = 0
+		self.__buffer = b''
+		self.__decrypted = b''
+		self.__decrypted_offset = 0
+
+	def read(self, size=-1):
+		if size is None or size < 0:
+			return WBufferedIOReader.read(self, size)
+		result = []
+		bytes_read = 0
+		while bytes_read < size:
+			chunk = self.read_chunk(size - bytes_read)
+			if len(chunk) == 0:
+				break
+			result.append(chunk)
+			bytes_read += len(chunk)
+		return b''.join(result)
+
+	def read_chunk(self, size):
+		if size <= 0:
+			return b''
+		if self.__decrypted_offset >= len(self.__decrypted):
+			self.__decrypted = self.__decrypt(size)
+			self.__decrypted_offset = 0
+		result = self.__decrypted[self.__decrypted_offset:self.__decrypted_offset + size]
+		self.__decrypted_offset += len(result)
+		return result
+
+	def __decrypt(self, size):
+		block_size = WAESMode.__data_padding_length__
+		result = b''
+		while len(result) == 0:
+			if self.__data_size is not None and self.__bytes_decrypted >= self.__data_size:
+				return b''
+
+			data = self.raw.read(max(size, block_size))
+			if len(data) == 0:
+				if len(self.__buffer) > 0:
+					raise RuntimeError('Archive is corrupted - encrypted data is not aligned to the cipher block')
+				return b''
+
+			data = self.__buffer + data
+			aligned_size = len(data) - (len(data) % block_size)
+			self.__buffer = data[aligned_size:]
+			if aligned_size > 0:
+				result = self.__cipher.decrypt(data[:aligned_size])
+				if self.__data_size is not None:
+					result = result[:self.__data_size - self.__bytes_decrypted]
+				self.__bytes_decrypted += len(result)
+		return result
+
+
+class WArchiverPipelineWriter(io.BufferedWriter):
+	""" Writer chain link that passes data to the next link in a separate thread. Data is passed in chunks
+	through a bounded queue, so the memory that is used by this link is limited by "queue_size" * "chunk_size" and
+	a writer is blocked when the next link is slower (back pressure). Errors of the next link are re-raised
+	by the following write or flush
+	"""
+
+	__default_chunk_size__ = 1024 * 1024
+	__polling_timeout__ = 0.1
+
+	class FlushMarker:
+
+		def __init__(self):
+			self.event = threading.Event()
+
+	@verify_type(queue_size=int, chunk_size=(int, None))
+	@verify_value(queue_size=lambda x: x > 0, chunk_size=lambda x: x is None or x > 0)
+	def __init__(self, raw, queue_size, stop_event=None, chunk_size=None):
+		io.BufferedWriter.__init__(self, raw)
+		self.__queue = queue.Queue(maxsize=queue_size)
+		self.__stop_event = stop_event
+		self.__chunk_size = chunk_size if chunk_size is not None else self.__default_chunk_size__
+		self.__buffer = bytearray()
+		self.__error = None
+		self.__aborted = False
+		self.__thread = threading.Thread(target=self.__worker, daemon=True)
+		self.__thread.start()
+
+	def write(self, b):
+		self.__check_state()
+		self.__buffer += b
+		if len(self.__buffer) >= self.__chunk_size:
+			self.__put(self.__buffer)
+			self.__buffer = bytearray()
+		return len(b)
+
+	def flush(self):
+		if self.__thread.is_alive() is False:
+			self.__check_state()
+			return
+
+		if len(self.__buffer) > 0:
+			self.__put(self.__buffer)
+			self.__buffer = bytearray()
+
+		marker = WArchiverPipelineWriter.FlushMarker()
+		self.__put(marker)
+		while marker.event.wait(self.__polling_timeout__) is False:
+			self.__check_state()
+		self.__check_state()
+
+	def tell(self):
+		self.flush()
+		return self.raw.tell()
+
+	def seek(self, pos, whence=os.SEEK_SET):
+		self.flush()
+		return self.raw.seek(pos, whence)
+
+	def close(self):
+		if self.closed is True:
+			return
+		if self.__thread.is_alive() is True:
+			self.flush()
+			self.__put(None)
+			self.__thread.join()
+		io.BufferedWriter.close(self)
+
+	def abort(self):
+		self.__aborted = True
+
+	def __terminated(self):
+		if self.__aborted is True:
+			return True
+		return self.__stop_event is not None and self.__stop_event.is_set()
+
+	def __check_state(self):
+		if self.__error is not None:
+			raise self.__error
+		if self.__terminated() is True:
+			raise WResponsiveIO.IOTerminated('Stop event was set')
+
+	def __put(self, item):
+		while True:
+			try:
+				self.__queue.put(item, timeout=self.__polling_timeout__)
+				return
+			except queue.Full:
+				self.__check_state()
+				if self.__thread.is_alive() is False:
+					raise RuntimeError('Pipeline thread was stopped unexpectedly')
+
+	def __worker(self):
+		while self.__terminated() is False:
+			try:
+				item = self.__queue.get(timeout=self.__polling_timeout__)
+			except queue.Empty:
+				continue
+
+			if item is None:
+				return
+			elif isinstance(item, WArchiverPipelineWriter.FlushMarker) is True:
+				item.event.set()
+				continue
+
+			try:
+				self.raw.write(memoryview(item))
+			except Exception as e:
+				self.__error = e
+				return
+
+
+class WArchiverTeeWriter(io.RawIOBase):
+	""" Writes archive to a local file (optionally) and passes the same data to a reader that is used by another
+	thread (by a network client that uploads archive, for example). Data is passed in chunks through a bounded
+	queue, so archive creation is slowed down to the reader speed when the queue is full. If the reader is
+	closed before all the data is read, then data is written to the local file only (or an exception is raised
+	if there is no local file)
+	"""
+
+	__default_chunk_size__ = 1024 * 1024
+	__default_queue_size__ = 16
+	__polling_timeout__ = 0.1
+
+	class Aborted:
+		pass
+
+	class Reader(io.RawIOBase):
+
+		def __init__(self, data_queue):
+			io.RawIOBase.__init__(self)
+			self.__queue = data_queue
+			self.__data = memoryview(b'')
+			self.__eof = False
+
+		def readable(self):
+			return True
+
+		def readinto(self, b):
+			while len(self.__data) == 0:
+				if self.__eof is True:
+					return 0
+				item = self.__queue.get()
+				if item is None:
+					self.__eof = True
+				elif isinstance(item, WArchiverTeeWriter.Aborted) is True:
+					raise RuntimeError('Archive creation was aborted')
+				else:
+					self.__data = memoryview(item)
+
+			result = min(len(b), len(self.__data))
+			b[:result] = self.__data[:result]
+			self.__data = self.__data[result:]
+			return result
+
+	@verify_type(local_path=(str, None), queue_size=(int, None), chunk_size=(int, None))
+	@verify_value(queue_size=lambda x: x is None or x > 0, chunk_size=lambda x: x is None or x > 0)
+	def __init__(self, local_path=None, queue_size=None, chunk_size=None):
+		io.RawIOBase.__init__(self)
+		self.__local_file = open(local_path, mode='wb') if local_path is not None else None
+		self.__queue = queue.Queue(maxsize=queue_size if queue_size is not None else self.__default_queue_size__)
+		self.__chunk_size = chunk_size if chunk_size is not None else self.__default_chunk_size__
+		self.__reader = WArchiverTeeWriter.Reader(self.__queue)
+		self.__buffer = bytearray()
+
+	def reader(self):
+		return self.__reader
+
+	def local_file(self):
+		return self.__local_file
+
+	def writable(self):
+		return True
+
+	def write(self, b):
+		if self.__local_file is not None:
+			self.__local_file.write(b)
+		if self.__reader.closed is False:
+			self.__buffer += b
+			if len(self.__buffer) >= self.__chunk_size:
+				self.__put(self.__buffer)
+				self.__buffer = bytearray()
+		elif self.__local_file is None:
+			raise RuntimeError('Archive reader was closed unexpectedly')
+		return len(b)
+
+	def flush(self):
+		if self.__local_file is not None:
+			self.__local_file.flush()
+
+	def close(self):
+		if self.closed is True:
+			return
+		if len(self.__buffer) > 0:
+			self.__put(self.__buffer)
+			self.__buffer = bytearray()
+		self.__put(None)
+		io.RawIOBase.close(self)
+		if self.__local_file is not None:
+			self.__local_file.close()
+
+	def abort(self):
+		""" Interrupt the reader (the following read will raise an exception)
+		"""
+		if self.closed is False:
+			self.__buffer = bytearray()
+			self.__put(WArchiverTeeWriter.Aborted())
+
+	def __put(self, item):
+		while self.__reader.closed is False:
+			try:
+				self.__queue.put(item, timeout=self.__polling_timeout__)
+				return
+			except queue.Full:
+				pass
+
 
 class WArchiverStatus(metaclass=ABCMeta):
 
@@ -342,6 +1948,620 @@ class WArchiverStatus(metaclass=ABCMeta):
 		raise NotImplementedError('This method is abstract')
 
 
+class WArchiverVolumes:
+	""" Routines for multi-volume archives. Volumes are files that are named after the archive with numeric
+	suffixes (like "archive.tar.000", "archive.tar.001"...) and the archive path itself is a JSON manifest that
+	describes volumes. Volumes are concatenated parts of a single tar archive
+	"""
+
+	__manifest_format__ = 'wasp-backup-volumes'
+	__manifest_version__ = 1
+	__maximum_manifest_size__ = 10 * 1024 * 1024
+
+	@classmethod
+	@verify_type(archive_path=str, volume_index=int)
+	def volume_path(cls, archive_path, volume_index):
+		return '%s.%03i' % (archive_path, volume_index)
+
+	@classmethod
+	@verify_type(archive_path=str)
+	def is_manifest(cls, archive_path):
+		try:
+			with open(archive_path, 'rb') as f:
+				if f.read(1) != b'{':
+					return False  # tar archive starts with a file name
+		except OSError:
+			return False
+		return cls.read_manifest(archive_path) is not None
+
+	@classmethod
+	@verify_type(archive_path=str)
+	def read_manifest(cls, archive_path):
+		with open(archive_path, 'rb') as f:
+			manifest_data = f.read(cls.__maximum_manifest_size__)
+		try:
+			manifest = json.loads(manifest_data.decode())
+		except ValueError:
+			return None
+		if isinstance(manifest, dict) is False or manifest.get('format') != cls.__manifest_format__:
+			return None
+		if manifest.get('version') != cls.__manifest_version__:
+			raise RuntimeError('Unsupported volumes manifest version: "%s"' % str(manifest.get('version')))
+		return manifest
+
+	@classmethod
+	@verify_type('paranoid', archive_path=str, volume_size=int, volume_sizes=list)
+	def write_manifest(cls, archive_path, volume_size, volume_sizes):
+		manifest = {
+			'format': cls.__manifest_format__,
+			'version': cls.__manifest_version__,
+			'volume_size': volume_size,
+			'archive_size': sum(volume_sizes),
+			'volumes': volume_sizes
+		}
+		temp_path = archive_path + '.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(manifest, f)
+		os.replace(temp_path, archive_path)
+
+	@classmethod
+	@verify_type('paranoid', archive_path=str)
+	def volumes(cls, archive_path):
+		""" Return paths of archive volumes. If the archive is a regular one, then the archive path is returned
+
+		:param archive_path: archive (or manifest) to check
+		:return: list of str
+		"""
+		if cls.is_manifest(archive_path) is False:
+			return [archive_path]
+		manifest = cls.read_manifest(archive_path)
+		return [cls.volume_path(archive_path, x) for x in range(len(manifest['volumes']))]
+
+	@classmethod
+	@verify_type('paranoid', archive_path=str)
+	def archive_size(cls, archive_path):
+		if cls.is_manifest(archive_path) is False:
+			return os.stat(archive_path).st_size
+		return cls.read_manifest(archive_path)['archive_size']
+
+	@classmethod
+	@verify_type('paranoid', archive_path=str)
+	def open(cls, archive_path):
+		""" Open archive for reading. Volumes of a multi-volume archive are read as a single file
+
+		:param archive_path: archive (or manifest) to open
+		:return: file object
+		"""
+		if cls.is_manifest(archive_path) is False:
+			return open(archive_path, 'rb')
+		return io.BufferedReader(WArchiverVolumeReader(archive_path))
+
+
+class WArchiverVolumeWriter(io.RawIOBase):
+	""" Target file object that splits written data into volumes of the specified size. A volume is sealed (closed
+	and passed to the callback) when data is written to the next volume, so it may be processed (uploaded for
+	example) while the rest of archive is written. The first volume is sealed last, because archive header is
+	patched after all the data is written. Sealed volumes can not be changed. The manifest is written on close
+	"""
+
+	@verify_type(archive_path=str, volume_size=int)
+	@verify_value(archive_path=lambda x: len(x) > 0, volume_size=lambda x: x > 0)
+	@verify_value(volume_callback=lambda x: x is None or callable(x))
+	def __init__(self, archive_path, volume_size, volume_callback=None):
+		io.RawIOBase.__init__(self)
+		self.__archive_path = archive_path
+		self.__volume_size = volume_size
+		self.__volume_callback = volume_callback
+		self.__volumes = []  # file objects of volumes, None is for sealed ones
+		self.__volumes_position = []
+		self.__position = 0
+		self.__size = 0
+		self.__discarded = False
+
+	def archive_path(self):
+		return self.__archive_path
+
+	def volume_size(self):
+		return self.__volume_size
+
+	def volumes_count(self):
+		return len(self.__volumes)
+
+	def writable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.__position
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self.__position
+		elif whence == os.SEEK_END:
+			offset += self.__size
+		if offset < 0:
+			raise ValueError('Negative seek position %i' % offset)
+		self.__position = offset
+		return self.__position
+
+	def write(self, b):
+		data = memoryview(b)
+		bytes_written = 0
+		while bytes_written < len(data):
+			volume_index, volume_offset = divmod(self.__position, self.__volume_size)
+			volume = self.__volume(volume_index)
+			piece_size = min(self.__volume_size - volume_offset, len(data) - bytes_written)
+
+			if self.__volumes_position[volume_index] != volume_offset:
+				volume.seek(volume_offset)
+			volume.write(data[bytes_written:bytes_written + piece_size])
+			self.__volumes_position[volume_index] = volume_offset + piece_size
+
+			bytes_written += piece_size
+			self.__position += piece_size
+			self.__size = max(self.__size, self.__position)
+		return bytes_written
+
+	def flush(self):
+		for volume in self.__volumes:
+			if volume is not None:
+				volume.flush()
+
+	def close(self):
+		if self.closed is True:
+			return
+		try:
+			if self.__discarded is False:
+				for volume_index in reversed(range(len(self.__volumes))):
+					self.__seal(volume_index)
+
+				volume_sizes = [self.__volume_size] * len(self.__volumes)
+				if len(volume_sizes) > 0:
+					volume_sizes[-1] = self.__size - (self.__volume_size * (len(volume_sizes) - 1))
+				WArchiverVolumes.write_manifest(self.__archive_path, self.__volume_size, volume_sizes)
+		finally:
+			io.RawIOBase.close(self)
+
+	def discard(self):
+		""" Close and remove all the volumes. Manifest will not be written
+		"""
+		self.__discarded = True
+		for volume_index in range(len(self.__volumes)):
+			volume = self.__volumes[volume_index]
+			if volume is not None:
+				volume.close()
+				self.__volumes[volume_index] = None
+			volume_path = WArchiverVolumes.volume_path(self.__archive_path, volume_index)
+			if os.path.exists(volume_path):
+				os.unlink(volume_path)
+		self.close()
+
+	def __volume(self, volume_index):
+		while len(self.__volumes) <= volume_index:
+			# previous volumes are complete, but the first one may be patched later
+			if len(self.__volumes) > 1:
+				self.__seal(len(self.__volumes) - 1)
+			volume_path = WArchiverVolumes.volume_path(self.__archive_path, len(self.__volumes))
+			self.__volumes.append(open(volume_path, 'wb'))
+			self.__volumes_position.append(0)
+
+		volume = self.__volumes[volume_index]
+		if volume is None:
+			raise RuntimeError('Unable to write data to the sealed volume #%i' % volume_index)
+		return volume
+
+	def __seal(self, volume_index):
+		volume = self.__volumes[volume_index]
+		if volume is None:
+			return
+		if volume_index < (len(self.__volumes) - 1):
+			volume.truncate(self.__volume_size)  # the whole volume must be written (in case of seeking)
+		volume.close()
+		self.__volumes[volume_index] = None
+
+		if self.__volume_callback is not None:
+			self.__volume_callback(WArchiverVolumes.volume_path(self.__archive_path, volume_index))
+
+
+class WArchiverVolumeReader(io.RawIOBase):
+	""" Reads volumes of a multi-volume archive as a single file
+	"""
+
+	@verify_type(archive_path=str)
+	def __init__(self, archive_path):
+		io.RawIOBase.__init__(self)
+		manifest = WArchiverVolumes.read_manifest(archive_path)
+		if manifest is None:
+			raise RuntimeError('File "%s" is not a volumes manifest' % archive_path)
+
+		self.__archive_path = archive_path
+		self.__volume_size = manifest['volume_size']
+		self.__volume_sizes = manifest['volumes']
+		self.__size = manifest['archive_size']
+		self.__position = 0
+		self.__volume = None
+		self.__volume_index = None
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.__position
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self.__position
+		elif whence == os.SEEK_END:
+			offset += self.__size
+		if offset < 0:
+			raise ValueError('Negative seek position %i' % offset)
+		self.__position = offset
+		return self.__position
+
+	def readinto(self, b):
+		if self.__position >= self.__size:
+			return 0
+
+		volume_index, volume_offset = divmod(self.__position, self.__volume_size)
+		if volume_index != self.__volume_index:
+			if self.__volume is not None:
+				self.__volume.close()
+			self.__volume = open(WArchiverVolumes.volume_path(self.__archive_path, volume_index), 'rb')
+			self.__volume_index = volume_index
+
+		piece_size = min(len(b), self.__volume_sizes[volume_index] - volume_offset)
+		self.__volume.seek(volume_offset)
+		bytes_read = self.__volume.readinto(memoryview(b)[:piece_size])
+		if bytes_read == 0:
+			raise RuntimeError('Volume #%i of archive "%s" is truncated' % (volume_index, self.__archive_path))
+		self.__position += bytes_read
+		return bytes_read
+
+	def close(self):
+		if self.__volume is not None:
+			self.__volume.close()
+			self.__volume = None
+		io.RawIOBase.close(self)
+
+
+class WArchiverSegmentsReader(io.RawIOBase):
+	""" Reads several segments of a seekable file as a single file. It is used for reading an inside file of
+	a streaming archive, which data is split into several tar members
+	"""
+
+	@verify_type(segments=list)
+	def __init__(self, source, segments):
+		""" Create new reader
+
+		:param source: seekable file object
+		:param segments: list of pairs - offset of a segment in the source and its size
+		"""
+		io.RawIOBase.__init__(self)
+		self.__source = source
+		self.__segments = segments
+		self.__starts = []
+		self.__size = 0
+		for segment_offset, segment_size in segments:
+			self.__starts.append(self.__size)
+			self.__size += segment_size
+		self.__position = 0
+
+	def size(self):
+		return self.__size
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.__position
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self.__position
+		elif whence == os.SEEK_END:
+			offset += self.__size
+		if offset < 0:
+			raise ValueError('Negative seek position %i' % offset)
+		self.__position = offset
+		return self.__position
+
+	def readinto(self, b):
+		if self.__position >= self.__size:
+			return 0
+
+		segment_index = bisect.bisect_right(self.__starts, self.__position) - 1
+		segment_offset, segment_size = self.__segments[segment_index]
+		inside_offset = self.__position - self.__starts[segment_index]
+
+		piece_size = min(len(b), segment_size - inside_offset)
+		self.__source.seek(segment_offset + inside_offset)
+		bytes_read = self.__source.readinto(memoryview(b)[:piece_size])
+		if bytes_read == 0:
+			raise RuntimeError('Archive is truncated')
+		self.__position += bytes_read
+		return bytes_read
+
+	def close(self):
+		self.__source.close()
+		io.RawIOBase.close(self)
+
+
+class WArchiverFrameReader(io.RawIOBase):
+	""" Reads uncompressed data of a seekable compressed inside file (which data was compressed as independent
+	frames). Only the frames that contain requested data are read and decompressed. Encrypted data is decrypted
+	from the frame beginning, since CBC and CTR modes allow decryption that starts at any cipher block
+	"""
+
+	@verify_type(frame_index=WArchiverFrameIndex, compression_mode=WBackupMeta.Archive.CompressionMode)
+	@verify_type(cipher=(WAES, None))
+	def __init__(self, source, frame_index, compression_mode, cipher=None):
+		""" Create new reader
+
+		:param source: seekable file object with data of the inside file
+		:param frame_index: frame index of the inside file
+		:param compression_mode: compression of frames
+		:param cipher: cipher that the compressed data was encrypted with
+		"""
+		io.RawIOBase.__init__(self)
+		self.__source = source
+		self.__frame_index = frame_index
+		self.__decompress_fn = WArchiverCompression.block_decompress_function(compression_mode)
+		self.__cipher = cipher
+		self.__position = 0
+		self.__frame_number = None
+		self.__frame_data = None
+
+	def size(self):
+		return self.__frame_index.uncompressed_size()
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.__position
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self.__position
+		elif whence == os.SEEK_END:
+			offset += self.size()
+		if offset < 0:
+			raise ValueError('Negative seek position %i' % offset)
+		self.__position = offset
+		return self.__position
+
+	def readinto(self, b):
+		if self.__position >= self.size():
+			return 0
+
+		frame_number, uncompressed_offset, compressed_offset, compressed_size = \
+			self.__frame_index.frame(self.__position)
+		if frame_number != self.__frame_number:
+			self.__frame_data = self.__read_frame(compressed_offset, compressed_size)
+			self.__frame_number = frame_number
+
+		inside_offset = self.__position - uncompressed_offset
+		piece_size = min(len(b), len(self.__frame_data) - inside_offset)
+		if piece_size <= 0:
+			raise RuntimeError('Archive is corrupted - frame is shorter than it is expected')
+		b[:piece_size] = self.__frame_data[inside_offset:inside_offset + piece_size]
+		self.__position += piece_size
+		return piece_size
+
+	def __read_frame(self, offset, size):
+		if self.__cipher is None:
+			return self.__decompress_fn(self.__read(offset, size))
+
+		block_size = WAESMode.__data_padding_length__
+		aligned_offset = offset - (offset % block_size)
+		previous_block = None
+		if aligned_offset > 0:
+			previous_block = self.__read(aligned_offset - block_size, block_size)
+		cipher = self.positioned_cipher(self.__cipher, aligned_offset // block_size, previous_block)
+
+		data = self.__read(aligned_offset, self.block_size(offset + size - aligned_offset))
+		data = cipher.cipher().decrypt(data)
+		return self.__decompress_fn(data[offset - aligned_offset:offset - aligned_offset + size])
+
+	def __read(self, offset, size):
+		self.__source.seek(offset)
+		result = self.__source.read(size)[:size]
+		if len(result) != size:
+			raise RuntimeError('Archive is truncated')
+		return result
+
+	@classmethod
+	def block_size(cls, size):
+		block_size = WAESMode.__data_padding_length__
+		return ((size + block_size - 1) // block_size) * block_size
+
+	@classmethod
+	@verify_type(cipher=WAES, block_index=int, previous_block=(bytes, None))
+	def positioned_cipher(cls, cipher, block_index, previous_block=None):
+		""" Return cipher that decrypts data from the given cipher block
+
+		:param cipher: cipher that the data was encrypted with
+		:param block_index: index of the first cipher block to decrypt
+		:param previous_block: encrypted block that precedes the first one (it is required for CBC mode)
+		:return: WAES
+		"""
+		mode = cipher.mode()
+		key_size = mode.key_size()
+		secret = mode.pyaes_args()[0]
+		counter = mode.initialization_counter_value()
+		if counter is not None:
+			counter = (counter + block_index) % (1 << (WAESMode.__counter_size__ * 8))
+			init_sequence = secret + counter.to_bytes(WAESMode.__counter_size__, byteorder='big')
+		elif block_index > 0:
+			if previous_block is None:
+				raise ValueError('Previous cipher block is required')
+			init_sequence = secret + previous_block
+		else:
+			init_sequence = secret + mode.initialization_vector()
+		return WAES(WAESMode(key_size, mode.mode(), init_sequence, padding=mode.padding()))
+
+	def close(self):
+		self.__source.close()
+		io.RawIOBase.close(self)
+
+
+class WArchiverRepositoryWriter(io.RawIOBase, WArchiverIOStatusProvider):
+	""" Target file object that splits written data into content-defined chunks and stores them in a
+	deduplicating repository (see :class:`wasp_backup.repository.WArchiverRepository`). Chunks are hashed,
+	compressed and encrypted by a pool of threads, chunks that are already in the repository are not stored again.
+	The manifest (list of chunk references) is written on close
+	"""
+
+	__minimum_split_size__ = 16 * 1024 * 1024
+
+	@verify_type(manifest_path=str, workers=(int, None))
+	@verify_value(manifest_path=lambda x: len(x) > 0, workers=lambda x: x is None or x > 0)
+	def __init__(self, repository, manifest_path, workers=None):
+		io.RawIOBase.__init__(self)
+		WArchiverIOStatusProvider.__init__(self)
+		self.__repository = repository
+		self.__manifest_path = manifest_path
+		self.__workers = workers if workers is not None else os.cpu_count()
+		self.__executor = ThreadPoolExecutor(max_workers=self.__workers)
+		self.__split_size = max(self.__minimum_split_size__, repository.maximum_chunk_size() * 4)
+		self.__buffer = bytearray()
+		self.__pending = deque()
+		self.__chunks = []
+		self.__size = 0
+		self.__stored_size = 0
+
+	def repository(self):
+		return self.__repository
+
+	def manifest_path(self):
+		return self.__manifest_path
+
+	def writable(self):
+		return True
+
+	def write(self, b):
+		self.__buffer += b
+		if len(self.__buffer) >= self.__split_size:
+			self.__split(final=False)
+		return len(b)
+
+	def close(self):
+		if self.closed is True:
+			return
+		try:
+			self.__split(final=True)
+			self.__wait_chunks(0)
+			self.__repository.write_manifest(self.__manifest_path, self.__chunks)
+		finally:
+			self.__executor.shutdown()
+			io.RawIOBase.close(self)
+
+	def abort(self):
+		""" Stop chunks processing. The manifest is not written, but chunks that were stored already are kept
+		(they may be reused by the following backups)
+		"""
+		if self.closed is False:
+			self.__buffer = bytearray()
+			for chunk in self.__pending:
+				chunk.cancel()
+			self.__pending.clear()
+			self.__executor.shutdown()
+			io.RawIOBase.close(self)
+
+	def status(self):
+		result = 'Repository chunks: %i\n' % len(self.__chunks)
+		result += 'Bytes stored: %i' % self.__stored_size
+		return result
+
+	def __split(self, final):
+		chunks_size = 0
+		chunk_boundaries = self.__repository.chunk_boundaries(self.__buffer, final=final)
+		with memoryview(self.__buffer) as buffer_view:  # the view must be released before buffer is resized
+			for chunk_offset, chunk_size in chunk_boundaries:
+				chunk = bytes(buffer_view[chunk_offset:chunk_offset + chunk_size])
+				self.__pending.append(self.__executor.submit(self.__repository.store_chunk, chunk))
+				self.__wait_chunks(self.__workers * 2)
+				chunks_size = chunk_offset + chunk_size
+		del self.__buffer[:chunks_size]
+
+	def __wait_chunks(self, pending_limit):
+		while len(self.__pending) > pending_limit:
+			digest, chunk_size, stored_size = self.__pending.popleft().result()
+			self.__chunks.append([digest, chunk_size])
+			self.__size += chunk_size
+			self.__stored_size += stored_size
+
+
+class WArchiverRepositoryReader(io.RawIOBase):
+	""" Reads archive that is stored in a deduplicating repository as a single file
+	"""
+
+	@verify_type(chunks=list)
+	def __init__(self, repository, chunks):
+		""" Create new reader
+
+		:param repository: repository with chunks
+		:param chunks: list of pairs - chunk digest and chunk size
+		"""
+		io.RawIOBase.__init__(self)
+		self.__repository = repository
+		self.__chunks = chunks
+		self.__starts = []
+		self.__size = 0
+		for chunk_digest, chunk_size in chunks:
+			self.__starts.append(self.__size)
+			self.__size += chunk_size
+		self.__position = 0
+		self.__chunk_index = None
+		self.__chunk_data = None
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.__position
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self.__position
+		elif whence == os.SEEK_END:
+			offset += self.__size
+		if offset < 0:
+			raise ValueError('Negative seek position %i' % offset)
+		self.__position = offset
+		return self.__position
+
+	def readinto(self, b):
+		if self.__position >= self.__size:
+			return 0
+
+		chunk_index = bisect.bisect_right(self.__starts, self.__position) - 1
+		if chunk_index != self.__chunk_index:
+			chunk_digest, chunk_size = self.__chunks[chunk_index]
+			self.__chunk_data = self.__repository.load_chunk(chunk_digest, chunk_size)
+			self.__chunk_index = chunk_index
+
+		chunk_offset = self.__position - self.__starts[chunk_index]
+		piece_size = min(len(b), len(self.__chunk_data) - chunk_offset)
+		b[:piece_size] = self.__chunk_data[chunk_offset:chunk_offset + piece_size]
+		self.__position += piece_size
+		return piece_size
+
+
 class WArchiverWriterChain(WWriterChain, WArchiverStatus):
 
 	@verify_type('paranoid', links=WWriterChainLink)
@@ -349,6 +2569,11 @@ class WArchiverWriterChain(WWriterChain, WArchiverStatus):
 		WWriterChain.__init__(self, last_io_obj, *links)
 		WArchiverStatus.__init__(self)
 
+	def abort(self):
+		for link in self:
+			if isinstance(link, (WArchiverPipelineWriter, WArchiverTeeWriter, WArchiverRepositoryWriter)) is True:
+				link.abort()
+
 
 class WExtractorReaderChain(WReaderChain, WArchiverStatus):
 
@@ -367,6 +2592,10 @@ class WBasicArchiverIO:
 		self.__logger = logger
 		self.__stop_event = stop_event
 		self.__io_rate = io_rate
+		self.__io_burst = None
+		self.__io_schedule = None
+		self.__io_pressure_target = None
+		self.__io_shared_state = None
 
 	def archive_path(self):
 		return self.__archive_path
@@ -377,6 +2606,46 @@ class WBasicArchiverIO:
 	def io_rate(self):
 		return self.__io_rate
 
+	def io_burst(self):
+		return self.__io_burst
+
+	def io_schedule(self):
+		return self.__io_schedule
+
+	def io_pressure_target(self):
+		return self.__io_pressure_target
+
+	@verify_type(burst=(int, float, None), schedule=(WArchiverRateSchedule, None))
+	@verify_type(pressure_target=(int, float, None))
+	@verify_value(burst=lambda x: x is None or x > 0)
+	@verify_value(pressure_target=lambda x: x is None or 0 < x < 100)
+	def set_io_throttling(self, burst=None, schedule=None, pressure_target=None, shared_state=None):
+		""" Set up the token bucket of I/O rate limit (the rate of this object is the limit outside of schedule
+		windows)
+
+		:param burst: number of bytes that may be processed at once without waiting
+		:param schedule: rate limits by time of day
+		:param pressure_target: stall percentage of I/O and CPU pressure that the adaptive limit holds
+		:param shared_state: bucket state that is shared with other processes (see
+		:meth:`.WArchiverTokenBucket.shared_state`)
+		:return: None
+		"""
+		self.__io_burst = burst
+		self.__io_schedule = schedule
+		self.__io_pressure_target = pressure_target
+		self.__io_shared_state = shared_state
+
+	def io_throttling(self):
+		""" Return a new token bucket for I/O of this object or None if I/O is not limited
+		"""
+		if self.__io_rate is None and self.__io_schedule is None and self.__io_pressure_target is None:
+			return None
+		return WArchiverTokenBucket(
+			rate=self.__io_rate, burst=self.__io_burst, schedule=self.__io_schedule,
+			pressure_target=self.__io_pressure_target, shared_state=self.__io_shared_state,
+			stop_event=self.__stop_event
+		)
+
 	def stop_event(self, value=None):
 		if value is not None:
 			self.__stop_event = value
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/io_priority.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import os
+import errno
+import ctypes
+import platform
+from enum import Enum
+
+from wasp_general.verify import verify_type, verify_value
+
+
+class WArchiverIOPriority:
+	""" Linux I/O priority (see ioprio_set(2)). Priority is set for the calling thread, threads and processes that
+	are started by the thread later inherit it, so the priority is set before archiving starts. Priorities are
+	respected by I/O schedulers that support them (like BFQ) only
+	"""
+
+	class IOClass(Enum):
+		best_effort = 'best-effort'  # I/O is served in turn with other best-effort I/O (by level)
+		idle = 'idle'  # I/O is served only when nobody else needs the disk
+
+	__class_values__ = {
+		IOClass.best_effort: 2,
+		IOClass.idle: 3
+	}
+	__class_shift__ = 13
+	__who_process__ = 1  # IOPRIO_WHO_PROCESS (with zero id it is the calling thread)
+	__maximum_level__ = 7
+	__default_level__ = 4
+
+	__syscall_numbers__ = {  # (ioprio_set, ioprio_get) by machine
+		'x86_64': (251, 252),
+		'i386': (289, 290),
+		'i686': (289, 290),
+		'aarch64': (30, 31),
+		'riscv64': (30, 31),
+		'armv6l': (314, 315),
+		'armv7l': (314, 315),
+		'ppc64': (273, 274),
+		'ppc64le': (273, 274),
+		's390x': (282, 283)
+	}
+
+	__libc = None
+
+	@verify_type(io_class=IOClass, level=(int, None))
+	@verify_value(level=lambda x: x is None or 0 <= x <= WArchiverIOPriority.__maximum_level__)
+	def __init__(self, io_class, level=None):
+		""" Create new priority
+
+		:param io_class: scheduling class
+		:param level: priority level of the best-effort class (from 0 that is the highest priority to 7)
+		"""
+		if io_class == WArchiverIOPriority.IOClass.idle:
+			if level is not None:
+				raise ValueError('Level can be set for the best-effort class only')
+			level = 0
+		elif level is None:
+			level = self.__default_level__
+		self.__io_class = io_class
+		self.__level = level
+
+	def io_class(self):
+		return self.__io_class
+
+	def level(self):
+		return self.__level
+
+	def value(self):
+		""" Return the priority as it is passed to the kernel
+		"""
+		return (self.__class_values__[self.__io_class] << self.__class_shift__) | self.__level
+
+	def apply(self):
+		""" Set this priority for the calling thread
+
+		:return: the previous priority value (it may be restored with :meth:`.WArchiverIOPriority.restore`)
+		"""
+		previous_value = self.__syscall(1)
+		self.__syscall(0, self.value())
+		return previous_value
+
+	@classmethod
+	@verify_type(value=int)
+	def restore(cls, value):
+		""" Set the priority that was returned by :meth:`.WArchiverIOPriority.apply` for the calling thread
+		"""
+		cls.__syscall(0, value)
+
+	@classmethod
+	def available(cls):
+		try:
+			cls.__syscall(1)
+			return True
+		except OSError:
+			return False
+
+	@classmethod
+	@verify_type(value=str)
+	def parse(cls, value):
+		""" Parse a priority like "idle", "best-effort" or "best-effort:7" (the level follows the colon)
+
+		:return: WArchiverIOPriority
+		"""
+		io_class, separator, level = value.partition(':')
+		try:
+			io_class = WArchiverIOPriority.IOClass(io_class.strip().lower())
+		except ValueError:
+			raise ValueError('Invalid I/O priority class: "%s"' % io_class)
+		if separator == '':
+			return WArchiverIOPriority(io_class)
+		if level.strip().isdigit() is False or int(level) > cls.__maximum_level__:
+			raise ValueError('Invalid I/O priority level: "%s"' % level)
+		return WArchiverIOPriority(io_class, level=int(level))
+
+	@classmethod
+	def __syscall(cls, syscall_index, *args):
+		syscall_numbers = cls.__syscall_numbers__.get(platform.machine())
+		if syscall_numbers is None or hasattr(os, 'uname') is False or os.uname().sysname != 'Linux':
+			raise OSError(errno.ENOSYS, 'I/O priorities are not supported on this platform')
+
+		if cls.__libc is None:
+			cls.__libc = ctypes.CDLL(None, use_errno=True)
+		result = cls.__libc.syscall(
+			syscall_numbers[syscall_index], ctypes.c_int(cls.__who_process__), ctypes.c_int(0),
+			*[ctypes.c_int(x) for x in args]
+		)
+		if result < 0:
+			error_code = ctypes.get_errno()
+			raise OSError(error_code, 'Unable to access I/O priority: %s' % os.strerror(error_code))
+		return result
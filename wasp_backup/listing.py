@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/listing.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import stat
+import fnmatch
+import tarfile
+from datetime import datetime
+
+from wasp_general.command.enhanced import WCommandArgumentDescriptor
+from wasp_general.command.result import WPlainCommandResult
+
+from wasp_backup.command_common import WBackupCommand
+from wasp_backup.archiver import WBasicArchiveExtractor
+
+
+class WListBackupCommand(WBackupCommand):
+
+	__command__ = 'list'
+	__description__ = 'list files of a file backup archive (archive member index is used, so archived data is not read)'
+
+	__type_chars__ = {
+		tarfile.DIRTYPE: 'd',
+		tarfile.SYMTYPE: 'l',
+		tarfile.LNKTYPE: 'h',
+		tarfile.CHRTYPE: 'c',
+		tarfile.BLKTYPE: 'b',
+		tarfile.FIFOTYPE: 'p'
+	}
+
+	__arguments__ = [
+		WCommandArgumentDescriptor(
+			'backup-archive', required=True, multiple_values=False, meta_var='archive_path',
+			help_info='backup file to list'
+		),
+		WCommandArgumentDescriptor(
+			'pattern', meta_var='shell_pattern',
+			help_info='list files which names match this pattern only (like "etc/*.conf")'
+		),
+		WCommandArgumentDescriptor(
+			'long-format', flag_mode=True,
+			help_info='if specified, then permissions, sizes and modification times are listed too'
+		),
+		WCommandArgumentDescriptor(
+			'password', meta_var='encryption_password',
+			help_info='password of an encrypted archive (or of an encrypted repository)'
+		)
+	]
+
+	def _exec(self, command_arguments, **command_env):
+		archive = command_arguments['backup-archive']
+
+		pattern = None
+		if 'pattern' in command_arguments.keys():
+			pattern = command_arguments['pattern']
+
+		long_format = False
+		if 'long-format' in command_arguments.keys():
+			long_format = command_arguments['long-format']
+
+		password = None
+		if 'password' in command_arguments.keys():
+			password = command_arguments['password']
+
+		extractor = WBasicArchiveExtractor(archive, self.logger(), stop_event=self.stop_event(), password=password)
+		member_index = extractor.member_index()
+		if member_index is None:
+			return WPlainCommandResult.error(
+				'Archive "%s" does not have a member index (it is not a file backup or it was created by a '
+				'previous version)' % archive
+			)
+
+		result = []
+		for entry in member_index.entries():
+			if pattern is not None and fnmatch.fnmatchcase(entry.name, pattern) is False:
+				continue
+			if long_format is True:
+				result.append(self.long_format(entry))
+			else:
+				result.append(entry.name)
+		return WPlainCommandResult('\n'.join(result))
+
+	@classmethod
+	def long_format(cls, entry):
+		mode = cls.__type_chars__.get(entry.type, '-') + stat.filemode(entry.mode)[1:]
+		mtime = datetime.fromtimestamp(entry.mtime).strftime('%Y-%m-%d %H:%M:%S')
+		return '%s %12i %s %s' % (mode, entry.size, mtime, entry.name)
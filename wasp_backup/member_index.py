@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/member_index.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import struct
+import tarfile
+import zlib
+
+from wasp_general.verify import verify_type
+from wasp_general.crypto.aes import WAES
+
+
+class WArchiverMemberIndex:
+	""" Table of contents of an inside tar archive. For every member it keeps name, size, modification time, mode,
+	type and offsets of the member header and data in the uncompressed inside tar, so archive content may be listed
+	without reading the inside tar and a single member may be found without scanning it.
+
+	Index is stored as a zlib-compressed sequence of fixed-size records (every record is followed by the member
+	name and by the member digest). It is encrypted with the auxiliary cipher of an encrypted archive. Digests of
+	regular files are saved when the digest cache is used (files are hashed with the "hash_algorithm" algorithm)
+	"""
+
+	__index_magic__ = b'WBKPIDX'
+	__index_version__ = 1
+	__header__ = struct.Struct('>7sBQ')  # magic, version and entries count
+	__entry__ = struct.Struct('>QQQqHcH')  # header offset, data offset, size, mtime, mode, type and name length
+	__digest_header__ = struct.Struct('>B')  # digest length (zero if there is no digest)
+	__name_encoding__ = 'utf-8'
+	__name_errors__ = 'surrogateescape'
+
+	class Entry:
+
+		def __init__(self, name, offset, data_offset, size, mtime, mode, member_type, digest=None):
+			self.name = name
+			self.offset = offset
+			self.data_offset = data_offset
+			self.size = size
+			self.mtime = mtime
+			self.mode = mode
+			self.type = member_type
+			self.digest = digest  # hex digest of a regular file or None
+
+		def isdir(self):
+			return self.type == tarfile.DIRTYPE
+
+		def isreg(self):
+			return self.type in tarfile.REGULAR_TYPES
+
+	def __init__(self):
+		self.__entries = []
+		self.__names = None
+
+	def entries(self):
+		return self.__entries
+
+	def __len__(self):
+		return len(self.__entries)
+
+	@verify_type(tar_info=tarfile.TarInfo, offset=int, data_offset=int)
+	def add(self, tar_info, offset, data_offset):
+		""" Add member to the index
+
+		:param tar_info: member description
+		:param offset: offset of the member header in the inside tar
+		:param data_offset: offset of the member data in the inside tar
+		:return: None
+		"""
+		self.__entries.append(WArchiverMemberIndex.Entry(
+			tar_info.name, offset, data_offset, tar_info.size, int(tar_info.mtime), tar_info.mode & 0o7777,
+			tar_info.type
+		))
+		self.__names = None
+
+	@verify_type(name=str)
+	def find(self, name):
+		""" Return the last entry with the given name (like "tarfile.TarFile.getmember" does) or None
+		"""
+		if self.__names is None:
+			self.__names = {x.name: x for x in self.__entries}
+		return self.__names.get(name.rstrip('/'))
+
+	@verify_type(digests=dict)
+	def set_digests(self, digests):
+		""" Set digests of regular files
+
+		:param digests: hex digests, archive names are keys
+		:return: None
+		"""
+		for entry in self.__entries:
+			if entry.isreg() is True and entry.name in digests:
+				entry.digest = digests[entry.name]
+
+	@verify_type(cipher=(WAES, None))
+	def encode(self, cipher=None):
+		""" Return index data
+
+		:param cipher: cipher to encrypt index with
+		:return: bytes
+		"""
+		compressor = zlib.compressobj()
+		result = [compressor.compress(
+			self.__header__.pack(self.__index_magic__, self.__index_version__, len(self.__entries))
+		)]
+		for entry in self.__entries:
+			name = entry.name.encode(self.__name_encoding__, self.__name_errors__)
+			digest = bytes.fromhex(entry.digest) if entry.digest is not None else b''
+			result.append(compressor.compress(self.__entry__.pack(
+				entry.offset, entry.data_offset, entry.size, entry.mtime, entry.mode, entry.type, len(name)
+			) + name + self.__digest_header__.pack(len(digest)) + digest))
+		result.append(compressor.flush())
+		result = b''.join(result)
+
+		if cipher is not None:
+			result = cipher.encrypt(result)
+		return result
+
+	@classmethod
+	@verify_type(data=bytes, cipher=(WAES, None))
+	def decode(cls, data, cipher=None):
+		""" Restore index from the data that was created by the :meth:`.WArchiverMemberIndex.encode` method
+
+		:param data: index data
+		:param cipher: cipher to decrypt index with
+		:return: WArchiverMemberIndex
+		"""
+		if cipher is not None:
+			# data is padded with zeros, they are left by the decompressor as unused data
+			data = cipher.cipher().decrypt(data)
+
+		decompressor = zlib.decompressobj()
+		try:
+			data = decompressor.decompress(data)
+		except zlib.error:
+			data = None
+		if data is None or decompressor.eof is False:
+			raise RuntimeError('Member index is corrupted (or the password is wrong)')
+
+		try:
+			magic, version, entries_count = cls.__header__.unpack_from(data)
+			if magic != cls.__index_magic__:
+				raise RuntimeError('Member index is corrupted')
+			if version != cls.__index_version__:
+				raise RuntimeError('Unsupported member index version: "%i"' % version)
+
+			result = WArchiverMemberIndex()
+			position = cls.__header__.size
+			for i in range(entries_count):
+				offset, data_offset, size, mtime, mode, member_type, name_length = \
+					cls.__entry__.unpack_from(data, position)
+				position += cls.__entry__.size
+				name = data[position:position + name_length].decode(cls.__name_encoding__, cls.__name_errors__)
+				position += name_length
+				digest_length = cls.__digest_header__.unpack_from(data, position)[0]
+				position += cls.__digest_header__.size
+				digest = None
+				if digest_length > 0:
+					digest = data[position:position + digest_length].hex().upper()
+					position += digest_length
+				result.__entries.append(WArchiverMemberIndex.Entry(
+					name, offset, data_offset, size, mtime, mode, member_type, digest=digest
+				))
+		except struct.error:
+			raise RuntimeError('Member index is corrupted')
+		return result
+
+
+class WArchiverIndexedTarFile(tarfile.TarFile):
+	""" Tar archive (for writing) that builds the member index of the added members. Offsets are counted from the
+	archive beginning (the position at which archive was opened)
+	"""
+
+	def __init__(self, *args, **kwargs):
+		tarfile.TarFile.__init__(self, *args, **kwargs)
+		self.__start_offset = self.offset
+		self.__member_index = WArchiverMemberIndex()
+
+	def member_index(self):
+		return self.__member_index
+
+	def addfile(self, tarinfo, fileobj=None):
+		offset = self.offset
+		tarfile.TarFile.addfile(self, tarinfo, fileobj)
+		data_offset = self.offset
+		if fileobj is not None:
+			data_offset -= tarfile.BLOCKSIZE * ((tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+		self.__member_index.add(tarinfo, offset - self.__start_offset, data_offset - self.__start_offset)
@@ -27,26 +27,385 @@ from wasp_backup.archiver import WBasicArchiveCreator
 # noinspection PyUnresolvedReferences
 from wasp_backup.version import __status__
 
+import os
+import time
 import shlex
+import fcntl
+import struct
+import tarfile
+import termios
+import tempfile
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from wasp_general.verify import verify_type, verify_value
+from wasp_general.io import WResponsiveIO
+
+from wasp_backup.archiver import WBasicInsideTarArchiveCreator
 from wasp_backup.file_archiver import WFileArchiveCreator
 from wasp_backup.core import WBackupMeta
+from wasp_backup.cipher import WBackupCipher
+from wasp_backup.io import WArchiverHash, WArchiverCompression
 
 
 class WPopenArchiveCreator(WFileArchiveCreator):
+	""" Archives output of a program. If "pipe_size" is specified, then the output is ingested in the
+	high-throughput mode - the pipe buffer is enlarged (with F_SETPIPE_SZ), data is read from the pipe directly
+	(without the intermediate buffer of a file object) into a reused buffer and the time that the program and the
+	archiver wait for each other is measured. The program is considered stalled when the pipe is full after the
+	archiver has processed the previous data
+	"""
+
+	__pipe_max_size_path__ = '/proc/sys/fs/pipe-max-size'
+	__set_pipe_size_cmd__ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)  # constants are defined since python 3.10
+	__get_pipe_size_cmd__ = getattr(fcntl, 'F_GETPIPE_SZ', 1032)
+
+	@verify_type('paranoid', archive_path=str, io_write_rate=(float, int, None))
+	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_write_rate=lambda x: x is None or x > 0)
+	@verify_type('paranoid', cipher=(WBackupCipher, None))
+	@verify_type('paranoid', compression_mode=(WBackupMeta.Archive.CompressionMode, None))
+	@verify_type('paranoid', compression_workers=(int, None), compression_level=(int, None))
+	@verify_type('paranoid', archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_value('paranoid', compression_workers=lambda x: x is None or x > 0)
+	@verify_value('paranoid', pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', hash_algorithm=(str, None), hash_chunk_size=(int, None))
+	@verify_value('paranoid', hash_chunk_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', volume_size=(int, None))
+	@verify_value('paranoid', volume_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', stream_part_size=(int, None), compression_frame_size=(int, None))
+	@verify_value('paranoid', stream_part_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', compression_frame_size=lambda x: x is None or x > 0)
+	@verify_type(backup_source=str, pipe_size=(int, None))
+	@verify_value(pipe_size=lambda x: x is None or x > 0)
+	def __init__(
+		self, backup_source, archive_path, logger, stop_event=None, io_write_rate=None, compression_mode=None,
+		cipher=None, buffer_size=None, compression_workers=None, compression_level=None,
+		archive_layout=None, pipeline_queue_size=None, hash_algorithm=None,
+		hash_chunk_size=None, volume_size=None, stream_part_size=None, compression_frame_size=None, pipe_size=None
+	):
+		WFileArchiveCreator.__init__(
+			self, backup_source, archive_path, logger, stop_event=stop_event, io_write_rate=io_write_rate,
+			compression_mode=compression_mode, cipher=cipher, buffer_size=buffer_size,
+			compression_workers=compression_workers, compression_level=compression_level,
+			archive_layout=archive_layout, pipeline_queue_size=pipeline_queue_size, hash_algorithm=hash_algorithm,
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size,
+			compression_frame_size=compression_frame_size
+		)
+		self.__pipe_size = pipe_size
+		self.__program_stall_time = None
+		self.__archiver_stall_time = None
+
+	def pipe_size(self):
+		return self.__pipe_size
+
+	def program_stall_time(self):
+		return self.__program_stall_time
+
+	def archiver_stall_time(self):
+		return self.__archiver_stall_time
 
 	def write_archive(self, fo, archive):
-		with subprocess.Popen(shlex.split(self.backup_source()), stdout=subprocess.PIPE) as pipe:
-			buffer_size = self.buffer_size()
-			read_buffer = pipe.stdout.read(buffer_size)
-			while len(read_buffer) > 0:
-				fo.write(read_buffer)
-				read_buffer = pipe.stdout.read(buffer_size)
+		if self.pipe_size() is None:
+			with subprocess.Popen(shlex.split(self.backup_source()), stdout=subprocess.PIPE) as pipe:
+				self.copy_data(pipe.stdout, fo, self.buffer_size())
+			return
+
+		with subprocess.Popen(shlex.split(self.backup_source()), stdout=subprocess.PIPE, bufsize=0) as pipe:
+			pipe_fd = pipe.stdout.fileno()
+			pipe_size = self.set_pipe_size(pipe_fd, self.pipe_size())
+			if pipe_size is None or pipe_size < self.pipe_size():
+				self.logger().warning(
+					'Unable to enlarge the pipe buffer to %i bytes (the buffer size is %s)' %
+					(self.pipe_size(), str(pipe_size) if pipe_size is not None else 'unknown')
+				)
+			self.__copy_pipe_data(pipe.stdout, pipe_fd, pipe_size, fo)
+
+		self.logger().info(
+			'Program output is ingested. Program stall time: %.1f sec, archiver stall time: %.1f sec' %
+			(self.__program_stall_time, self.__archiver_stall_time)
+		)
+
+	def __copy_pipe_data(self, source, pipe_fd, pipe_size, target):
+		read_buffer = bytearray(self.buffer_size())
+		read_view = memoryview(read_buffer)
+		self.__program_stall_time = 0.0
+		self.__archiver_stall_time = 0.0
+
+		read_started_at = time.monotonic()
+		bytes_read = source.readinto(read_buffer)
+		while bytes_read:
+			write_started_at = time.monotonic()
+			self.__archiver_stall_time += write_started_at - read_started_at
+			target.write(read_view[:bytes_read])
+			read_started_at = time.monotonic()
+
+			# if the pipe is full, then the program has been blocked for a part of the processing time. Since
+			# this part is unknown, the whole time is counted
+			if pipe_size is not None and self.pipe_data_size(pipe_fd) >= pipe_size:
+				self.__program_stall_time += read_started_at - write_started_at
+			bytes_read = source.readinto(read_buffer)
+
+	def archiving_details(self):
+		result = WFileArchiveCreator.archiving_details(self)
+		if self.__program_stall_time is not None:
+			stall_details = 'Program stall time: %.1f sec\nArchiver stall time: %.1f sec' % (
+				self.__program_stall_time, self.__archiver_stall_time
+			)
+			result = stall_details if result is None else (result + '\n' + stall_details)
+		return result
 
 	def meta(self):
 		result = WFileArchiveCreator.meta(self)
 		if WBackupMeta.Archive.MetaOptions.archived_files in result:
 			result.pop(WBackupMeta.Archive.MetaOptions.archived_files)
 		result[WBackupMeta.Archive.MetaOptions.archived_program] = self.backup_source()
+		if self.__program_stall_time is not None:
+			result[WBackupMeta.Archive.MetaOptions.program_stall_time] = round(self.__program_stall_time, 3)
+			result[WBackupMeta.Archive.MetaOptions.archiver_stall_time] = round(self.__archiver_stall_time, 3)
+		return result
+
+	@classmethod
+	@verify_type(pipe_fd=int, pipe_size=int)
+	@verify_value(pipe_size=lambda x: x > 0)
+	def set_pipe_size(cls, pipe_fd, pipe_size):
+		""" Change size of a pipe buffer (Linux only). Unprivileged processes may not exceed the system limit, so
+		the limit is used when the requested size is greater
+
+		:param pipe_fd: file descriptor of a pipe
+		:param pipe_size: requested size
+		:return: actual size of the pipe buffer or None if it is unknown
+		"""
+		try:
+			return fcntl.fcntl(pipe_fd, cls.__set_pipe_size_cmd__, pipe_size)
+		except PermissionError:
+			pipe_max_size = cls.pipe_max_size()
+			if pipe_max_size is not None and pipe_max_size < pipe_size:
+				try:
+					return fcntl.fcntl(pipe_fd, cls.__set_pipe_size_cmd__, pipe_max_size)
+				except OSError:
+					pass
+		except OSError:
+			pass
+
+		try:
+			return fcntl.fcntl(pipe_fd, cls.__get_pipe_size_cmd__)
+		except OSError:
+			return None
+
+	@classmethod
+	def pipe_max_size(cls):
+		try:
+			with open(cls.__pipe_max_size_path__) as f:
+				return int(f.read().strip())
+		except (OSError, ValueError):
+			return None
+
+	@classmethod
+	@verify_type(pipe_fd=int)
+	def pipe_data_size(cls, pipe_fd):
+		""" Return number of bytes that are available for reading from a pipe
+		"""
+		return struct.unpack('i', fcntl.ioctl(pipe_fd, termios.FIONREAD, struct.pack('i', 0)))[0]
+
+
+class WMultiplePopenArchiveCreator(WBasicInsideTarArchiveCreator):
+	""" Archives output of several programs that run concurrently. Output of every program is compressed by the
+	thread that reads it and is spooled to a temporary file, then it is added to the inside tar as a separate
+	member (members are added in order of program completion, so spooled data of a program is added while the
+	others are running). The inside tar is not compressed as a whole, it may be encrypted only. Program commands,
+	return codes, compression, sizes and hashes of members are saved to meta
+	"""
+
+	@verify_type(programs=(list, tuple))
+	@verify_value(programs=lambda x: len(x) > 0)
+	@verify_type('paranoid', archive_path=str, io_write_rate=(float, int, None))
+	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_write_rate=lambda x: x is None or x > 0)
+	@verify_type('paranoid', cipher=(WBackupCipher, None))
+	@verify_type(compression_mode=(WBackupMeta.Archive.CompressionMode, None), compression_level=(int, None))
+	@verify_type('paranoid', archive_layout=(WBackupMeta.Archive.Layout, None), pipeline_queue_size=(int, None))
+	@verify_value('paranoid', pipeline_queue_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', hash_algorithm=(str, None), hash_chunk_size=(int, None))
+	@verify_value('paranoid', hash_chunk_size=lambda x: x is None or x > 0)
+	@verify_type('paranoid', volume_size=(int, None), stream_part_size=(int, None))
+	@verify_value('paranoid', volume_size=lambda x: x is None or x > 0)
+	@verify_value('paranoid', stream_part_size=lambda x: x is None or x > 0)
+	@verify_type(buffer_size=(int, None), pipe_size=(int, None), spool_directory=(str, None))
+	@verify_value(buffer_size=lambda x: x is None or x > 0, pipe_size=lambda x: x is None or x > 0)
+	def __init__(
+		self, programs, archive_path, logger, stop_event=None, io_write_rate=None, compression_mode=None,
+		cipher=None, compression_level=None, archive_layout=None, pipeline_queue_size=None, hash_algorithm=None,
+		hash_chunk_size=None, volume_size=None, stream_part_size=None, buffer_size=None, pipe_size=None,
+		spool_directory=None
+	):
+		""" Create new archiver
+
+		:param programs: pairs of a member name and a program command
+		:param compression_mode: compression of members
+		:param compression_level: compression level of members
+		:param buffer_size: size of a single read of a program output
+		:param pipe_size: size of pipe buffers (see :meth:`.WPopenArchiveCreator.set_pipe_size`)
+		:param spool_directory: directory for temporary files (the system one by default)
+
+		(the rest parameters are the same as :class:`.WBasicArchiveCreator` has)
+		"""
+		WBasicInsideTarArchiveCreator.__init__(
+			self, archive_path, logger, cipher=cipher, stop_event=stop_event, io_write_rate=io_write_rate,
+			archive_layout=archive_layout, pipeline_queue_size=pipeline_queue_size, hash_algorithm=hash_algorithm,
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size
+		)
+
+		if compression_mode is not None:
+			WArchiverCompression.check_availability(compression_mode)
+			compression_level = WArchiverCompression.compression_level(compression_mode, compression_level)
+		elif compression_level is not None:
+			raise ValueError('Compression level can not be set for uncompressed archive')
+
+		self.__programs = []
+		for member_name, program in programs:
+			if len(member_name) == 0 or '/' in member_name:
+				raise ValueError('Invalid member name spotted: "%s"' % member_name)
+			if compression_mode is not None:
+				member_name += '.' + compression_mode.value
+			if member_name in (x[0] for x in self.__programs):
+				raise ValueError('Duplicate member name spotted: "%s"' % member_name)
+			self.__programs.append((member_name, program))
+
+		self.__member_compression_mode = compression_mode
+		self.__member_compression_level = compression_level
+		self.__buffer_size = buffer_size if buffer_size is not None else \
+			WFileArchiveCreator.__default_buffer_size__
+		self.__pipe_size = pipe_size
+		self.__spool_directory = spool_directory
+		self.__members = None
+		self.__processes = set()
+		self.__processes_lock = threading.Lock()
+		self.__abort_event = threading.Event()
+
+	def programs(self):
+		""" Return pairs of a member name and a program command
+		"""
+		return self.__programs.copy()
+
+	def member_compression_mode(self):
+		return self.__member_compression_mode
+
+	def member_compression_level(self):
+		return self.__member_compression_level
+
+	def buffer_size(self):
+		return self.__buffer_size
+
+	def pipe_size(self):
+		return self.__pipe_size
+
+	def spool_directory(self):
+		return self.__spool_directory
+
+	def inside_filename(self):
+		return WBackupMeta.Archive.__basic_inside_file_name__ + '.tar'
+
+	def archiving_details(self):
+		result = WBasicInsideTarArchiveCreator.archiving_details(self)
+		members = self.__members
+		if members is not None:
+			members_details = 'Members archived: %i of %i' % (len(members), len(self.__programs))
+			result = members_details if result is None else (result + '\n' + members_details)
+		return result
+
+	def _populate_archive(self, tar_archive):
+		self.__members = {}
+		self.__abort_event.clear()
+
+		with ThreadPoolExecutor(max_workers=len(self.__programs)) as executor:
+			futures = [executor.submit(self.__spool_output, x, y) for x, y in self.__programs]
+			try:
+				for future in as_completed(futures):
+					tar_info, spool, member_meta = future.result()
+					with spool:
+						tar_archive.addfile(tar_info, spool)
+					self.__members[tar_info.name] = member_meta
+			except BaseException:
+				# the rest programs are killed, so that threads are not blocked by them
+				self.__abort_event.set()
+				with self.__processes_lock:
+					for process in self.__processes:
+						process.kill()
+				raise
+
+	def __spool_output(self, member_name, program):
+		stop_event = self.stop_event()
+		hash_algorithm = self.hash_algorithm()
+		hash_obj = WArchiverHash.new(
+			hash_algorithm if hash_algorithm is not None else WBackupMeta.Archive.__hash_generator_name__
+		)
+		read_buffer = bytearray(self.buffer_size())
+		read_view = memoryview(read_buffer)
+		output_size = 0
+
+		spool = tempfile.TemporaryFile(dir=self.spool_directory())
+		try:
+			writer = spool
+			if self.__member_compression_mode is not None:
+				writer = WArchiverCompression.stream_writer(
+					self.__member_compression_mode, spool, compression_level=self.__member_compression_level
+				)
+
+			with subprocess.Popen(shlex.split(program), stdout=subprocess.PIPE, bufsize=0) as pipe:
+				with self.__processes_lock:
+					self.__processes.add(pipe)
+				try:
+					if self.pipe_size() is not None:
+						WPopenArchiveCreator.set_pipe_size(pipe.stdout.fileno(), self.pipe_size())
+
+					bytes_read = pipe.stdout.readinto(read_buffer)
+					while bytes_read:
+						if self.__abort_event.is_set() is True or \
+							(stop_event is not None and stop_event.is_set() is True):
+							pipe.kill()
+							raise WResponsiveIO.IOTerminated('Stop event was set')
+						hash_obj.update(read_view[:bytes_read])
+						writer.write(read_view[:bytes_read])
+						output_size += bytes_read
+						bytes_read = pipe.stdout.readinto(read_buffer)
+				finally:
+					with self.__processes_lock:
+						self.__processes.discard(pipe)
+
+			if writer is not spool:
+				writer.close()
+			if pipe.returncode != 0:
+				self.logger().warning('Program "%s" exited with code %i' % (program, pipe.returncode))
+
+			tar_info = tarfile.TarInfo(member_name)
+			tar_info.size = spool.tell()
+			tar_info.mtime = time.time()
+			tar_info.mode = WBackupMeta.Archive.__file_mode__
+			tar_info.uid = os.getuid()
+			tar_info.gid = os.getgid()
+			spool.seek(0)
+		except BaseException:
+			spool.close()
+			raise
+
+		compression_mode = self.__member_compression_mode
+		member_meta = {
+			WBackupMeta.Archive.ProgramMemberOptions.program.value: program,
+			WBackupMeta.Archive.ProgramMemberOptions.compression_mode.value:
+				compression_mode.value if compression_mode is not None else None,
+			WBackupMeta.Archive.ProgramMemberOptions.compression_level.value: self.__member_compression_level,
+			WBackupMeta.Archive.ProgramMemberOptions.return_code.value: pipe.returncode,
+			WBackupMeta.Archive.ProgramMemberOptions.size.value: output_size,
+			WBackupMeta.Archive.ProgramMemberOptions.stored_size.value: tar_info.size,
+			WBackupMeta.Archive.ProgramMemberOptions.hash_value.value: hash_obj.hexdigest().upper()
+		}
+		return tar_info, spool, member_meta
+
+	def meta(self):
+		result = WBasicInsideTarArchiveCreator.meta(self)
+		result.update({
+			WBackupMeta.Archive.MetaOptions.inside_tar: True,
+			WBackupMeta.Archive.MetaOptions.archived_program: [x[1] for x in self.__programs],
+			WBackupMeta.Archive.MetaOptions.program_members: self.__members
+		})
 		return result
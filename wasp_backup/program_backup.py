@@ -30,7 +30,7 @@ from wasp_backup.version import __status__
 from wasp_general.command.enhanced import WCommandArgumentDescriptor
 
 from wasp_backup.cipher import WBackupCipher
-from wasp_backup.popen_archiver import WPopenArchiveCreator
+from wasp_backup.popen_archiver import WPopenArchiveCreator, WMultiplePopenArchiveCreator
 from wasp_backup.command_common import __common_args__, WCreateBackupCommand
 
 
@@ -42,14 +42,55 @@ class WProgramBackupCommand(WCreateBackupCommand):
 	__arguments__ = (
 		__common_args__['backup-archive'],
 		WCommandArgumentDescriptor(
-			'input-program', required=True, multiple_values=False, meta_var='program_command',
-			help_info='program which output will be backed up'
+			'input-program', required=True, multiple_values=True, meta_var='program_command',
+			help_info='program which output will be backed up. May be specified multiple times, then programs run '
+			'concurrently and output of every program is compressed in parallel and is stored as a separate member '
+			'of the archive (the "compression-workers" and "compression-frame-size" options are not used in this '
+			'case)'
+		),
+		WCommandArgumentDescriptor(
+			'program-name', multiple_values=True, meta_var='member_name',
+			help_info='name of an archive member that stores output of a program (names are matched with the '
+			'"input-program" options in the same order). Output of every program is stored as a separate member '
+			'if this option is specified. Programs are named "program_1", "program_2" and so on by default'
+		),
+		WCommandArgumentDescriptor(
+			'spool-directory', meta_var='directory_path',
+			help_info='directory for temporary files with output of programs that is waiting to be archived (when '
+			'output of several programs is archived). The system temporary directory is used by default'
+		),
+		WCommandArgumentDescriptor(
+			'pipe-size', meta_var='pipe_buffer_size',
+			help_info='enables the high-throughput ingestion of the program output. The pipe buffer is enlarged to '
+			'this size (it is limited by "/proc/sys/fs/pipe-max-size" for unprivileged users), the output is read '
+			'with large reads and time that the program and the archiver wait for each other is reported (it is '
+			'saved to the archive meta also). You can use suffixes like "K" for kibibytes, "M" for mebibytes, '
+			'"G" for gibibytes, "T" for tebibytes for convenience',
+			casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
 		),
 		__common_args__['compression'],
+		__common_args__['compression-level'],
+		__common_args__['compression-workers'],
+		__common_args__['pipeline-buffers'],
 		__common_args__['password'],
 		__common_args__['cipher_algorithm'],
+		__common_args__['hash-algorithm'],
+		__common_args__['hash-chunk-size'],
 		__common_args__['io-write-rate'],
+		__common_args__['io-burst'],
+		__common_args__['io-schedule'],
+		__common_args__['io-pressure-target'],
+		__common_args__['source-read-rate'],
+		__common_args__['io-priority'],
+		__common_args__['volume-size'],
+		__common_args__['stream-part-size'],
+		__common_args__['compression-frame-size'],
+		__common_args__['repository'],
+		__common_args__['repository-chunk-size'],
 		__common_args__['copy-to'],
+		__common_args__['copy-workers'],
+		__common_args__['copy-stream'],
+		__common_args__['no-local-copy'],
 		__common_args__['copy-fail'],
 		__common_args__['notify-app']
 	)
@@ -59,21 +100,105 @@ class WProgramBackupCommand(WCreateBackupCommand):
 		if 'compression' in command_arguments.keys():
 			compression_mode = command_arguments['compression']
 
+		compression_level = None
+		if 'compression-level' in command_arguments.keys():
+			compression_level = command_arguments['compression-level']
+
+		compression_workers = None
+		if 'compression-workers' in command_arguments.keys():
+			compression_workers = command_arguments['compression-workers']
+
+		pipeline_queue_size = None
+		if 'pipeline-buffers' in command_arguments.keys():
+			pipeline_queue_size = command_arguments['pipeline-buffers']
+
+		repository = self._open_repository(
+			command_arguments, compression_mode=compression_mode, compression_level=compression_level
+		)
+		if repository is not None:
+			# chunks are compressed and encrypted by the repository
+			compression_mode = None
+			compression_level = None
+
 		cipher = None
-		if 'password' in command_arguments:
+		if 'password' in command_arguments and repository is None:
 			cipher = WBackupCipher(
 				command_arguments['cipher_algorithm'], command_arguments['password']
 			)
 
+		hash_chunk_size = None
+		if 'hash-chunk-size' in command_arguments.keys():
+			hash_chunk_size = int(command_arguments['hash-chunk-size'])
+
+		volume_size = None
+		if 'volume-size' in command_arguments.keys():
+			volume_size = int(command_arguments['volume-size'])
+
+		stream_part_size = None
+		if 'stream-part-size' in command_arguments.keys():
+			stream_part_size = int(command_arguments['stream-part-size'])
+
+		compression_frame_size = None
+		if 'compression-frame-size' in command_arguments.keys():
+			compression_frame_size = int(command_arguments['compression-frame-size'])
+
 		io_write_rate = None
 		if 'io-write-rate' in command_arguments.keys():
 			io_write_rate = command_arguments['io-write-rate']
 
+		pipe_size = None
+		if 'pipe-size' in command_arguments.keys():
+			pipe_size = int(command_arguments['pipe-size'])
+
 		backup_archive = command_arguments['backup-archive']
-		archiver = WPopenArchiveCreator(
-			command_arguments['input-program'], backup_archive, self.logger(),
-			compression_mode=compression_mode, cipher=cipher, io_write_rate=io_write_rate,
-			stop_event=self.stop_event()
-		)
+		programs = list(command_arguments['input-program'])
+		if len(programs) > 1 or 'program-name' in command_arguments.keys():
+			archiver = self.__multiple_programs_archiver(
+				command_arguments, programs, compression_mode=compression_mode, cipher=cipher,
+				io_write_rate=io_write_rate, compression_level=compression_level,
+				pipeline_queue_size=pipeline_queue_size, hash_chunk_size=hash_chunk_size, volume_size=volume_size,
+				stream_part_size=stream_part_size, compression_frame_size=compression_frame_size,
+				pipe_size=pipe_size
+			)
+		else:
+			archiver = WPopenArchiveCreator(
+				programs[0], backup_archive, self.logger(),
+				compression_mode=compression_mode, cipher=cipher, io_write_rate=io_write_rate,
+				stop_event=self.stop_event(), compression_workers=compression_workers,
+				compression_level=compression_level, pipeline_queue_size=pipeline_queue_size,
+				hash_algorithm=command_arguments['hash-algorithm'], hash_chunk_size=hash_chunk_size,
+				volume_size=volume_size, stream_part_size=stream_part_size,
+				compression_frame_size=compression_frame_size, pipe_size=pipe_size
+			)
+		if repository is not None:
+			archiver.set_repository(repository)
 		self.set_archiver(archiver)
 		return self._create_backup(command_arguments)
+
+	def __multiple_programs_archiver(
+		self, command_arguments, programs, compression_mode=None, cipher=None, io_write_rate=None,
+		compression_level=None, pipeline_queue_size=None, hash_chunk_size=None, volume_size=None,
+		stream_part_size=None, compression_frame_size=None, pipe_size=None
+	):
+		if compression_frame_size is not None:
+			raise ValueError('Seekable compression can not be used when output of several programs is archived')
+
+		if 'program-name' in command_arguments.keys():
+			names = list(command_arguments['program-name'])
+			if len(names) != len(programs):
+				raise ValueError('Number of program names must be equal to the number of programs')
+		else:
+			names = ['program_%i' % (x + 1) for x in range(len(programs))]
+
+		spool_directory = None
+		if 'spool-directory' in command_arguments.keys():
+			spool_directory = command_arguments['spool-directory']
+
+		return WMultiplePopenArchiveCreator(
+			list(zip(names, programs)), command_arguments['backup-archive'], self.logger(),
+			compression_mode=compression_mode, cipher=cipher, io_write_rate=io_write_rate,
+			stop_event=self.stop_event(), compression_level=compression_level,
+			pipeline_queue_size=pipeline_queue_size, hash_algorithm=command_arguments['hash-algorithm'],
+			hash_chunk_size=hash_chunk_size, volume_size=volume_size, stream_part_size=stream_part_size,
+			pipe_size=pipe_size, spool_directory=spool_directory
+		)
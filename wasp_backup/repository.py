@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/repository.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import io
+import os
+import json
+import hmac
+import struct
+import threading
+
+try:
+	import fastcdc
+except ImportError:
+	fastcdc = None
+
+from wasp_general.verify import verify_type, verify_value
+from wasp_general.crypto.aes import WAES, WAESMode, WZeroPadding
+
+from wasp_backup.core import WBackupMeta
+from wasp_backup.cipher import WBackupCipher
+from wasp_backup.io import WArchiverCompression, WArchiverHash, WArchiverRepositoryReader
+
+
+class WArchiverRepository:
+	""" Local directory that stores content-defined chunks (FastCDC) of archives. Every chunk is stored once, it is
+	addressed by its hash and is compressed and encrypted independently of others. An archive that is stored in
+	a repository is a small manifest with references to chunks, so archives of data that changes slightly
+	(program dumps, VM images) share most of their chunks. Chunking requires the "fastcdc" module.
+
+	Compression and encryption settings are selected when repository is created, encryption key is derived
+	with a salt that is saved in the repository configuration. Chunks of an encrypted repository are addressed by
+	HMAC of their data (not by a plain hash), so chunk names do not reveal data. Every chunk is encrypted with its
+	own random initialization vector (or initial counter value) that is saved in the chunk header. The HMAC key
+	is derived from the secret key with a distinct label (like HKDF does), so it is independent of the key stream
+	that chunks are encrypted with
+	"""
+
+	__repository_format__ = 'wasp-backup-repository'
+	__repository_version__ = 1
+	__manifest_format__ = 'wasp-backup-repository-archive'
+	__manifest_version__ = 1
+	__maximum_manifest_size__ = 64 * 1024 * 1024
+
+	__config_filename__ = 'config.json'
+	__chunks_dir__ = 'chunks'
+	__hash_algorithm__ = 'SHA256'
+	__default_chunk_size__ = 1024 * 1024
+	__chunk_nonce_size__ = 16
+	__chunk_header__ = struct.Struct('>Q%is' % __chunk_nonce_size__)  # payload size and chunk nonce
+	__chunk_key_label__ = b'wasp-backup-repository-chunk-key'
+
+	@verify_type(repository_path=str, config=dict, cipher=(WBackupCipher, None))
+	@verify_value(repository_path=lambda x: len(x) > 0)
+	def __init__(self, repository_path, config, cipher=None):
+		self.__path = repository_path
+		self.__chunk_sizes = tuple(config['chunk_sizes'])
+
+		self.__compression_mode = None
+		self.__compression_level = None
+		self.__compress_fn = None
+		self.__decompress_fn = None
+		if config['compression_mode'] is not None:
+			self.__compression_mode = WBackupMeta.Archive.CompressionMode(config['compression_mode'])
+			self.__compression_level = config['compression_level']
+			self.__compress_fn = WArchiverCompression.block_compress_function(
+				self.__compression_mode, self.__compression_level
+			)
+			self.__decompress_fn = WArchiverCompression.block_decompress_function(self.__compression_mode)
+
+		self.__cipher = cipher
+		self.__chunk_key = None
+		if config['cipher_algorithm'] is not None:
+			if cipher is None:
+				raise ValueError('Repository "%s" is encrypted. Password is required' % repository_path)
+			self.__chunk_key = self.chunk_key(cipher)
+			if hmac.compare_digest(self.key_check(self.__chunk_key), config['key_check']) is False:
+				raise ValueError('Invalid password for repository "%s"' % repository_path)
+		elif cipher is not None:
+			raise ValueError('Repository "%s" is not encrypted' % repository_path)
+
+	def path(self):
+		return self.__path
+
+	def chunk_sizes(self):
+		""" Return minimum, average and maximum chunk sizes
+		"""
+		return self.__chunk_sizes
+
+	def maximum_chunk_size(self):
+		return self.__chunk_sizes[2]
+
+	def compression_mode(self):
+		return self.__compression_mode
+
+	def compression_level(self):
+		return self.__compression_level
+
+	def cipher(self):
+		return self.__cipher
+
+	@classmethod
+	def available(cls):
+		return fastcdc is not None
+
+	@classmethod
+	def check_availability(cls):
+		if cls.available() is False:
+			raise RuntimeError('Deduplicating repositories are unavailable. Python module "fastcdc" is required')
+
+	@classmethod
+	@verify_type(cipher=WBackupCipher)
+	def chunk_key(cls, cipher):
+		""" Return key that chunks are addressed with (HMAC key). It is the HMAC of a distinct label keyed with
+		the secret key, so it does not reveal the key and is not a part of any key stream
+		"""
+		secret = cipher.aes_cipher().mode().pyaes_args()[0]
+		return hmac.new(secret, cls.__chunk_key_label__, cls.__hash_algorithm__.lower()).digest()
+
+	@classmethod
+	@verify_type(cipher=WBackupCipher, nonce=bytes)
+	@verify_value(nonce=lambda x: len(x) == WArchiverRepository.__chunk_nonce_size__)
+	def chunk_cipher(cls, cipher, nonce):
+		""" Return cipher for a single chunk. The repository key is used with the chunk nonce as an
+		initialization vector (CBC mode) or as an initial counter value (CTR mode)
+		"""
+		aes_mode = cipher.aes_cipher().mode()
+		secret = aes_mode.pyaes_args()[0]
+		return WAES(WAESMode(aes_mode.key_size(), aes_mode.mode(), secret + nonce, padding=WZeroPadding()))
+
+	@classmethod
+	def key_check(cls, chunk_key):
+		hash_obj = WArchiverHash.new(cls.__hash_algorithm__)
+		hash_obj.update(chunk_key)
+		return hash_obj.hexdigest()
+
+	@classmethod
+	@verify_type(repository_path=str)
+	def config_path(cls, repository_path):
+		return os.path.join(repository_path, cls.__config_filename__)
+
+	@classmethod
+	@verify_type('paranoid', repository_path=str)
+	def exists(cls, repository_path):
+		return os.path.isfile(cls.config_path(repository_path))
+
+	@classmethod
+	@verify_type('paranoid', repository_path=str)
+	def read_config(cls, repository_path):
+		with open(cls.config_path(repository_path), 'r') as f:
+			config = json.load(f)
+		if isinstance(config, dict) is False or config.get('format') != cls.__repository_format__:
+			raise RuntimeError('Directory "%s" is not a repository' % repository_path)
+		if config.get('version') != cls.__repository_version__:
+			raise RuntimeError('Unsupported repository version: "%s"' % str(config.get('version')))
+		return config
+
+	@classmethod
+	@verify_type(repository_path=str, chunk_size=(int, None), password=(str, None), cipher_name=(str, None))
+	@verify_type('paranoid', compression_mode=(WBackupMeta.Archive.CompressionMode, None))
+	@verify_type('paranoid', compression_level=(int, None))
+	@verify_value(repository_path=lambda x: len(x) > 0, chunk_size=lambda x: x is None or x >= 1024)
+	def create(
+		cls, repository_path, chunk_size=None, compression_mode=None, compression_level=None, password=None,
+		cipher_name=None
+	):
+		""" Create new repository
+
+		:param repository_path: repository directory (it is created if it does not exist)
+		:param chunk_size: average chunk size (minimum and maximum sizes are 1/4 and 4 times of it)
+		:param compression_mode: chunks compression
+		:param compression_level: chunks compression level
+		:param password: password to encrypt chunks with (chunks are not encrypted by default)
+		:param cipher_name: cipher to encrypt chunks with
+
+		:return: WArchiverRepository
+		"""
+		cls.check_availability()
+		if cls.exists(repository_path) is True:
+			raise ValueError('Repository "%s" exists already' % repository_path)
+
+		if chunk_size is None:
+			chunk_size = cls.__default_chunk_size__
+
+		if compression_mode is not None:
+			WArchiverCompression.check_availability(compression_mode)
+			compression_level = WArchiverCompression.compression_level(compression_mode, compression_level)
+		elif compression_level is not None:
+			raise ValueError('Compression level can not be set for uncompressed repository')
+
+		cipher = None
+		config = {
+			'format': cls.__repository_format__,
+			'version': cls.__repository_version__,
+			'chunker': 'fastcdc',
+			'chunk_sizes': [chunk_size // 4, chunk_size, chunk_size * 4],
+			'hash_algorithm': cls.__hash_algorithm__,
+			'compression_mode': compression_mode.value if compression_mode is not None else None,
+			'compression_level': compression_level,
+			'cipher_algorithm': None,
+			'pbkdf2_salt': None,
+			'key_check': None
+		}
+		if password is not None:
+			cipher = WBackupCipher(cipher_name if cipher_name is not None else 'AES-256-CBC', password)
+			config['cipher_algorithm'] = cipher.cipher_name()
+			config['pbkdf2_salt'] = cipher.salt().hex()
+			config['key_check'] = cls.key_check(cls.chunk_key(cipher))
+
+		os.makedirs(os.path.join(repository_path, cls.__chunks_dir__), exist_ok=True)
+		config_path = cls.config_path(repository_path)
+		with open(config_path + '.tmp', 'w') as f:
+			json.dump(config, f)
+		os.replace(config_path + '.tmp', config_path)
+		return WArchiverRepository(repository_path, config, cipher=cipher)
+
+	@classmethod
+	@verify_type('paranoid', repository_path=str, password=(str, None))
+	def open(cls, repository_path, password=None):
+		""" Open existing repository
+
+		:param repository_path: repository directory
+		:param password: password of an encrypted repository
+
+		:return: WArchiverRepository
+		"""
+		cls.check_availability()
+		config = cls.read_config(repository_path)
+
+		cipher = None
+		if password is not None and config['cipher_algorithm'] is not None:
+			cipher = WBackupCipher(
+				config['cipher_algorithm'], password, salt=bytes.fromhex(config['pbkdf2_salt'])
+			)
+		elif password is not None:
+			raise ValueError('Repository "%s" is not encrypted' % repository_path)
+		return WArchiverRepository(repository_path, config, cipher=cipher)
+
+	@verify_type(digest=str)
+	def chunk_path(self, digest):
+		return os.path.join(self.__path, self.__chunks_dir__, digest[:2], digest)
+
+	def chunk_boundaries(self, data, final=True):
+		""" Split data into content-defined chunks. Unless data is final, the last chunks, which boundaries
+		may depend on the following data, are not returned
+
+		:param data: data to split
+		:param final: whether there is no more data
+		:return: list of pairs - chunk offset and chunk size
+		"""
+		minimum_size, average_size, maximum_size = self.__chunk_sizes
+		result = []
+		for chunk in fastcdc.fastcdc(data, min_size=minimum_size, avg_size=average_size, max_size=maximum_size):
+			if final is False and (chunk.offset + maximum_size) > len(data):
+				break
+			result.append((chunk.offset, chunk.length))
+		return result
+
+	def chunk_digest(self, data):
+		if self.__chunk_key is not None:
+			return hmac.new(self.__chunk_key, data, self.__hash_algorithm__.lower()).hexdigest()
+		hash_obj = WArchiverHash.new(self.__hash_algorithm__)
+		hash_obj.update(data)
+		return hash_obj.hexdigest()
+
+	@verify_type(data=bytes)
+	def store_chunk(self, data):
+		""" Save chunk if it is not in the repository yet. This method may be called by several threads at once
+
+		:param data: chunk data
+		:return: tuple of chunk digest, chunk size and number of bytes that were stored (it is 0 if chunk was
+		in the repository already)
+		"""
+		digest = self.chunk_digest(data)
+		chunk_path = self.chunk_path(digest)
+		if os.path.exists(chunk_path) is True:
+			return digest, len(data), 0
+
+		payload = self.__compress_fn(data) if self.__compress_fn is not None else data
+		nonce = bytes(self.__chunk_nonce_size__)
+		if self.__cipher is not None:
+			nonce = os.urandom(self.__chunk_nonce_size__)
+		header = self.__chunk_header__.pack(len(payload), nonce)
+		if self.__cipher is not None:
+			payload = self.chunk_cipher(self.__cipher, nonce).encrypt(payload)
+
+		os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+		temp_path = '%s.%i.tmp' % (chunk_path, threading.get_ident())
+		with open(temp_path, 'wb') as f:
+			f.write(header)
+			f.write(payload)
+		os.replace(temp_path, chunk_path)
+		return digest, len(data), len(header) + len(payload)
+
+	@verify_type(digest=str, chunk_size=int)
+	def load_chunk(self, digest, chunk_size):
+		chunk_path = self.chunk_path(digest)
+		if os.path.exists(chunk_path) is False:
+			raise RuntimeError('Chunk "%s" was not found in repository "%s"' % (digest, self.__path))
+
+		with open(chunk_path, 'rb') as f:
+			chunk = f.read()
+		header_size = self.__chunk_header__.size
+		if len(chunk) < header_size:
+			raise RuntimeError('Chunk "%s" of repository "%s" is corrupted' % (digest, self.__path))
+		payload_size, nonce = self.__chunk_header__.unpack(chunk[:header_size])
+		payload = chunk[header_size:]
+		if self.__cipher is not None:
+			payload = self.chunk_cipher(self.__cipher, nonce).cipher().decrypt(payload)
+		payload = payload[:payload_size]
+
+		try:
+			data = self.__decompress_fn(payload) if self.__decompress_fn is not None else payload
+		except Exception:
+			data = None
+		if data is None or len(data) != chunk_size or self.chunk_digest(data) != digest:
+			raise RuntimeError('Chunk "%s" of repository "%s" is corrupted' % (digest, self.__path))
+		return data
+
+	@verify_type(manifest_path=str, chunks=list)
+	def write_manifest(self, manifest_path, chunks):
+		manifest = {
+			'format': self.__manifest_format__,
+			'version': self.__manifest_version__,
+			'repository': os.path.abspath(self.__path),
+			'archive_size': sum(x[1] for x in chunks),
+			'chunks': chunks
+		}
+		temp_path = manifest_path + '.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(manifest, f)
+		os.replace(temp_path, manifest_path)
+
+	@classmethod
+	@verify_type(archive_path=str)
+	def is_manifest(cls, archive_path):
+		try:
+			with open(archive_path, 'rb') as f:
+				if f.read(1) != b'{':
+					return False  # tar archive starts with a file name
+		except OSError:
+			return False
+		return cls.read_manifest(archive_path) is not None
+
+	@classmethod
+	@verify_type(archive_path=str)
+	def read_manifest(cls, archive_path):
+		with open(archive_path, 'rb') as f:
+			manifest_data = f.read(cls.__maximum_manifest_size__)
+		try:
+			manifest = json.loads(manifest_data.decode())
+		except ValueError:
+			return None
+		if isinstance(manifest, dict) is False or manifest.get('format') != cls.__manifest_format__:
+			return None
+		if manifest.get('version') != cls.__manifest_version__:
+			raise RuntimeError('Unsupported repository manifest version: "%s"' % str(manifest.get('version')))
+		return manifest
+
+	@classmethod
+	@verify_type('paranoid', archive_path=str, password=(str, None))
+	def open_archive(cls, archive_path, password=None):
+		""" Open archive that is stored in a repository for reading
+
+		:param archive_path: archive manifest
+		:param password: password of an encrypted repository
+		:return: file object
+		"""
+		manifest = cls.read_manifest(archive_path)
+		if manifest is None:
+			raise RuntimeError('File "%s" is not a repository manifest' % archive_path)
+		repository = cls.open(manifest['repository'], password=password)
+		return io.BufferedReader(WArchiverRepositoryReader(repository, manifest['chunks']))
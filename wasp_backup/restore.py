@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/restore.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+from wasp_general.command.enhanced import WCommandArgumentDescriptor
+from wasp_general.command.result import WPlainCommandResult
+
+from wasp_backup.command_common import __common_args__, WBackupCommand
+from wasp_backup.restorer import WArchiveRestorer
+
+
+class WRestoreBackupCommand(WBackupCommand):
+
+	__command__ = 'restore'
+	__description__ = 'restore files of a file backup archive (or data of a program backup)'
+
+	__arguments__ = [
+		WCommandArgumentDescriptor(
+			'backup-archive', required=True, multiple_values=False, meta_var='archive_path',
+			help_info='backup file to restore'
+		),
+		WCommandArgumentDescriptor(
+			'restore-to', required=True, multiple_values=False, meta_var='target_path',
+			help_info='directory to restore files to. For program backups this is a file to restore data to ("-" '
+			'means stdout)'
+		),
+		WCommandArgumentDescriptor(
+			'members', multiple_values=True, meta_var='archived_path',
+			help_info='files or directories to restore (directories are restored with their content). All the '
+			'files are restored by default'
+		),
+		WCommandArgumentDescriptor(
+			'io-read-rate', meta_var='maximum reading rate',
+			help_info='use this parameter to limit disk I/O load (bytes per second). You can use '
+			'suffixes like "K" for kibibytes, "M" for mebibytes, "G" for gibibytes, "T" for tebibytes for '
+			'convenience ', casting_helper=WCommandArgumentDescriptor.DataSizeArgumentHelper()
+		),
+		__common_args__['io-burst'],
+		__common_args__['io-schedule'],
+		__common_args__['io-pressure-target'],
+		WCommandArgumentDescriptor(
+			'workers', meta_var='threads_count',
+			help_info='number of threads that write restored files. It is the number of CPUs by default',
+			casting_helper=WCommandArgumentDescriptor.IntegerArgumentCastingHelper(
+				validate_fn=lambda x: x > 0
+			)
+		),
+		WCommandArgumentDescriptor(
+			'no-same-owner', flag_mode=True,
+			help_info='if specified, then file ownership is not restored (by default, it is restored if command is '
+			'run by root)'
+		),
+		WCommandArgumentDescriptor(
+			'password', meta_var='encryption_password',
+			help_info='password of an encrypted archive (or of an encrypted repository)'
+		)
+	]
+
+	def __init__(self, logger):
+		WBackupCommand.__init__(self, logger)
+		self.__restorer = None
+
+	def restorer(self):
+		return self.__restorer
+
+	def _exec(self, command_arguments, **command_env):
+		archive = command_arguments['backup-archive']
+		target_path = command_arguments['restore-to']
+
+		members = None
+		if 'members' in command_arguments.keys():
+			members = list(command_arguments['members'])
+
+		io_read_rate = None
+		if 'io-read-rate' in command_arguments.keys():
+			io_read_rate = int(command_arguments['io-read-rate'])
+		io_burst, io_schedule, io_pressure_target = self._io_throttling(command_arguments)
+
+		workers = None
+		if 'workers' in command_arguments.keys():
+			workers = command_arguments['workers']
+
+		same_owner = None
+		if command_arguments['no-same-owner'] is True:
+			same_owner = False
+
+		password = None
+		if 'password' in command_arguments.keys():
+			password = command_arguments['password']
+
+		try:
+			self.__restorer = WArchiveRestorer(
+				archive, self.logger(), target_path, stop_event=self.stop_event(), io_read_rate=io_read_rate,
+				workers=workers, password=password, same_owner=same_owner, members=members
+			)
+			self.__restorer.set_io_throttling(
+				burst=io_burst, schedule=io_schedule, pressure_target=io_pressure_target
+			)
+			restored_count = self.__restorer.restore()
+		finally:
+			self.__restorer = None
+
+		if restored_count is None:
+			return WPlainCommandResult.error('Restoring of archive "%s" was terminated' % archive)
+		return WPlainCommandResult(
+			'Archive "%s" is restored to "%s" (members restored: %i)' % (archive, target_path, restored_count)
+		)
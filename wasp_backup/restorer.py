@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/restorer.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import os
+import io
+import sys
+import stat
+import shutil
+import pwd
+import grp
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from wasp_general.verify import verify_type, verify_value
+from wasp_general.io import WReaderChainLink, WResponsiveIO
+
+from wasp_backup.core import WBackupMeta
+from wasp_backup.io import WArchiverCompression, WArchiverAESReader, WArchiverThrottlingSource, WExtractorReaderChain
+from wasp_backup.archiver import WBasicArchiveExtractor
+
+
+class WArchiveRestorer(WBasicArchiveExtractor):
+	""" Restores content of an archive. Archive data is read, decrypted and decompressed once (as a stream) and
+	files of an inside tar archive are written by a pool of threads: small files are read ahead (the amount of data
+	that waits for writing is bounded), large files are written while they are read. Ownership, permissions and
+	modification times are restored in bulk after all the files are written (directories are processed the last,
+	the deepest ones first).
+
+	If only some members are restored and the archive allows random access (see
+	:meth:`.WBasicArchiveExtractor.open_inside_data`), then the selected members are found with the member index and
+	the rest of the archive is not read. Data of archives that are not inside tar archives (program backups and
+	single file backups) is written to the target file as is
+	"""
+
+	__read_size__ = 1024 * 1024
+	__small_file_size__ = 1024 * 1024
+	__default_write_ahead_size__ = 64 * 1024 * 1024
+
+	@verify_type('paranoid', archive_path=str, io_read_rate=(float, int, None), password=(str, None))
+	@verify_value('paranoid', archive_path=lambda x: len(x) > 0, io_read_rate=lambda x: x is None or x > 0)
+	@verify_type(target_path=str, workers=(int, None), same_owner=(bool, None), members=(list, tuple, set, None))
+	@verify_value(target_path=lambda x: len(x) > 0, workers=lambda x: x is None or x > 0)
+	def __init__(
+		self, archive_path, logger, target_path, stop_event=None, io_read_rate=None, workers=None, password=None,
+		same_owner=None, members=None
+	):
+		""" Create new restorer
+
+		:param archive_path: archive to restore
+		:param logger: logger to use
+		:param target_path: directory to restore files to (or a file to restore data of a program backup to, "-"
+		means stdout)
+		:param stop_event: event that terminates restoring
+		:param io_read_rate: archive reading rate limit
+		:param workers: number of threads that write files (it is the number of CPUs by default)
+		:param password: password of an encrypted archive (or of an encrypted repository)
+		:param same_owner: whether to restore file ownership (by default, it is restored if the current user is
+		root)
+		:param members: names of members to restore (directories are restored with their content). All the members
+		are restored by default
+		"""
+		WBasicArchiveExtractor.__init__(
+			self, archive_path, logger, stop_event=stop_event, io_read_rate=io_read_rate, password=password
+		)
+		self.__target_path = target_path
+		self.__workers = workers if workers is not None else (os.cpu_count() or 1)
+		self.__same_owner = same_owner if same_owner is not None else (os.geteuid() == 0)
+		self.__members = None
+		if members is not None:
+			self.__members = {x.strip('/') for x in members if len(x.strip('/')) > 0}
+
+		self.__source = None
+		self.__restored_count = 0
+		self.__pending = deque()
+		self.__pending_size = 0
+		self.__written_files = {}
+		self.__attributes = []
+		self.__safe_directories = set()
+		self.__real_target_path = None
+		self.__user_ids = {}
+		self.__group_ids = {}
+
+	def target_path(self):
+		return self.__target_path
+
+	def workers(self):
+		return self.__workers
+
+	def same_owner(self):
+		return self.__same_owner
+
+	def members(self):
+		return self.__members.copy() if self.__members is not None else None
+
+	def restored_count(self):
+		""" Return number of restored members (by the last or by the current restoring)
+
+		:return: int
+		"""
+		return self.__restored_count
+
+	def restore_details(self):
+		if self.__source is not None:
+			return '%s\nMembers restored: %i' % (self.__source.status(), self.__restored_count)
+
+	def open_inside_file(self, inside_file_name, parts_count=None):
+		# inside file is the only data that is read while restoring, so it is throttled
+		self.__source = WArchiverThrottlingSource(
+			WBasicArchiveExtractor.open_inside_file(self, inside_file_name, parts_count=parts_count),
+			read_limit=self.io_throttling(), stop_event=self.stop_event()
+		)
+		return io.BufferedReader(self.__source, buffer_size=self.__read_size__)
+
+	def data_reader_chain(self, meta):
+		""" Return reader chain that reads decrypted and decompressed data of the inside file
+
+		:param meta: archive meta data
+		:return: WExtractorReaderChain
+		"""
+		compression_mode = meta.get(WBackupMeta.Archive.MetaOptions.compression_mode.value)
+		if compression_mode is not None:
+			try:
+				compression_mode = WBackupMeta.Archive.CompressionMode(compression_mode)
+			except ValueError:
+				raise RuntimeError('Unsupported compression mode spotted: "%s"' % compression_mode)
+			WArchiverCompression.check_availability(compression_mode)
+
+		archive_layout = meta.get(
+			WBackupMeta.Archive.MetaOptions.archive_layout.value,
+			WBackupMeta.Archive.Layout.encryption_compression.value
+		)
+		try:
+			archive_layout = WBackupMeta.Archive.Layout(archive_layout)
+		except ValueError:
+			raise RuntimeError('Unsupported archive layout spotted: "%s"' % archive_layout)
+
+		decompression = None
+		if compression_mode is not None:
+			decompression = WReaderChainLink(WArchiverCompression.reader_cls(compression_mode))
+
+		decryption = None
+		cipher = self.archive_cipher(meta)
+		if cipher is not None:
+			data_size = None
+			if archive_layout == WBackupMeta.Archive.Layout.compression_encryption:
+				# size of data before encryption is known for this layout only
+				data_size = meta.get(
+					WBackupMeta.Archive.MetaOptions.compressed_archive_size.value
+					if compression_mode is not None else
+					WBackupMeta.Archive.MetaOptions.uncompressed_archive_size.value
+				)
+			decryption = WReaderChainLink(WArchiverAESReader, cipher.aes_cipher(), data_size=data_size)
+
+		if archive_layout == WBackupMeta.Archive.Layout.compression_encryption:
+			links = [decryption, decompression]
+		else:
+			links = [decompression, decryption]
+
+		inside_file = self.open_inside_file(
+			meta[WBackupMeta.Archive.MetaOptions.inside_filename.value],
+			parts_count=meta.get(WBackupMeta.Archive.MetaOptions.inside_file_parts.value)
+		)
+		return WExtractorReaderChain(inside_file, *[x for x in links if x is not None])
+
+	def restore(self):
+		""" Restore archive content. None is returned if restoring was terminated
+
+		:return: number of restored members (or None)
+		"""
+		self.__restored_count = 0
+		try:
+			meta = self.read_meta()
+			if meta.get(WBackupMeta.Archive.MetaOptions.inside_tar.value) is True:
+				self.__restore_files(meta)
+			else:
+				self.__restore_data(meta)
+			return self.__restored_count
+		except WResponsiveIO.IOTerminated:
+			self.logger().error('Unable to restore archive "%s" - task terminated' % self.archive_path())
+			return
+		finally:
+			self.__source = None
+			self.__pending.clear()
+			self.__pending_size = 0
+			self.__written_files.clear()
+			self.__attributes.clear()
+			self.__safe_directories.clear()
+
+	def __restore_data(self, meta):
+		target_path = self.target_path()
+		if target_path == WBackupMeta.Archive.__stdout_path__:
+			target = open(sys.stdout.fileno(), mode='wb', closefd=False)
+		else:
+			if os.path.isdir(target_path) is True:
+				archived_file = meta.get(WBackupMeta.Archive.MetaOptions.archived_files.value)
+				target_path = os.path.join(
+					target_path, os.path.basename(archived_file) if archived_file else
+					WBackupMeta.Archive.__basic_inside_file_name__
+				)
+			target = open(target_path, mode='wb')
+
+		reader_chain = self.data_reader_chain(meta)
+		try:
+			with target:
+				# chain links must be read directly, so that every link could process data
+				reader = reader_chain.first_io()
+				data = reader.read(self.__read_size__)
+				while len(data) > 0:
+					target.write(data)
+					data = reader.read(self.__read_size__)
+		finally:
+			reader_chain.close()
+		self.__restored_count = 1
+
+	def __restore_files(self, meta):
+		# the member index is decoded before anything is written, so that a wrong password is reported clearly
+		member_index = self.member_index(meta)
+		os.makedirs(self.target_path(), exist_ok=True)
+		self.__real_target_path = os.path.realpath(self.target_path())
+		with ThreadPoolExecutor(max_workers=self.workers()) as executor:
+			if self.__members is None or self.__restore_selected(executor, meta, member_index) is False:
+				reader_chain = self.data_reader_chain(meta)
+				try:
+					tar_archive = tarfile.open(fileobj=reader_chain.first_io(), mode='r|')
+					for tar_info in tar_archive:
+						if self.__is_selected(tar_info.name) is True:
+							self.__restore_member(executor, tar_archive, tar_info)
+				finally:
+					reader_chain.close()
+
+			self.__wait_pending(0)
+			self.__restore_attributes(executor)
+
+		if self.__members is not None and self.__restored_count == 0:
+			raise RuntimeError('Requested files were not found in archive "%s"' % self.archive_path())
+
+	def __restore_selected(self, executor, meta, member_index):
+		# only the selected members are read. False is returned if archive does not allow this
+		if member_index is None:
+			return False
+		inside_data = self.open_inside_data(meta)
+		if inside_data is None:
+			return False
+
+		with inside_data:
+			for entry in member_index.entries():
+				if self.__is_selected(entry.name) is False:
+					continue
+				inside_data.seek(entry.offset)
+				tar_archive = tarfile.open(fileobj=inside_data, mode='r:')
+				tar_info = tar_archive.next()
+				if tar_info is None or tar_info.name != entry.name:
+					raise RuntimeError('Archive "%s" is corrupted - member index mismatch' % self.archive_path())
+				self.__restore_member(executor, tar_archive, tar_info)
+		return True
+
+	def __is_selected(self, name):
+		if self.__members is None:
+			return True
+		name = name.strip('/')
+		path = name
+		while len(path) > 0:
+			if path in self.__members:
+				return True
+			path = os.path.dirname(path)
+		return False
+
+	def __restore_member(self, executor, tar_archive, tar_info):
+		path = self.__target(tar_info.name)
+		if path is None:
+			self.logger().warning('Archive member "%s" is skipped - unsafe path' % tar_info.name)
+			return
+
+		# a file that is written in background must be written before the path is replaced
+		written_file = self.__written_files.pop(path, None)
+		if written_file is not None:
+			written_file.result()
+
+		if tar_info.isdir():
+			# a symbolic link that was restored before must not redirect the directory (and its attributes)
+			self.__remove_existing(path)
+			os.makedirs(path, exist_ok=True)
+		else:
+			if os.path.islink(path) is False and os.path.isdir(path) is True:
+				# the path was a directory in a previous archive (or member) and it is not a directory now
+				self.__remove_directory(path)
+			self.__remove_existing(path)
+			if tar_info.isreg():
+				member_data = tar_archive.extractfile(tar_info)
+				if tar_info.size <= self.__small_file_size__:
+					data = member_data.read(tar_info.size)
+					if len(data) != tar_info.size:
+						raise RuntimeError('Archive "%s" is truncated' % self.archive_path())
+					self.__wait_pending(self.__default_write_ahead_size__ - len(data))
+					future = executor.submit(self.__write_file, path, data)
+					self.__pending.append((len(data), future))
+					self.__pending_size += len(data)
+					self.__written_files[path] = future
+				else:
+					self.__write_file(path, member_data)
+					self.__written_files[path] = None
+			elif tar_info.issym():
+				os.symlink(tar_info.linkname, path)
+				self.__safe_directories.clear()
+			elif tar_info.islnk():
+				link_target = self.__target(tar_info.linkname)
+				if link_target is None or link_target not in self.__written_files:
+					self.logger().warning(
+						'Hard link "%s" is skipped - its target "%s" was not restored' %
+						(tar_info.name, tar_info.linkname)
+					)
+					return
+				future = self.__written_files[link_target]
+				if future is not None:
+					future.result()
+				os.link(link_target, path)
+			elif tar_info.isfifo():
+				os.mkfifo(path)
+			elif tar_info.ischr() or tar_info.isblk():
+				if os.geteuid() != 0:
+					self.logger().warning('Device "%s" is skipped - root privileges are required' % tar_info.name)
+					return
+				device_type = stat.S_IFCHR if tar_info.ischr() else stat.S_IFBLK
+				os.mknod(
+					path, (tar_info.mode & 0o7777) | device_type, os.makedev(tar_info.devmajor, tar_info.devminor)
+				)
+			else:
+				self.logger().warning('Archive member "%s" is skipped - unsupported type' % tar_info.name)
+				return
+
+		self.__attributes.append((path, tar_info))
+		self.__restored_count += 1
+
+	def __target(self, name):
+		# returns path to restore a member to or None if the path is outside of the target directory
+		name = name.lstrip('/')
+		if len(name) == 0 or '..' in name.split('/'):
+			return None
+		target_path = self.__real_target_path
+		path = os.path.join(target_path, *name.split('/'))
+		parent = os.path.dirname(path)
+		if parent not in self.__safe_directories:
+			# restored symbolic links must not redirect files out of the target directory
+			real_parent = os.path.realpath(parent)
+			if real_parent != target_path and real_parent.startswith(os.path.join(target_path, '')) is False:
+				return None
+			os.makedirs(parent, exist_ok=True)
+			self.__safe_directories.add(parent)
+		return path
+
+	def __remove_directory(self, path):
+		# removes directory that was restored before with its content
+		self.__wait_pending(0)
+		prefix = os.path.join(path, '')
+		self.__attributes = [x for x in self.__attributes if x[0] != path and x[0].startswith(prefix) is False]
+		for written_file in [x for x in self.__written_files.keys() if x.startswith(prefix) is True]:
+			del self.__written_files[written_file]
+		shutil.rmtree(path)
+		self.__safe_directories.clear()
+
+	@classmethod
+	def __remove_existing(cls, path):
+		if os.path.islink(path) is True or (os.path.lexists(path) is True and os.path.isdir(path) is False):
+			os.unlink(path)
+
+	@classmethod
+	def __write_file(cls, path, data):
+		with open(path, mode='wb') as f:
+			if isinstance(data, bytes) is True:
+				f.write(data)
+			else:
+				chunk = data.read(cls.__read_size__)
+				while len(chunk) > 0:
+					f.write(chunk)
+					chunk = data.read(cls.__read_size__)
+
+	def __wait_pending(self, pending_limit):
+		while len(self.__pending) > 0 and self.__pending_size > pending_limit:
+			size, future = self.__pending.popleft()
+			self.__pending_size -= size
+			future.result()
+
+	def __restore_attributes(self, executor):
+		files = [x for x in self.__attributes if x[1].isdir() is False]
+		for _ in executor.map(self.__restore_member_attributes, files):
+			pass
+
+		# directories are processed the last (their content is modified before) and the deepest ones go first,
+		# so that restricted permissions would not prevent access to the nested directories
+		directories = {}
+		for path, tar_info in self.__attributes:
+			if tar_info.isdir() is True:
+				directories.setdefault(path.count(os.sep), []).append((path, tar_info))
+		for depth in sorted(directories.keys(), reverse=True):
+			for _ in executor.map(self.__restore_member_attributes, directories[depth]):
+				pass
+
+	def __restore_member_attributes(self, attributes):
+		path, tar_info = attributes
+		try:
+			if self.same_owner() is True:
+				os.chown(path, self.__user_id(tar_info), self.__group_id(tar_info), follow_symlinks=False)
+			if os.path.islink(path) is False:  # member may be replaced by a symbolic link later
+				os.chmod(path, tar_info.mode & 0o7777)
+			os.utime(path, (tar_info.mtime, tar_info.mtime), follow_symlinks=False)
+		except OSError as e:
+			self.logger().warning('Unable to restore attributes of "%s": %s' % (path, str(e)))
+
+	def __user_id(self, tar_info):
+		if tar_info.uname not in self.__user_ids:
+			try:
+				self.__user_ids[tar_info.uname] = pwd.getpwnam(tar_info.uname).pw_uid if tar_info.uname else None
+			except KeyError:
+				self.__user_ids[tar_info.uname] = None
+		user_id = self.__user_ids[tar_info.uname]
+		return user_id if user_id is not None else tar_info.uid
+
+	def __group_id(self, tar_info):
+		if tar_info.gname not in self.__group_ids:
+			try:
+				self.__group_ids[tar_info.gname] = grp.getgrnam(tar_info.gname).gr_gid if tar_info.gname else None
+			except KeyError:
+				self.__group_ids[tar_info.gname] = None
+		group_id = self.__group_ids[tar_info.gname]
+		return group_id if group_id is not None else tar_info.gid
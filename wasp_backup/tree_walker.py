@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+# wasp_backup/tree_walker.py
+#
+# Copyright (C) 2017 the wasp-backup authors and contributors
+# <see AUTHORS file>
+#
+# This file is part of wasp-backup.
+#
+# wasp-backup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wasp-backup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with wasp-backup.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: document the code
+# TODO: write tests for the code
+
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __author__, __version__, __credits__, __license__, __copyright__, __email__
+# noinspection PyUnresolvedReferences
+from wasp_backup.version import __status__
+
+import os
+import io
+import stat
+import pwd
+import grp
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from wasp_general.verify import verify_type, verify_value
+
+from wasp_backup.io import WArchiverHash
+from wasp_backup.digest_cache import WArchiverDigestCache
+
+
+class WArchiverTreeWalker:
+	""" Adds files to a tar archive like "tarfile.TarFile.add" does (members are added in the same order and
+	with the same headers), but directories are listed, files are stat'ed and small files are read by a pool of
+	threads ahead of the tar serialization. The amount of prefetched data is bounded by the "read_ahead_size" value.
+
+	If a hash algorithm is set, then digests of archived regular files are calculated (small files are hashed by
+	the same threads that read them, large files are hashed while they are archived). Digests of untouched files
+	are taken from the digest cache if it is set
+	"""
+
+	__default_read_ahead_size__ = 64 * 1024 * 1024
+	__default_read_ahead_entries__ = 4096
+	__default_prefetch_directories__ = 1024
+	__small_file_size__ = 1024 * 1024
+
+	class Entry:
+
+		def __init__(self, path, stat_result):
+			self.path = path
+			self.stat = stat_result
+
+		def is_small_file(self):
+			return stat.S_ISREG(self.stat.st_mode) and self.stat.st_size <= WArchiverTreeWalker.__small_file_size__
+
+		def prefetch_size(self):
+			return self.stat.st_size if self.is_small_file() is True else 0
+
+	class HashingReader:
+
+		def __init__(self, raw, hash_algorithm):
+			self.__raw = raw
+			self.__hash = WArchiverHash.new(hash_algorithm)
+
+		def read(self, size=-1):
+			result = self.__raw.read(size)
+			self.__hash.update(result)
+			return result
+
+		def hexdigest(self):
+			return self.__hash.hexdigest().upper()
+
+	@verify_type(tar_archive=tarfile.TarFile, workers=int, read_ahead_size=(int, None))
+	@verify_type(hash_algorithm=(str, None), digest_cache=(WArchiverDigestCache, None))
+	@verify_value(workers=lambda x: x > 0, read_ahead_size=lambda x: x is None or x > 0)
+	@verify_value(hash_algorithm=lambda x: x is None or WArchiverHash.available(x))
+	def __init__(self, tar_archive, workers, read_ahead_size=None, hash_algorithm=None, digest_cache=None):
+		self.__tar_archive = tar_archive
+		self.__workers = workers
+		self.__read_ahead_size = \
+			read_ahead_size if read_ahead_size is not None else self.__default_read_ahead_size__
+		self.__hash_algorithm = hash_algorithm.upper() if hash_algorithm is not None else None
+		self.__digest_cache = digest_cache
+		self.__digests = {}
+		self.__user_names = {}
+		self.__group_names = {}
+
+	def tar_archive(self):
+		return self.__tar_archive
+
+	def workers(self):
+		return self.__workers
+
+	def read_ahead_size(self):
+		return self.__read_ahead_size
+
+	def hash_algorithm(self):
+		return self.__hash_algorithm
+
+	def digest_cache(self):
+		return self.__digest_cache
+
+	def digests(self):
+		""" Return digests of archived regular files (archive names are keys)
+
+		:return: dict
+		"""
+		return self.__digests
+
+	@verify_type(path=str)
+	def add(self, path, filter=None, entry_filter=None):
+		""" Add file or directory (recursively) to the archive
+
+		:param path: path to add
+		:param filter: the same as the "filter" argument of the "tarfile.TarFile.add" method
+		:param entry_filter: function that is called with every found entry (:class:`.WArchiverTreeWalker.Entry`)
+		before it is read. If it returns False, then the entry is not archived (unlike the "filter" function,
+		content of a skipped directory is walked anyway)
+
+		:return: None
+		"""
+		pending = deque()
+		pending_size = 0
+		skipped_prefix = None
+
+		with ThreadPoolExecutor(max_workers=self.workers()) as executor:
+			for entry in self.__walk(executor, path):
+				if entry_filter is not None and entry_filter(entry) is False:
+					continue
+				pending.append((entry, executor.submit(self.__prefetch, entry)))
+				pending_size += entry.prefetch_size()
+
+				while len(pending) > self.__default_read_ahead_entries__ or pending_size > self.read_ahead_size():
+					next_entry, prefetched = pending.popleft()
+					pending_size -= next_entry.prefetch_size()
+					skipped_prefix = self.__add_entry(next_entry, prefetched, filter, skipped_prefix)
+
+			while len(pending) > 0:
+				next_entry, prefetched = pending.popleft()
+				skipped_prefix = self.__add_entry(next_entry, prefetched, filter, skipped_prefix)
+
+	def __add_entry(self, entry, prefetched, filter_fn, skipped_prefix):
+		# returns prefix of paths that must be skipped (a content of an excluded directory)
+		if skipped_prefix is not None:
+			if entry.path.startswith(skipped_prefix) is True:
+				return skipped_prefix
+			skipped_prefix = None
+
+		tar_archive = self.tar_archive()
+		link_target, data, digest = prefetched.result()
+
+		if tar_archive.name is not None and os.path.abspath(entry.path) == tar_archive.name:
+			return skipped_prefix
+
+		tar_info = self.tar_info(entry, link_target)
+		if tar_info is None:
+			return skipped_prefix
+
+		if filter_fn is not None:
+			tar_info = filter_fn(tar_info)
+			if tar_info is None:
+				if stat.S_ISDIR(entry.stat.st_mode):
+					return os.path.join(entry.path, '')
+				return skipped_prefix
+
+		if tar_info.isreg():
+			if data is not None:
+				tar_archive.addfile(tar_info, io.BytesIO(data))
+			elif self.__hash_algorithm is not None and digest is None:
+				with open(entry.path, 'rb') as f:
+					reader = WArchiverTreeWalker.HashingReader(f, self.__hash_algorithm)
+					tar_archive.addfile(tar_info, reader)
+				digest = reader.hexdigest()
+				if self.__digest_cache is not None:
+					self.__digest_cache.set(entry.stat, self.__hash_algorithm, digest)
+			else:
+				with open(entry.path, 'rb') as f:
+					tar_archive.addfile(tar_info, f)
+			if digest is not None:
+				self.__digests[tar_info.name] = digest
+		else:
+			tar_archive.addfile(tar_info)
+		return skipped_prefix
+
+	def tar_info(self, entry, link_target):
+		""" Return TarInfo object for the given entry. This is the same as the "tarfile.TarFile.gettarinfo"
+		method does, but the previously fetched stat result is used
+		"""
+		tar_archive = self.tar_archive()
+
+		arc_name = os.path.splitdrive(entry.path)[1].replace(os.sep, '/').lstrip('/')
+		stat_result = entry.stat
+		st_mode = stat_result.st_mode
+
+		tar_info = tar_archive.tarinfo()
+		tar_info.tarfile = tar_archive
+
+		link_name = ''
+		if stat.S_ISREG(st_mode):
+			inode = (stat_result.st_ino, stat_result.st_dev)
+			if tar_archive.dereference is False and stat_result.st_nlink > 1 and \
+				inode in tar_archive.inodes and arc_name != tar_archive.inodes[inode]:
+				tar_type = tarfile.LNKTYPE
+				link_name = tar_archive.inodes[inode]
+			else:
+				tar_type = tarfile.REGTYPE
+				if inode[0]:
+					tar_archive.inodes[inode] = arc_name
+		elif stat.S_ISDIR(st_mode):
+			tar_type = tarfile.DIRTYPE
+		elif stat.S_ISFIFO(st_mode):
+			tar_type = tarfile.FIFOTYPE
+		elif stat.S_ISLNK(st_mode):
+			tar_type = tarfile.SYMTYPE
+			link_name = link_target
+		elif stat.S_ISCHR(st_mode):
+			tar_type = tarfile.CHRTYPE
+		elif stat.S_ISBLK(st_mode):
+			tar_type = tarfile.BLKTYPE
+		else:
+			return None
+
+		tar_info.name = arc_name
+		tar_info.mode = st_mode
+		tar_info.uid = stat_result.st_uid
+		tar_info.gid = stat_result.st_gid
+		tar_info.size = stat_result.st_size if tar_type == tarfile.REGTYPE else 0
+		tar_info.mtime = stat_result.st_mtime
+		tar_info.type = tar_type
+		tar_info.linkname = link_name
+		tar_info.uname = self.__user_name(tar_info.uid)
+		tar_info.gname = self.__group_name(tar_info.gid)
+		if tar_type in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+			tar_info.devmajor = os.major(stat_result.st_rdev)
+			tar_info.devminor = os.minor(stat_result.st_rdev)
+		return tar_info
+
+	def __user_name(self, uid):
+		if uid not in self.__user_names:
+			try:
+				self.__user_names[uid] = pwd.getpwuid(uid).pw_name
+			except KeyError:
+				self.__user_names[uid] = ''
+		return self.__user_names[uid]
+
+	def __group_name(self, gid):
+		if gid not in self.__group_names:
+			try:
+				self.__group_names[gid] = grp.getgrgid(gid).gr_name
+			except KeyError:
+				self.__group_names[gid] = ''
+		return self.__group_names[gid]
+
+	def __walk(self, executor, path):
+		# entries are returned in the same order as "tarfile.TarFile.add" adds them
+		root_entry = WArchiverTreeWalker.Entry(path, os.lstat(path))
+		yield root_entry
+		if stat.S_ISDIR(root_entry.stat.st_mode):
+			yield from self.__walk_directory(executor, path, {})
+
+	def __walk_directory(self, executor, path, listings):
+		listing = listings.pop(path, None)
+		entries = listing.result() if listing is not None else self.__list_directory(path)
+
+		# subdirectories are listed while files of the current directory are processed
+		for entry in entries:
+			if stat.S_ISDIR(entry.stat.st_mode) and len(listings) < self.__default_prefetch_directories__:
+				listings[entry.path] = executor.submit(self.__list_directory, entry.path)
+
+		for entry in entries:
+			yield entry
+			if stat.S_ISDIR(entry.stat.st_mode):
+				yield from self.__walk_directory(executor, entry.path, listings)
+
+	@classmethod
+	def __list_directory(cls, path):
+		with os.scandir(path) as directory:
+			return [
+				WArchiverTreeWalker.Entry(x.path, x.stat(follow_symlinks=False))
+				for x in sorted(directory, key=lambda x: x.name)
+			]
+
+	def __prefetch(self, entry):
+		# returns a symbolic link target, a content of a small file and a digest of a regular file
+		st_mode = entry.stat.st_mode
+		if stat.S_ISLNK(st_mode):
+			return os.readlink(entry.path), None, None
+		if stat.S_ISREG(st_mode) is False:
+			return None, None, None
+
+		digest = None
+		if self.__hash_algorithm is not None and self.__digest_cache is not None:
+			digest = self.__digest_cache.get(entry.stat, self.__hash_algorithm)
+
+		with open(entry.path, 'rb') as f:
+			if entry.is_small_file() is True:
+				data = f.read(entry.stat.st_size)
+				if self.__hash_algorithm is not None and digest is None:
+					hash_obj = WArchiverHash.new(self.__hash_algorithm)
+					hash_obj.update(data)
+					digest = hash_obj.hexdigest().upper()
+					if self.__digest_cache is not None:
+						self.__digest_cache.set(entry.stat, self.__hash_algorithm, digest)
+				return None, data, digest
+			if hasattr(os, 'posix_fadvise') is True:
+				# large files are not read, but the kernel is asked to read them ahead
+				os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+		return None, None, digest